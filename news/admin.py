@@ -1,10 +1,14 @@
 from django.contrib import admin, messages
+from django.core.cache import cache
 
-from .models import APIUser, FailedTask, Newsletter, Subscriber
+from .models import (APIUser, FailedTask, Newsletter, OutboxEntry,
+                     Subscriber, TaskError)
+from .tasks import (RETRY_PROGRESS_KEY, retry_failed_tasks_task,
+                    validate_message_ids)
 
 
 class APIUserAdmin(admin.ModelAdmin):
-    list_display = ('name', 'enabled')
+    list_display = ('name', 'enabled', 'requests', 'last_used')
 
 
 admin.site.register(APIUser, APIUserAdmin)
@@ -32,6 +36,11 @@ class NewsletterAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("title",)}
     search_fields = ('title', 'slug', 'description', 'vendor_id')
 
+    def save_model(self, request, obj, form, change):
+        super(NewsletterAdmin, self).save_model(request, obj, form, change)
+        # Check its message IDs exist in ET before anyone is sent them
+        validate_message_ids.delay([obj.pk])
+
 
 admin.site.register(Newsletter, NewsletterAdmin)
 
@@ -42,11 +51,34 @@ class FailedTaskAdmin(admin.ModelAdmin):
 
     def retry_task_action(self, request, queryset):
         """Admin action to retry some tasks that have failed previously"""
-        count = 0
-        for old_task in queryset:
-            old_task.retry()
-            count += 1
-        messages.info(request, "Queued %d task%s to try again" % (count, '' if count == 1 else 's'))
+        ids = list(queryset.values_list('pk', flat=True))
+        retry_failed_tasks_task.delay(ids)
+        count = len(ids)
+        messages.info(request, "Retrying %d task%s in the background" % (count, '' if count == 1 else 's'))
     retry_task_action.short_description = u"Retry task(s)"
 
+    def changelist_view(self, request, extra_context=None):
+        counts = cache.get(RETRY_PROGRESS_KEY)
+        if counts and counts['done'] < counts['total']:
+            messages.info(request, "Retrying failed tasks: %(done)d of %(total)d done, "
+                                   "%(queued)d queued, %(duplicates)d duplicates" % counts)
+        return super(FailedTaskAdmin, self).changelist_view(request, extra_context)
+
 admin.site.register(FailedTask, FailedTaskAdmin)
+
+
+class TaskErrorAdmin(admin.ModelAdmin):
+    list_display = ('when', 'signature')
+    readonly_fields = ('signature', 'einfo')
+    fields = ('signature', 'einfo')
+
+
+admin.site.register(TaskError, TaskErrorAdmin)
+
+
+class OutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('when', 'kind', 'target', 'done_at', 'attempts', 'error')
+    list_filter = ('kind', 'target')
+
+
+admin.site.register(OutboxEntry, OutboxEntryAdmin)
@@ -98,32 +98,39 @@ def handle_fault(e):
     raise NewsletterException(str(e))
 
 
+def get_client(user, pass_):
+    """Return the suds client for ET, building it from the cached WSDL
+    the first time. The same client is used from then on."""
+    # Try to re-use existing client instance.
+    client = getattr(logged_in, 'cached_client', None)
+    if not client:
+        # Monkey-patch suds because it always initializes an ObjectCache
+        # before looking at the cache you told it to use, and that tries
+        # to use the same subdir under /tmp even if it already exists
+        # and is owned by another user.
+        # While we're at it, use Django caching instead of temp files.
+        import suds.client
+        suds.client.ObjectCache = SudsDjangoCache
+
+        client = Client(WSDL_URL)
+
+        security = Security()
+        token = UsernameToken(user, pass_)
+        security.tokens.append(token)
+        client.set_options(wsse=security)
+
+        # Save client instance and just re-use it next time.
+        setattr(logged_in, 'cached_client', client)
+    return client
+
+
 def logged_in(f):
     """ Decorator to ensure the request will be authenticated """
 
     @wraps(f)
     def wrapper(inst, *args, **kwargs):
         if not inst.client:
-            # Try to re-use existing client instance.
-            inst.client = getattr(logged_in, 'cached_client', None)
-        if not inst.client:
-            # Monkey-patch suds because it always initializes an ObjectCache
-            # before looking at the cache you told it to use, and that tries
-            # to use the same subdir under /tmp even if it already exists
-            # and is owned by another user.
-            # While we're at it, use Django caching instead of temp files.
-            import suds.client
-            suds.client.ObjectCache = SudsDjangoCache
-
-            inst.client = Client(WSDL_URL)
-
-            security = Security()
-            token = UsernameToken(inst.user, inst.pass_)
-            security.tokens.append(token)
-            inst.client.set_options(wsse=security)
-
-            # Save client instance and just re-use it next time.
-            setattr(logged_in, 'cached_client', inst.client)
+            inst.client = get_client(inst.user, inst.pass_)
         return f(inst, *args, **kwargs)
     return wrapper
 
@@ -296,6 +303,43 @@ class ExactTargetDataExt(ExactTargetObject):
         except WebFault, e:
             handle_fault(e)
 
+    @logged_in
+    def add_records(self, data_id, records):
+        """
+        Add or update several records in data extension ``data_id`` with
+        one call. ``records`` is a list of dictionaries mapping field
+        names to values; they don't all need to have the same fields.
+        """
+        objs = []
+        for record in records:
+            obj = self.create('DataExtensionObject')
+            props = []
+
+            for name, value in record.items():
+                prop = self.create('APIProperty')
+                prop.Name = name
+                prop.Value = value
+
+                props.append(prop)
+
+            obj.Properties.Property = props
+            obj.CustomerKey = data_id
+            objs.append(obj)
+
+        opt = self.create('SaveOption')
+        opt.PropertyName = '*'
+        opt.SaveAction = 'UpdateAdd'
+
+        self.create('RequestType')
+        opts = self.create('UpdateOptions')
+        opts.SaveOptions.SaveOption = [opt]
+
+        try:
+            obj = self.client.service.Update(opts, objs)
+            assert_status(obj)
+        except WebFault, e:
+            handle_fault(e)
+
     @logged_in
     def get_record(self, data_id, token, fields, field='TOKEN'):
         req = self.create('RetrieveRequest')
@@ -324,6 +368,41 @@ class ExactTargetDataExt(ExactTargetObject):
         return dict((p.Name, p.Value)
                     for p in obj.Results[0].Properties.Property)
 
+    @logged_in
+    def get_records(self, data_id, values, fields, field='TOKEN'):
+        """
+        Like get_record, but looks up all the records whose ``field`` is
+        one of ``values`` with one call. Returns a list of dictionaries,
+        which is empty if none were found. Callers should keep
+        ``values`` to fewer than ET's page size (2500).
+        """
+        req = self.create('RetrieveRequest')
+        req.ObjectType = 'DataExtensionObject[%s]' % data_id
+        req.Properties = fields
+
+        filter_ = self.create('SimpleFilterPart')
+        filter_.Property = field
+        if len(values) == 1:
+            filter_.SimpleOperator = 'equals'
+            filter_.Value = values[0]
+        else:
+            filter_.SimpleOperator = 'IN'
+            filter_.Value = list(values)
+        req.Filter = filter_
+
+        del req.Options
+
+        try:
+            obj = self.client.service.Retrieve(req)
+            assert_status(obj)
+        except WebFault, e:
+            handle_fault(e)
+
+        if not hasattr(obj, 'Results'):
+            return []
+        return [dict((p.Name, p.Value) for p in result.Properties.Property)
+                for result in obj.Results]
+
     @logged_in
     def delete_record(self, data_id, token):
         """
@@ -406,6 +485,38 @@ class ExactTarget(ExactTargetObject):
         except WebFault, e:
             handle_fault(e)
 
+    @logged_in
+    def get_triggered_send_keys(self, keys):
+        """
+        Return the set of ``keys`` that are the customer keys of triggered
+        send definitions in ET, with one call.
+        """
+        req = self.create('RetrieveRequest')
+        req.ObjectType = 'TriggeredSendDefinition'
+        req.Properties = ['CustomerKey']
+
+        filter_ = self.create('SimpleFilterPart')
+        filter_.Property = 'CustomerKey'
+        if len(keys) == 1:
+            filter_.SimpleOperator = 'equals'
+            filter_.Value = keys[0]
+        else:
+            filter_.SimpleOperator = 'IN'
+            filter_.Value = list(keys)
+        req.Filter = filter_
+
+        del req.Options
+
+        try:
+            obj = self.client.service.Retrieve(req)
+            assert_status(obj)
+        except WebFault, e:
+            handle_fault(e)
+
+        if not hasattr(obj, 'Results'):
+            return set()
+        return set(result.CustomerKey for result in obj.Results)
+
     @logged_in
     def trigger_send_sms(self, send_name, mobile_number):
         send = self.create('SMSTriggeredSend')
@@ -0,0 +1,57 @@
+"""
+Exporting basket's email to token mapping.
+
+The Subscriber table is read in order of email (its primary key), a
+chunk at a time, each chunk starting after the last email of the one
+before, so an export of millions of rows runs in constant memory and
+with no big OFFSETs. The rows come out as newline-delimited JSON, one
+``{"email": "...", "token": "..."}`` per line. To carry on with an
+export that was cut off, start again after the last email it got.
+"""
+from django.conf import settings
+
+from .models import PendingPromotion, Subscriber
+from .responses import dumps
+
+
+def subscriber_rows(after=None, chunk_size=None, with_pending=False):
+    """Yield a dict for each Subscriber, in order of email.
+
+    :param after: Only yield subscribers whose emails sort after this
+    :param chunk_size: How many rows to read at a time
+        (default settings.SUBSCRIBER_EXPORT_CHUNK_SIZE)
+    :param with_pending: Also say in each row whether the subscriber is
+        waiting to be promoted to Master (see news.promotion)
+    """
+    chunk_size = chunk_size or settings.SUBSCRIBER_EXPORT_CHUNK_SIZE
+    subscribers = Subscriber.objects.order_by('email')
+    while True:
+        if after is not None:
+            chunk = subscribers.filter(email__gt=after)
+        else:
+            chunk = subscribers
+        chunk = list(chunk.values_list('email', 'token')[:chunk_size])
+        if not chunk:
+            return
+        if with_pending:
+            pending = set(PendingPromotion.objects.filter(
+                token__in=[token for email, token in chunk],
+            ).values_list('token', flat=True))
+        for email, token in chunk:
+            row = {'email': email, 'token': token}
+            if with_pending:
+                row['pending_promotion'] = token in pending
+            yield row
+        after = chunk[-1][0]
+
+
+def ndjson(rows, lines_per_chunk=100):
+    """Yield ``rows`` as newline-delimited JSON, a few lines at a time"""
+    lines = []
+    for row in rows:
+        lines.append(dumps(row))
+        if len(lines) >= lines_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
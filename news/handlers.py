@@ -0,0 +1,73 @@
+"""
+WSGI handlers that run less middleware for the news API.
+
+The API views don't use sessions, users, messages or CSRF, so requests
+under settings.API_PATH_PREFIX are handled with just the middleware in
+settings.API_MIDDLEWARE_CLASSES. Everything else, like the admin, gets
+the full settings.MIDDLEWARE_CLASSES. wsgi/basket.wsgi serves
+``application()``.
+"""
+from django.conf import settings
+from django.core import exceptions
+from django.core.handlers.wsgi import WSGIHandler
+from django.utils.importlib import import_module
+
+
+class MiddlewareHandler(WSGIHandler):
+    """A WSGIHandler that runs the given middleware instead of
+    settings.MIDDLEWARE_CLASSES"""
+
+    def __init__(self, middleware_classes):
+        super(MiddlewareHandler, self).__init__()
+        self.middleware_classes = middleware_classes
+
+    def load_middleware(self):
+        # Like BaseHandler.load_middleware, with our own list
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._response_middleware = []
+        self._exception_middleware = []
+        request_middleware = []
+        for middleware_path in self.middleware_classes:
+            module, classname = middleware_path.rsplit('.', 1)
+            try:
+                middleware = getattr(import_module(module), classname)()
+            except exceptions.MiddlewareNotUsed:
+                continue
+            if hasattr(middleware, 'process_request'):
+                request_middleware.append(middleware.process_request)
+            if hasattr(middleware, 'process_view'):
+                self._view_middleware.append(middleware.process_view)
+            if hasattr(middleware, 'process_template_response'):
+                self._template_response_middleware.insert(
+                    0, middleware.process_template_response)
+            if hasattr(middleware, 'process_response'):
+                self._response_middleware.insert(
+                    0, middleware.process_response)
+            if hasattr(middleware, 'process_exception'):
+                self._exception_middleware.insert(
+                    0, middleware.process_exception)
+        # Set last, since it's how the handler knows it's loaded
+        self._request_middleware = request_middleware
+
+
+class PrefixRouter(object):
+    """WSGI application that sends requests for the news API to a
+    handler with the lean middleware, and the rest to the usual one"""
+
+    def __init__(self):
+        self.prefix = settings.API_PATH_PREFIX
+        self.api = MiddlewareHandler(settings.API_MIDDLEWARE_CLASSES)
+        self.full = WSGIHandler()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(self.prefix):
+            return self.api(environ, start_response)
+        return self.full(environ, start_response)
+
+
+def application():
+    """Return the WSGI application for the site"""
+    if settings.API_MIDDLEWARE_CLASSES is None:
+        return WSGIHandler()
+    return PrefixRouter()
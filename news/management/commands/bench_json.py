@@ -0,0 +1,61 @@
+import json
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from news.responses import OK, HttpResponseJSON, ujson
+
+
+# What lookup_user returns for a typical user
+SAMPLE_USER_DATA = {
+    'status': 'ok',
+    'email': 'dude@example.com',
+    'format': 'H',
+    'country': 'us',
+    'lang': 'en',
+    'token': '6a5a8ba0-0c5e-4ccb-9e26-df4a8b2c0a3f',
+    'created-date': '1/30/2013 12:46:05 PM',
+    'newsletters': ['mozilla-and-you', 'firefox-tips', 'about-mozilla',
+                    'affiliates', 'mobile', 'firefox-os'],
+    'confirmed': True,
+    'pending': False,
+    'master': True,
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure how long encoding API responses takes: the lookup_user ' \
+           'payload with json and ujson (if installed), and the ' \
+           'pre-encoded {"status": "ok"}.'
+    option_list = BaseCommand.option_list + (
+        make_option('--count',
+                    type='int',
+                    dest='count',
+                    default=10000,
+                    help='How many times to encode each response'),
+    )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        cases = [
+            ('lookup_user json', lambda: json.dumps(SAMPLE_USER_DATA)),
+        ]
+        if ujson is not None:
+            cases.append(('lookup_user ujson',
+                          lambda: ujson.dumps(SAMPLE_USER_DATA)))
+        cases.extend([
+            ('lookup_user response',
+             lambda: HttpResponseJSON(SAMPLE_USER_DATA)),
+            ('ok json', lambda: json.dumps({'status': 'ok'})),
+            ('ok response', lambda: HttpResponseJSON(OK)),
+        ])
+        if ujson is None:
+            self.stdout.write('ujson is not installed\n')
+        self.stdout.write('%-22s %10s\n' % ('encoding', 'time (us)'))
+        for name, encode in cases:
+            start = time.time()
+            for i in xrange(count):
+                encode()
+            self.stdout.write('%-22s %10.1f\n' % (
+                name, (time.time() - start) * 1e6 / count))
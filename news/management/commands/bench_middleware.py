@@ -0,0 +1,59 @@
+import sys
+import time
+from StringIO import StringIO
+from optparse import make_option
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+
+from news.handlers import PrefixRouter
+
+
+def environ(path):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+class Command(BaseCommand):
+    args = '[<path>]'
+    help = 'Measure the time per request for an API path (default ' \
+           '/news/newsletters/) with the full middleware and with the ' \
+           'API middleware (see news/handlers.py).'
+    option_list = BaseCommand.option_list + (
+        make_option('--count',
+                    type='int',
+                    dest='count',
+                    default=2000,
+                    help='How many requests to make with each handler'),
+    )
+
+    def handle(self, *args, **options):
+        path = args[0] if args else '/news/newsletters/'
+        count = options['count']
+        self.stdout.write('%-8s %12s\n' % ('stack', 'request (us)'))
+        for name, app in (('full', WSGIHandler()), ('api', PrefixRouter())):
+            # Load the middleware and fill the caches first
+            ''.join(app(environ(path), start_response))
+            start = time.time()
+            for i in xrange(count):
+                ''.join(app(environ(path), start_response))
+            self.stdout.write('%-8s %12.1f\n' % (
+                name, (time.time() - start) * 1e6 / count))
@@ -0,0 +1,62 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from kombu.compression import compress
+from kombu.serialization import decode, encode
+
+from news.tasks import SUBSCRIBE, msgpack, update_user
+
+
+# What a typical subscribe form POSTs
+SAMPLE_POST = ('email=dude%40example.com&newsletters=mozilla-and-you%2Cfirefox-tips'
+               '&format=H&country=us&lang=en&source_url=https%3A%2F%2Fwww.mozilla.org'
+               '%2Fen-US%2Fnewsletter%2F&privacy=true&fmt=H'
+               '&csrfmiddlewaretoken=0123456789abcdef0123456789abcdef')
+
+
+class Command(BaseCommand):
+    help = 'Measure the size and decode time of update_user task messages ' \
+           'with each serializer, with all the POST data and with just ' \
+           'what the task uses.'
+    option_list = BaseCommand.option_list + (
+        make_option('--count',
+                    type='int',
+                    dest='count',
+                    default=10000,
+                    help='How many times to decode each message'),
+    )
+
+    def handle(self, *args, **options):
+        data = QueryDict(SAMPLE_POST)
+        call_args = ['dude@example.com', '6a5a8ba0-0c5e-4ccb-9e26-df4a8b2c0a3f',
+                     False, SUBSCRIBE, True]
+        payloads = [
+            ('full', {'args': [data] + call_args, 'kwargs': {}}),
+            ('slim', {'args': [update_user.slim_data(data)] + call_args,
+                      'kwargs': {}}),
+        ]
+        serializers = ['pickle', 'json']
+        if msgpack is not None:
+            serializers.append('msgpack')
+
+        self.stdout.write('%-6s %-8s %8s %8s %12s\n' % (
+            'data', 'format', 'bytes', 'gzipped', 'decode (us)'))
+        for name, payload in payloads:
+            for serializer in serializers:
+                try:
+                    content_type, encoding, body = encode(
+                        payload, serializer=serializer)
+                except Exception as e:
+                    self.stdout.write('%-6s %-8s can\'t encode: %s\n' % (
+                        name, serializer, e))
+                    continue
+                gzipped, _ = compress(body, 'gzip')
+                start = time.time()
+                for i in xrange(options['count']):
+                    decode(body, content_type, encoding)
+                decode_us = (time.time() - start) * 1e6 / options['count']
+                self.stdout.write('%-6s %-8s %8d %8d %12.1f\n' % (
+                    name, serializer, len(body), len(gzipped), decode_us))
@@ -0,0 +1,94 @@
+import re
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from news.forms import EmailForm
+from news.newsletters import newsletter_languages, newsletter_slugs
+from news.validation import (check_send_recovery_message, check_subscribe_sms,
+                             check_update_user)
+
+
+# What a typical subscribe form POSTs
+SAMPLE_POST = ('email=dude%40example.com&newsletters=mozilla-and-you%2Cfirefox-tips'
+               '&format=H&country=us&lang=en-US&source_url=https%3A%2F%2Fwww.mozilla.org'
+               '%2Fen-US%2Fnewsletter%2F')
+SAMPLE_SMS_POST = 'mobile_number=%28555%29+555-1234&msg_name=SMS_Android'
+
+
+## How the views checked their parameters before news.validation
+
+
+def old_language_code_is_valid(code):
+    langs = [''] + [lang.lower() for lang in newsletter_languages()]
+    code = code.lower()
+    if code in langs:
+        return True
+    elif len(code) in [2, 5]:
+        code2 = code[:2]
+        if any(code2 == lang[:2] for lang in langs):
+            return True
+    return False
+
+
+def old_check_update_user(data):
+    newsletters = data.get('newsletters', None)
+    if newsletters:
+        all_newsletters = newsletter_slugs()
+        for nl in [x.strip() for x in newsletters.split(',')]:
+            if nl not in all_newsletters:
+                return 'invalid newsletter'
+    if 'lang' in data and not old_language_code_is_valid(data['lang']):
+        return 'invalid language'
+
+
+def old_check_subscribe_sms(data):
+    mobile = re.sub(r'\D+', '', data['mobile_number'])
+    if len(mobile) == 10:
+        mobile = '1' + mobile
+    elif len(mobile) != 11 or mobile[0] != '1':
+        return 'mobile_number must be a US number'
+
+
+def old_check_send_recovery_message(data):
+    if not EmailForm(data).is_valid():
+        return 'invalid email'
+
+
+class Command(BaseCommand):
+    help = 'Measure how long checking the parameters of a typical ' \
+           'request takes with news.validation and with the checks the ' \
+           'views used to make by hand, using the newsletters in the ' \
+           'database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--count',
+                    type='int',
+                    dest='count',
+                    default=10000,
+                    help='How many times to check each request'),
+    )
+
+    def handle(self, *args, **options):
+        post = QueryDict(SAMPLE_POST)
+        sms_post = QueryDict(SAMPLE_SMS_POST)
+        cases = [
+            ('update_user', post,
+             old_check_update_user, check_update_user),
+            ('subscribe_sms', sms_post,
+             old_check_subscribe_sms, check_subscribe_sms),
+            ('send_recovery_message', post,
+             old_check_send_recovery_message, check_send_recovery_message),
+        ]
+        self.stdout.write('%-22s %10s %10s\n' % ('check', 'old (us)',
+                                                  'new (us)'))
+        for name, data, old, new in cases:
+            times = []
+            for check in (old, new):
+                start = time.time()
+                for i in xrange(options['count']):
+                    check(data)
+                times.append((time.time() - start) * 1e6 / options['count'])
+            self.stdout.write('%-22s %10.1f %10.1f\n' % ((name,) +
+                                                         tuple(times)))
@@ -0,0 +1,62 @@
+import logging
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from news.outbox import drain_outbox, purge_outbox
+
+
+log = logging.getLogger(__name__)
+
+# How often to delete old sent entries, in seconds
+PURGE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = 'Send the changes in the outbox to ET, in order and in batches. ' \
+           'Runs until killed unless --once is given.'
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='Send one batch and stop'),
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=settings.ET_OUTBOX_BATCH_SIZE,
+                    help='Most entries to read at a time'),
+        make_option('--interval',
+                    type='float',
+                    dest='interval',
+                    default=settings.ET_OUTBOX_POLL_INTERVAL,
+                    help='Seconds to wait when the outbox is empty or ET '
+                         'is having problems'),
+    )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done = drain_outbox(options['batch_size'])
+            self.stdout.write('Sent %d entries\n' % done)
+            return
+        last_purge = 0
+        while True:
+            done = 0
+            try:
+                if time.time() - last_purge > PURGE_INTERVAL:
+                    purge_outbox()
+                    last_purge = time.time()
+                done = drain_outbox(options['batch_size'])
+            except Exception:
+                # Don't let one bad poll stop the drainer
+                log.exception('Error draining the outbox')
+            finally:
+                # End the transaction even if nothing was written, or
+                # MySQL keeps showing us the same snapshot of the table.
+                transaction.commit_unless_managed()
+            # Keep going while there's a full batch waiting
+            if done < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from news.export import ndjson, subscriber_rows
+
+
+class Command(BaseCommand):
+    help = 'Write the email and token of every subscriber as ' \
+           'newline-delimited JSON, in order of email.'
+    option_list = BaseCommand.option_list + (
+        make_option('--after',
+                    dest='after',
+                    default=None,
+                    help='Start after this email, e.g. the last one an '
+                         'export that was cut off got to'),
+        make_option('--chunk-size',
+                    type='int',
+                    dest='chunk_size',
+                    default=settings.SUBSCRIBER_EXPORT_CHUNK_SIZE,
+                    help='How many subscribers to read at a time'),
+        make_option('--pending',
+                    action='store_true',
+                    dest='pending',
+                    default=False,
+                    help='Say whether each subscriber is waiting to be '
+                         'promoted to Master'),
+        make_option('--output',
+                    dest='output',
+                    default=None,
+                    help='File to write to (default standard output)'),
+    )
+
+    def handle(self, *args, **options):
+        rows = subscriber_rows(after=options['after'],
+                               chunk_size=options['chunk_size'],
+                               with_pending=options['pending'])
+        out = open(options['output'], 'w') if options['output'] else \
+            self.stdout
+        try:
+            for lines in ndjson(rows):
+                out.write(lines)
+        finally:
+            if out is not self.stdout:
+                out.close()
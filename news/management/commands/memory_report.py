@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from news.preload import child_pids, memory_usage
+
+
+class Command(BaseCommand):
+    args = '<pid>'
+    help = 'Show how much memory each child of a process (e.g. a celery ' \
+           'worker or gunicorn master) has to itself and how much it ' \
+           'shares with the others. Only works on Linux.'
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or not args[0].isdigit():
+            raise CommandError('Give the pid of the parent process')
+        parent = int(args[0])
+        self.stdout.write('%-8s %10s %10s %10s %10s\n' % (
+            'pid', 'rss (kB)', 'pss (kB)', 'shared', 'private'))
+        totals = dict(rss=0, pss=0, shared=0, private=0)
+        for pid in [parent] + child_pids(parent):
+            usage = memory_usage(pid)
+            if usage is None:
+                continue
+            self.stdout.write('%-8d %10d %10d %10d %10d\n' % (
+                pid, usage['rss'], usage['pss'], usage['shared'],
+                usage['private']))
+            for key in totals:
+                totals[key] += usage[key]
+        self.stdout.write('%-8s %10d %10d %10d %10d\n' % (
+            'total', totals['rss'], totals['pss'], totals['shared'],
+            totals['private']))
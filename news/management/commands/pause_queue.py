@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from news.tasks import pause_queue, resume_queue
+
+
+class Command(BaseCommand):
+    args = '<queue>'
+    help = 'Pause (or with --resume, resume) running the tasks on a queue, ' \
+           'e.g. the back-office queue during an ET incident.'
+    option_list = BaseCommand.option_list + (
+        make_option('--resume',
+                    action='store_true',
+                    dest='resume',
+                    default=False,
+                    help='Resume the queue instead of pausing it'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: pause_queue [--resume] <queue>')
+        queue = args[0]
+        if queue not in settings.CELERY_QUEUES:
+            raise CommandError('Unknown queue %r. Queues are: %s' % (
+                queue, ', '.join(sorted(settings.CELERY_QUEUES))))
+        if options['resume']:
+            resume_queue(queue)
+            self.stdout.write('Resumed %s\n' % queue)
+        else:
+            pause_queue(queue)
+            self.stdout.write('Paused %s\n' % queue)
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from news.promotion import promote_confirmed_users
+
+
+class Command(BaseCommand):
+    help = 'Copy users who have confirmed from Opt-in to Master at ET, ' \
+           'in batches. Safe to run from cron every few minutes.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+                    type='int',
+                    dest='batch_size',
+                    default=settings.PROMOTION_BATCH_SIZE,
+                    help='Most users to handle at a time'),
+    )
+
+    def handle(self, *args, **options):
+        def progress(counts):
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Promoted %(promoted)d, %(already)d '
+                                  'already in Master, %(missing)d '
+                                  'missing, %(dropped)d dropped\n' % counts)
+
+        counts = promote_confirmed_users(options['batch_size'], progress)
+        self.stdout.write('Promoted %(promoted)d users (%(already)d were '
+                          'already in Master, %(missing)d were missing and '
+                          '%(dropped)d of those were dropped)\n' % counts)
+        if counts['error']:
+            raise CommandError('Stopped by an error from ET: %s'
+                               % counts['error'])
@@ -0,0 +1,38 @@
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from news.readiness import run_probes
+
+
+class Command(BaseCommand):
+    help = 'Check ET, the broker, the database and the cache and keep the ' \
+           'results for the readiness view. Runs until killed unless ' \
+           '--once is given; run one on each web node.'
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='Run the probes once, show the results and stop'),
+        make_option('--interval',
+                    type='float',
+                    dest='interval',
+                    default=settings.READINESS_INTERVAL,
+                    help='Seconds between runs'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            state = run_probes()
+            if options['once']:
+                for name, result in sorted(state['probes'].items()):
+                    self.stdout.write('%-12s %6.3fs %s\n' % (
+                        name, result['seconds'],
+                        'ok' if result['ok'] else result['error'] or
+                        'over budget'))
+                return
+            time.sleep(max(options['interval'] - (time.time() - started), 0))
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from news.tasks import retry_failed_tasks
+
+
+class Command(BaseCommand):
+    help = 'Queue all the failed tasks to run again, a chunk at a time, ' \
+           'and delete them.'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size',
+                    type='int',
+                    dest='chunk_size',
+                    default=settings.FAILED_TASK_RETRY_CHUNK_SIZE,
+                    help='How many failed tasks to handle at a time'),
+        make_option('--rate',
+                    type='int',
+                    dest='rate',
+                    default=settings.FAILED_TASK_RETRY_RATE,
+                    help='Most tasks to queue per second (0 for no limit)'),
+    )
+
+    def handle(self, *args, **options):
+        def progress(counts):
+            self.stdout.write('%(done)d of %(total)d done, %(queued)d '
+                              'queued, %(duplicates)d duplicates\n' % counts)
+
+        counts = retry_failed_tasks(chunk_size=options['chunk_size'],
+                                    rate=options['rate'],
+                                    progress=progress)
+        self.stdout.write('Queued %(queued)d tasks\n' % counts)
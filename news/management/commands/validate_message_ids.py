@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from news.tasks import validate_message_ids
+
+
+class Command(BaseCommand):
+    help = 'Check that the welcome and confirm message IDs of all the ' \
+           'newsletters, in every language and format, exist in ET.'
+
+    def handle(self, *args, **options):
+        bad = validate_message_ids()
+        if bad:
+            self.stdout.write('Not found in ET:\n%s\n' % '\n'.join(bad))
+        else:
+            self.stdout.write('All message IDs found in ET\n')
@@ -1,6 +1,17 @@
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
 from django_statsd.clients import statsd
 from django_statsd.middleware import GraphiteRequestTimingMiddleware
 
+# Get error codes from basket-client so users see the same definitions
+from basket import errors
+
+from .models import api_key_cache
+from .responses import HttpResponseJSON, constant
+
 
 class GraphiteViewHitCountMiddleware(GraphiteRequestTimingMiddleware):
     """add hit counting to statsd's request timer."""
@@ -14,3 +25,57 @@ class GraphiteViewHitCountMiddleware(GraphiteRequestTimingMiddleware):
             statsd.incr('view.count.{module}.{name}.{method}'.format(**data))
             statsd.incr('view.count.{module}.{method}'.format(**data))
             statsd.incr('view.count.{method}'.format(**data))
+
+
+RATE_LIMITED = constant({
+    'status': 'error',
+    'desc': 'Too many requests, please try again later',
+    'code': errors.BASKET_USAGE_ERROR,
+})
+
+
+class RateLimitMiddleware(object):
+    """Limit how often each client can call the news API views listed in
+    settings.RATE_LIMITS, which maps view names to
+    (per IP, per API key, seconds)::
+
+        RATE_LIMITS = {'lookup_user': (60, 3000, 60)}
+
+    lets each IP address call lookup_user 60 times a minute, or each
+    enabled API key 3000 times a minute. Each view, IP and key has its
+    own fixed-window counter in the shared cache, so each request costs
+    one increment. Requests over the limit get a 429 with Retry-After.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func.__module__ != 'news.views':
+            return None
+        name = view_func.__name__
+        limits = settings.RATE_LIMITS.get(name)
+        if not limits:
+            return None
+        ip_limit, key_limit, period = limits
+
+        api_key = request.GET.get('api-key', None) or\
+            request.META.get('HTTP_X_API_KEY', None)
+        if api_key and api_key_cache.is_valid(api_key, count=False):
+            who, limit = 'key:' + api_key, key_limit
+        else:
+            who = 'ip:' + request.META.get(settings.RATE_LIMIT_IP_HEADER, '')
+            limit = ip_limit
+
+        now = int(time.time())
+        key = 'ratelimit:%s:%s:%d' % (name, md5(who).hexdigest(),
+                                      now // period)
+        try:
+            hits = cache.incr(key)
+        except ValueError:
+            # First request in this window
+            hits = 1 if cache.add(key, 1, period) else cache.incr(key)
+        if hits <= limit:
+            return None
+
+        statsd.incr('news.ratelimit.%s' % name)
+        response = HttpResponseJSON(RATE_LIMITED, 429)
+        response['Retry-After'] = str(period - now % period)
+        return response
@@ -1,3 +1,9 @@
+import atexit
+import threading
+import time
+import zlib
+from base64 import b64decode, b64encode
+from hashlib import sha1
 from uuid import uuid4
 
 from celery.task import subtask
@@ -5,8 +11,10 @@ from celery.task import subtask
 from jsonfield import JSONField
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
-from django.db.models.signals import post_delete
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.timezone import now
 
@@ -148,13 +156,141 @@ class APIUser(models.Model):
                                default=lambda: str(uuid4()),
                                db_index=True)
     enabled = models.BooleanField(default=True)
+    requests = models.BigIntegerField(
+        default=0, editable=False,
+        help_text="How many requests have used this key",
+    )
+    last_used = models.DateTimeField(null=True, default=None, editable=False)
 
     class Meta:
         verbose_name = "API User"
 
     @classmethod
     def is_valid(cls, api_key):
-        return cls.objects.filter(api_key=api_key, enabled=True).exists()
+        return api_key_cache.is_valid(api_key)
+
+
+# Changes whenever an APIUser is saved or deleted
+API_KEYS_VERSION_KEY = 'api-keys-version'
+
+
+def api_keys_version():
+    """Return the current version of the API keys"""
+    version = cache.get(API_KEYS_VERSION_KEY)
+    if version is None:
+        # Start somewhere no process has seen
+        cache.add(API_KEYS_VERSION_KEY, int(time.time() * 1000))
+        version = cache.get(API_KEYS_VERSION_KEY)
+    return version
+
+
+class APIKeyCache(object):
+    """The enabled API keys, kept in each process so checking a key
+    doesn't need the database.
+
+    The keys are read again when they're older than
+    settings.API_KEY_CACHE_TTL seconds, or straight away when any
+    APIUser is saved or deleted, which changes the version in the shared
+    cache. Uses of each key are counted here and added to its APIUser
+    every settings.API_KEY_USAGE_FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.keys = frozenset()
+        self.version = None
+        self.loaded_at = 0
+        self.usage = {}
+        self.flushed_at = time.time()
+        self.lock = threading.Lock()
+
+    def is_valid(self, api_key, count=True):
+        """Return whether ``api_key`` is enabled, counting a use of it
+        if so and ``count`` is true"""
+        version = api_keys_version()
+        if (version != self.version or
+                time.time() - self.loaded_at > settings.API_KEY_CACHE_TTL):
+            self.load(version)
+        if api_key not in self.keys:
+            return False
+        if count:
+            self.count(api_key)
+        return True
+
+    def load(self, version):
+        # Read the version before the keys, so a change while we read
+        # them has us read them again next time
+        self.keys = frozenset(APIUser.objects.filter(enabled=True)
+                              .values_list('api_key', flat=True))
+        self.version = version
+        self.loaded_at = time.time()
+
+    def invalidate(self):
+        self.version = None
+
+    def count(self, api_key):
+        with self.lock:
+            self.usage[api_key] = self.usage.get(api_key, 0) + 1
+            due = (time.time() - self.flushed_at >
+                   settings.API_KEY_USAGE_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the uses counted so far to the APIUsers"""
+        with self.lock:
+            usage, self.usage = self.usage, {}
+            self.flushed_at = time.time()
+        for api_key, count in usage.items():
+            APIUser.objects.filter(api_key=api_key).update(
+                requests=F('requests') + count, last_used=now())
+
+
+api_key_cache = APIKeyCache()
+
+
+def _flush_api_key_usage():
+    try:
+        api_key_cache.flush()
+    except Exception:
+        # The database may be gone by now; the counts are only a guide
+        pass
+
+
+atexit.register(_flush_api_key_usage)
+
+
+@receiver(post_save, sender=APIUser)
+@receiver(post_delete, sender=APIUser)
+def post_apiuser_change(sender, **kwargs):
+    api_key_cache.invalidate()
+    try:
+        cache.incr(API_KEYS_VERSION_KEY)
+    except ValueError:
+        # Not in the cache; the next check starts a new version
+        pass
+
+
+class TaskError(models.Model):
+    """A traceback from a failed task, stored once (compressed) however
+    many FailedTasks had it."""
+    signature = models.CharField(max_length=40, unique=True)
+    when = models.DateTimeField(editable=False, default=now)
+    compressed_einfo = models.TextField(help_text=u"base64(zlib(str(einfo)))")
+
+    def __unicode__(self):
+        return self.signature
+
+    @staticmethod
+    def signature_of(einfo):
+        return sha1(einfo.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def compress(einfo):
+        return b64encode(zlib.compress(einfo.encode('utf-8')))
+
+    @property
+    def einfo(self):
+        return zlib.decompress(b64decode(self.compressed_einfo)).decode('utf-8')
 
 
 class FailedTask(models.Model):
@@ -164,11 +300,20 @@ class FailedTask(models.Model):
     args = JSONField(null=False, default=[])
     kwargs = JSONField(null=False, default={})
     exc = models.TextField(null=True, default=None, help_text=u"repr(exception)")
+    # Only set on tasks that failed before there was an `error`
     einfo = models.TextField(null=True, default=None, help_text=u"repr(einfo)")
+    error = models.ForeignKey(TaskError, null=True, default=None,
+                              on_delete=models.SET_NULL)
 
     def __unicode__(self):
         return self.task_id
 
+    def traceback(self):
+        """Return str(einfo) from when the task failed"""
+        if self.error_id:
+            return self.error.einfo
+        return self.einfo
+
     def formatted_call(self):
         """Return a string that could be evalled to repeat the original call"""
         formatted_args = [repr(arg) for arg in self.args]
@@ -186,3 +331,40 @@ class FailedTask(models.Model):
         new_task.apply_async()
         # Forget the old task
         self.delete()
+
+
+class OutboxEntry(models.Model):
+    """A change to make in ET, written with the database changes that
+    led to it and sent later by the outbox drainer (see news.outbox)."""
+    UPSERT = 'upsert'
+    SEND = 'send'
+    KIND_CHOICES = (
+        (UPSERT, 'Add or update a data extension record'),
+        (SEND, 'Triggered send'),
+    )
+
+    when = models.DateTimeField(editable=False, default=now)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Data extension for upserts, message ID for sends
+    target = models.CharField(max_length=128)
+    payload = JSONField(null=False, default={})
+    done_at = models.DateTimeField(null=True, default=None, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, default=None)
+
+    class Meta:
+        verbose_name_plural = "Outbox entries"
+
+    def __unicode__(self):
+        return u"%s %s" % (self.kind, self.target)
+
+
+class PendingPromotion(models.Model):
+    """A user who confirmed and whose record is still to be copied from
+    Opt-in to Master by ./manage.py promote_confirmed_users (see
+    news.promotion)."""
+    token = models.CharField(max_length=40, unique=True)
+    when = models.DateTimeField(editable=False, default=now)
+
+    def __unicode__(self):
+        return self.token
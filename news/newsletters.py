@@ -4,17 +4,29 @@ backend-specific data for working with them in the email provider.
 It's used to lookup the backend-specific newsletter name from a
 generic one passed by the user. This decouples the API from any
 specific email provider."""
+import json
+import struct
+import zlib
+from hashlib import md5
+
 from django.core.cache import cache
 
 from news.models import Newsletter
 
 
 __all__ = ('clear_newsletter_cache', 'newsletter_field', 'newsletter_name',
-           'newsletter_fields', 'newsletter_names')
+           'newsletter_fields', 'newsletter_names', 'newsletter_slug_set',
+           'newsletters_exempt_from_confirmation',
+           'newsletter_confirm_message', 'newsletter_welcomes',
+           'newsletters_api_body')
 
 
 CACHE_KEY = "newsletters_cache_data"
 
+# Vendor IDs for Firefox OS and Firefox & You:
+FFOS_VENDOR_ID = 'FIREFOX_OS'
+FFAY_VENDOR_ID = 'MOZILLA_AND_YOU'
+
 
 def _newsletters():
     """Returns a data structure with the data about newsletters.
@@ -31,7 +43,29 @@ def _newsletters():
             'by_vendor_id': {
                 'NEWSLETTER_ID_1': a Newsletter object,
                 'NEWSLETTER_ID_2': another Newsletter object,
-            }
+            },
+            'slugs': frozenset(['newsletter_name_1', 'newsletter_name_2']),
+            # all the language codes the newsletters support
+            'languages': frozenset(['en', 'fr-FR']),
+            # slugs of newsletters that don't require double opt-in
+            'exempt_slugs': frozenset(['newsletter_name_2']),
+            # (slug, confirm message ID) in newsletter order, only for
+            # newsletters with a custom confirm message
+            'confirm_messages': (('newsletter_name_1', 'CONFIRM_ID'),),
+            # welcome message IDs, already mogrified for language and format
+            'welcomes': {
+                ('newsletter_name_1', 'en', 'H'): 'en_WELCOME_ID',
+                ('newsletter_name_1', 'en', 'T'): 'en_WELCOME_ID_T',
+            },
+            # slugs whose welcome is replaced by the Firefox OS one
+            'ffos_slugs': frozenset(),
+            'ffay_slugs': frozenset(),
+            # the /news/newsletters/ API response, see newsletters_api_body()
+            'api': {
+                'body': '{"status": "ok", ...}',
+                'gzip_body': the body, gzipped,
+                'etag': hash of the body,
+            },
         }
     """
     data = cache.get(CACHE_KEY)
@@ -43,17 +77,85 @@ def _newsletters():
 
 
 def _get_newsletters_data():
+    # Cannot import earlier due to circular import
+    from news.tasks import mogrify_message_id
+
     by_name = {}
     by_vendor_id = {}
+    exempt_slugs = set()
+    confirm_messages = []
+    welcomes = {}
+    api_newsletters = {}
+    # Newsletter's default ordering is by 'order', so confirm_messages
+    # comes out in the same order the ORM used to return them in.
     for nl in Newsletter.objects.all():
         by_name[nl.slug] = nl
         by_vendor_id[nl.vendor_id] = nl
+        api_newsletters[nl.slug] = _newsletter_api_dict(nl)
+        if not nl.requires_double_optin:
+            exempt_slugs.add(nl.slug)
+        if nl.confirm_message:
+            confirm_messages.append((nl.slug, nl.confirm_message))
+        welcome = nl.welcome.strip()
+        if welcome:
+            # English is the fallback for languages a newsletter
+            # doesn't support, so always have it in the table.
+            langs = set(lang[:2].lower() for lang in nl.language_list)
+            langs.add('en')
+            for lang in langs:
+                for fmt in ('H', 'T'):
+                    welcomes[(nl.slug, lang, fmt)] = \
+                        mogrify_message_id(welcome, lang, fmt)
     return {
         'by_name': by_name,
         'by_vendor_id': by_vendor_id,
+        'slugs': frozenset(by_name),
+        'languages': frozenset(lang for nl in by_name.values()
+                               for lang in nl.language_list),
+        'exempt_slugs': frozenset(exempt_slugs),
+        'confirm_messages': tuple(confirm_messages),
+        'welcomes': welcomes,
+        'ffos_slugs': frozenset(nl.slug for nl in by_name.values()
+                                if nl.vendor_id == FFOS_VENDOR_ID),
+        'ffay_slugs': frozenset(nl.slug for nl in by_name.values()
+                                if nl.vendor_id == FFAY_VENDOR_ID),
+        'api': _render_api_body(api_newsletters),
     }
 
 
+def _newsletter_api_dict(nl):
+    """Return the newsletter's fields as the newsletters API shows them"""
+    data = dict((f.attname, getattr(nl, f.attname)) for f in nl._meta.fields)
+    data['languages'] = data['languages'].split(",")
+    del data['id']  # caller doesn't need to know our pkey
+    del data['slug']  # or our slug
+    return data
+
+
+def _render_api_body(api_newsletters):
+    body = json.dumps({
+        'status': 'ok',
+        'newsletters': api_newsletters,
+    })
+    return {
+        'body': body,
+        'gzip_body': _gzip(body),
+        'etag': md5(body).hexdigest(),
+    }
+
+
+def _gzip(data):
+    """Return ``data`` gzipped, with an mtime of 0 so the same data
+    always gzips to the same bytes (GzipFile only takes an mtime from
+    Python 2.7)."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # Magic, deflate, no flags, mtime 0, best compression, unknown OS
+    header = '\x1f\x8b\x08\x00' + struct.pack('<I', 0) + '\x02\xff'
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                          len(data) & 0xffffffff)
+    return header + compressor.compress(data) + compressor.flush() + trailer
+
+
 def newsletter_field(name):
     """Lookup the backend-specific field (vendor ID) for the newsletter"""
     try:
@@ -78,6 +180,11 @@ def newsletter_slugs():
     return _newsletters()['by_name'].keys()
 
 
+def newsletter_slug_set():
+    """Return a frozenset of the slugs of all the newsletters"""
+    return _newsletters()['slugs']
+
+
 def slug_to_vendor_id(slug):
     """Given a newsletter's slug, return its vendor_id"""
     return _newsletters()['by_name'][slug].vendor_id
@@ -90,13 +197,10 @@ def newsletter_fields():
 
 def newsletter_languages():
     """
-    Return a set of the 2 or 5 char codes of all the languages
+    Return a frozenset of the 2 or 5 char codes of all the languages
     supported by newsletters.
     """
-    lang_set = set()
-    for newsletter in _newsletters()['by_name'].values():
-        lang_set |= set(newsletter.language_list)
-    return lang_set
+    return _newsletters()['languages']
 
 
 def is_supported_newsletter_language(code):
@@ -107,5 +211,61 @@ def is_supported_newsletter_language(code):
     return code[:2].lower() in [lang[:2].lower() for lang in newsletter_languages()]
 
 
+def newsletters_exempt_from_confirmation(slugs):
+    """
+    Return True if any of the given newsletter slugs is for a newsletter
+    that does not require double opt-in.
+    """
+    return not _newsletters()['exempt_slugs'].isdisjoint(slugs)
+
+
+def newsletter_confirm_message(slugs):
+    """
+    Return the custom confirm message ID of the first (by order) of the
+    given newsletters that has one, or None if none of them do.
+    """
+    slugs = set(slugs)
+    for slug, message_id in _newsletters()['confirm_messages']:
+        if slug in slugs:
+            return message_id
+    return None
+
+
+def newsletter_welcomes(slugs, lang, format):
+    """
+    Return the set of welcome message IDs to send to someone who just
+    subscribed to the given newsletters, for their language and format
+    ('H' or 'T'). Newsletters without a welcome message are skipped.
+
+    If a newsletter doesn't support the language, its English welcome is
+    used. If the newsletters include Firefox OS, the Firefox & You
+    welcome is not sent.
+    """
+    data = _newsletters()
+    slugs = set(slugs)
+    if not data['ffos_slugs'].isdisjoint(slugs):
+        slugs -= data['ffay_slugs']
+    lang_code = lang[:2].lower()
+    format = 'T' if format == 'T' else 'H'
+    welcomes = data['welcomes']
+    result = set()
+    for slug in slugs:
+        welcome = welcomes.get((slug, lang_code, format)) or \
+            welcomes.get((slug, 'en', format))
+        if welcome:
+            result.add(welcome)
+    return result
+
+
+def newsletters_api_body():
+    """
+    Return the pre-rendered response for the newsletters API, as a dict
+    with 'body' (the JSON), 'gzip_body' (the same, gzipped) and 'etag'
+    (a strong validator for 'body'). It's rendered once each time the
+    newsletter data changes.
+    """
+    return _newsletters()['api']
+
+
 def clear_newsletter_cache():
     cache.delete(CACHE_KEY)
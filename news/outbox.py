@@ -0,0 +1,187 @@
+"""
+The outbox: changes to make in ET, kept in the database until the
+drainer sends them.
+
+With settings.ET_OUTBOX on, the ET writes and sends that tasks and
+views would make are written to the OutboxEntry table instead, in the
+same database transaction as whatever led to them. The drainer
+(``./manage.py drain_outbox``) reads the outbox in order, sends
+consecutive writes to the same data extension to ET together, and
+marks each entry done. Run one drainer, so entries are sent in order.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+from django_statsd.clients import statsd
+
+from .backends.common import NewsletterException
+from .backends.exacttarget import ExactTarget
+from .models import OutboxEntry
+
+
+log = logging.getLogger(__name__)
+
+# Errors from ET that trying again won't fix
+FATAL_SEND_ERRORS = (
+    'Invalid Customer Key',
+    'There are no valid subscribers.',
+)
+
+
+def outbox_upsert(target, record):
+    """Add or update ``record`` (a dict) in data extension ``target``"""
+    OutboxEntry.objects.create(kind=OutboxEntry.UPSERT, target=target,
+                               payload=record)
+
+
+def outbox_send(message_id, email, token, format):
+    """Send message ``message_id`` to the user, like send_message"""
+    OutboxEntry.objects.create(kind=OutboxEntry.SEND, target=message_id,
+                               payload={
+                                   'EMAIL_ADDRESS_': email,
+                                   'TOKEN': token,
+                                   'EMAIL_FORMAT_': format,
+                               })
+
+
+# What to undo if the current outbox transaction is rolled back
+_rollback = threading.local()
+
+
+@contextmanager
+def outbox_transaction():
+    """Commit the outbox entries written inside this together, if the
+    outbox is on."""
+    if not settings.ET_OUTBOX:
+        yield
+        return
+    outer = getattr(_rollback, 'callbacks', None)
+    _rollback.callbacks = callbacks = []
+    try:
+        with transaction.commit_on_success():
+            yield
+    except Exception:
+        for func in reversed(callbacks):
+            func()
+        raise
+    finally:
+        _rollback.callbacks = outer
+    if outer is not None:
+        # Undo these too if the outer transaction is rolled back
+        outer.extend(callbacks)
+
+
+def on_outbox_rollback(func):
+    """Call ``func`` if the outbox transaction we're in is rolled back.
+    Outside of one, what's been done is done, so it's never called."""
+    callbacks = getattr(_rollback, 'callbacks', None)
+    if callbacks is not None:
+        callbacks.append(func)
+
+
+def _runs(entries):
+    """Split entries into lists that can each go to ET in one call:
+    consecutive upserts to the same data extension (but not two for the
+    same token, which ET might apply out of order), or a single send."""
+    run = []
+    for entry in entries:
+        if run and (entry.kind == OutboxEntry.SEND or
+                    entry.target != run[0].target or
+                    entry.payload.get('TOKEN') in
+                    set(e.payload.get('TOKEN') for e in run)):
+            yield run
+            run = []
+        run.append(entry)
+        if entry.kind == OutboxEntry.SEND:
+            yield run
+            run = []
+    if run:
+        yield run
+
+
+def drain_outbox(batch_size=None):
+    """Send the oldest batch of pending outbox entries to ET.
+
+    Stops at the first entry ET has a (possibly passing) problem with,
+    or at any other error sending a run, so later entries don't overtake
+    it; the drainer tries again later.
+    When ET rejects a run of writes, they're sent again one at a time to
+    find the one it has a problem with.
+    Entries that have failed settings.ET_OUTBOX_MAX_ATTEMPTS times are
+    left in the table with their error for someone to look at.
+
+    :returns: how many entries were marked done
+    """
+    batch_size = batch_size or settings.ET_OUTBOX_BATCH_SIZE
+    entries = list(OutboxEntry.objects.filter(
+        done_at=None,
+        attempts__lt=settings.ET_OUTBOX_MAX_ATTEMPTS,
+    ).order_by('id')[:batch_size])
+    if not entries:
+        return 0
+    lag = now() - entries[0].when
+    statsd.timing('outbox.lag', lag.days * 86400000 + lag.seconds * 1000 +
+                  lag.microseconds // 1000)
+
+    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+    done = 0
+    runs = list(_runs(entries))
+    while runs:
+        run = runs.pop(0)
+        ids = [entry.id for entry in run]
+        first = run[0]
+        try:
+            if first.kind == OutboxEntry.UPSERT:
+                et.data_ext().add_records(first.target,
+                                          [entry.payload for entry in run])
+            else:
+                et.trigger_send(first.target, first.payload)
+        except NewsletterException as e:
+            if len(run) > 1:
+                # Send them one at a time, so only the entry ET has a
+                # problem with is charged an attempt.
+                statsd.incr('outbox.split')
+                runs[:0] = [[entry] for entry in run]
+                continue
+            fatal = first.kind == OutboxEntry.SEND and any(
+                message in e.message for message in FATAL_SEND_ERRORS)
+            OutboxEntry.objects.filter(id__in=ids).update(
+                attempts=F('attempts') + 1,
+                error=repr(e),
+                done_at=now() if fatal else None,
+            )
+            statsd.incr('outbox.error')
+            if fatal:
+                log.error("ET rejected outbox entry %d: %r" % (first.id, e))
+                continue
+            log.warning("Error sending outbox entries %r: %r" % (ids, e))
+            break
+        except Exception as e:
+            # Not ET objecting to an entry, but a connection problem,
+            # bad credentials or a bug. Try the run again later.
+            OutboxEntry.objects.filter(id__in=ids).update(
+                attempts=F('attempts') + 1,
+                error=repr(e),
+            )
+            statsd.incr('outbox.error')
+            log.warning("Error sending outbox entries %r: %r" % (ids, e),
+                        exc_info=True)
+            break
+        OutboxEntry.objects.filter(id__in=ids).update(done_at=now())
+        done += len(run)
+    statsd.incr('outbox.done', done)
+    return done
+
+
+def purge_outbox(days=None):
+    """Delete entries that were sent more than ``days`` ago
+    (default settings.ET_OUTBOX_KEEP_DAYS)"""
+    days = settings.ET_OUTBOX_KEEP_DAYS if days is None else days
+    OutboxEntry.objects.filter(
+        done_at__lt=now() - timedelta(days=days)).delete()
@@ -0,0 +1,113 @@
+"""
+Loading things in a parent process so its forked children share them.
+
+Forked children share their parent's memory until they write to it. If
+the parent builds the suds client, the parsed WSDL and the rest of the
+app (see news.startup) before forking, each child doesn't need its own
+copy. ``preload()`` does that. The celery worker runs it on
+``worker_init``, before it starts its pool. WSGI servers that fork after
+loading the application, like gunicorn with ``--preload``, run it from
+wsgi/basket.wsgi. mod_wsgi daemon processes are forked before the script
+is loaded, so there it only warms each process up.
+
+Reading an object doesn't copy its page, but the garbage collector
+writes to every object it looks at. Python 2 has no ``gc.freeze()`` to
+take the preloaded objects out of its sight. The nearest we can get is
+to collect everything before forking, so what's left has been promoted
+to the oldest generation, and then to make full collections rare with
+settings.PRELOAD_GC_THRESHOLD. Refcount changes will still copy some
+pages.
+
+``memory_usage()`` reads /proc/<pid>/smaps to show how much of each
+child's memory is its own and how much it shares. The memory_report
+command prints it.
+"""
+import gc
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_connection
+
+from .startup import warm_up
+
+
+log = logging.getLogger(__name__)
+
+
+def preload():
+    """Load the app in a process that's about to fork"""
+    warm_up()
+    # The children can't share the parent's connections.
+    close_connection()
+    if hasattr(cache, 'close'):
+        cache.close()
+    settle_gc()
+
+
+def settle_gc():
+    """Leave the garbage collector as unlikely as it can be to touch
+    the objects that exist now"""
+    gc.collect()
+    if settings.PRELOAD_GC_THRESHOLD:
+        gc.set_threshold(*settings.PRELOAD_GC_THRESHOLD)
+
+
+def preload_worker(**kwargs):
+    """Handler for celery's worker_init signal"""
+    if settings.CELERY_PRELOAD:
+        preload()
+
+
+## Memory reports
+
+
+def child_pids(pid):
+    """Return the pids of the processes whose parent is ``pid``"""
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except IOError:
+            # It's gone
+            continue
+        # The command name is in parens and can have spaces in it.
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(fields[1]) == pid:
+            pids.append(int(name))
+    return sorted(pids)
+
+
+def parse_smaps(lines):
+    """Add up the sizes in the lines of a smaps file.
+
+    :returns: A dict of rss, pss, shared and private, in kB
+    """
+    totals = dict(rss=0, pss=0, shared=0, private=0)
+    fields = {
+        'Rss:': 'rss',
+        'Pss:': 'pss',
+        'Shared_Clean:': 'shared',
+        'Shared_Dirty:': 'shared',
+        'Private_Clean:': 'private',
+        'Private_Dirty:': 'private',
+    }
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[0] in fields:
+            totals[fields[parts[0]]] += int(parts[1])
+    return totals
+
+
+def memory_usage(pid):
+    """Return the memory totals of process ``pid``, or None if it's
+    gone or we can't read them"""
+    try:
+        with open('/proc/%d/smaps' % pid) as f:
+            return parse_smaps(f)
+    except IOError:
+        return None
@@ -0,0 +1,151 @@
+"""
+Promoting confirmed users from Opt-in to Master.
+
+When someone confirms, confirm_user adds their token to the Confirmation
+data extension, and a nightly job at ET moves them to Master. Until it
+does, looking them up costs three calls to ET (Master, Opt-in and
+Confirmation). With settings.PROMOTE_CONFIRMED_USERS on, confirm_user
+also records the token as a PendingPromotion, and
+``./manage.py promote_confirmed_users`` (run from cron as often as every
+few minutes) copies their Opt-in records to Master in batches, so later
+lookups find them in Master with one call.
+
+The PendingPromotion table is the job's checkpoint: each batch's rows
+are deleted once the batch is written to Master, so a run that's
+stopped or hits an ET error picks up where it left off next time. Users
+not in Opt-in yet stay pending and are tried again on later runs, until
+they're older than settings.PROMOTION_MISSING_MAX_AGE seconds.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import now
+from django_statsd.clients import statsd
+
+from .backends.common import NewsletterException
+from .backends.exacttarget import ExactTargetDataExt
+from .models import PendingPromotion
+from .newsletters import newsletter_fields
+
+
+log = logging.getLogger(__name__)
+
+# Cache key of the progress of the last promote_confirmed_users run, and
+# how long it's kept (an explicit timeout, since None means the default)
+PROMOTION_PROGRESS_KEY = 'promotion-progress'
+PROMOTION_PROGRESS_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _upper(record):
+    # Field names from ET don't always come back in the same case
+    return dict((name.upper(), value) for name, value in record.items())
+
+
+def _pending_batches(batch_size):
+    """Yield lists of PendingPromotions in order of ID"""
+    last_pk = 0
+    while True:
+        batch = list(PendingPromotion.objects.filter(pk__gt=last_pk)
+                     .order_by('pk')[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def promote_batch(ext, tokens):
+    """Copy the Opt-in records of the users with these tokens to Master,
+    with one read of each and one write.
+
+    :returns: a dict counting the tokens 'promoted', those 'already' in
+        Master and those 'missing' from both, and the set of the missing
+        tokens
+    """
+    from .tasks import gmttime              # Avoid circular import
+    from .views import user_data_fields     # Avoid circular import
+    in_master = set(_upper(record)['TOKEN'] for record in
+                    ext.get_records(settings.EXACTTARGET_DATA, tokens,
+                                    ['TOKEN']))
+    to_read = [token for token in tokens if token not in in_master]
+    records = []
+    found = set()
+    if to_read:
+        # The subscription dates go along with the flags
+        fields = user_data_fields() + ['%s_DATE' % name
+                                       for name in newsletter_fields()]
+        for record in ext.get_records(settings.EXACTTARGET_OPTIN_STAGE,
+                                      to_read, fields):
+            record = _upper(record)
+            # Keep the first one, like get_record does
+            if record['TOKEN'] in found:
+                continue
+            found.add(record['TOKEN'])
+            # Don't blank out in Master what's missing from Opt-in
+            record = dict((name, value) for name, value in record.items()
+                          if value not in (None, ''))
+            # Set like confirm_user and update_user do
+            record['EMAIL_PERMISSION_STATUS_'] = 'I'
+            record['MODIFIED_DATE_'] = gmttime()
+            records.append(record)
+        if records:
+            ext.add_records(settings.EXACTTARGET_DATA, records)
+    missing = set(to_read) - found
+    return {
+        'promoted': len(records),
+        'already': len(in_master),
+        'missing': len(missing),
+    }, missing
+
+
+def promote_confirmed_users(batch_size=None, progress=None):
+    """Promote the pending users to Master, a batch at a time.
+
+    Stops at the first batch ET has a problem with; its users stay
+    pending for the next run. So do users missing from Opt-in, unless
+    they've been pending for more than settings.PROMOTION_MISSING_MAX_AGE
+    seconds, when they're dropped.
+
+    :param batch_size: How many users to handle at a time
+        (default settings.PROMOTION_BATCH_SIZE)
+    :param progress: Called with a dict of counts after each batch. The
+        same dict is kept in the cache under PROMOTION_PROGRESS_KEY.
+    :returns: the dict of counts
+    """
+    batch_size = batch_size or settings.PROMOTION_BATCH_SIZE
+    counts = {'promoted': 0, 'already': 0, 'missing': 0, 'dropped': 0,
+              'error': None, 'started': now().isoformat()}
+    too_old = now() - timedelta(seconds=settings.PROMOTION_MISSING_MAX_AGE)
+    ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
+                             settings.EXACTTARGET_PASS)
+    for batch in _pending_batches(batch_size):
+        tokens = [pending.token for pending in batch]
+        try:
+            batch_counts, missing = promote_batch(ext, tokens)
+        except NewsletterException as e:
+            log.warning("Error promoting confirmed users: %r" % e)
+            statsd.incr('promotion.error')
+            counts['error'] = repr(e)
+            cache.set(PROMOTION_PROGRESS_KEY, counts,
+                      PROMOTION_PROGRESS_TIMEOUT)
+            break
+        dropped = [pending.token for pending in batch
+                   if pending.token in missing and pending.when < too_old]
+        if dropped:
+            log.warning("Gave up promoting users missing from Opt-in: %s"
+                        % ', '.join(dropped))
+        batch_counts['dropped'] = len(dropped)
+        PendingPromotion.objects.filter(
+            pk__in=[pending.pk for pending in batch
+                    if pending.token not in missing or
+                    pending.token in dropped]).delete()
+        for name, count in batch_counts.items():
+            counts[name] += count
+            statsd.incr('promotion.%s' % name, count)
+        counts['last_id'] = batch[-1].pk
+        cache.set(PROMOTION_PROGRESS_KEY, counts,
+                  PROMOTION_PROGRESS_TIMEOUT)
+        if progress:
+            progress(counts)
+    return counts
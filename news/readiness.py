@@ -0,0 +1,143 @@
+"""
+Checking whether this node's dependencies are answering in time.
+
+``./manage.py readiness_probes`` runs the probes below every
+settings.READINESS_INTERVAL seconds and keeps the results in the cache.
+The /news/readiness/ view only reads them, so the load balancer's checks
+never wait on ExactTarget or the broker themselves. That needs a cache
+shared by the command and the web processes; when the view finds no
+results at all, it runs the probes itself. A node isn't ready when a
+probe failed, took longer than its budget in settings.READINESS_BUDGETS,
+or hasn't been run for settings.READINESS_MAX_AGE seconds.
+
+Each node keeps its results under its own cache key and sends its broker
+ping through its own queue, named after settings.READINESS_NODE (the
+hostname by default), so the probes run on one node never stand in for
+another's.
+"""
+import logging
+import socket
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django_statsd.clients import statsd
+
+from celery import current_app
+
+from .backends.exacttarget import ExactTargetDataExt
+
+
+log = logging.getLogger(__name__)
+
+# Where each node's latest results are kept
+READINESS_KEY = 'readiness:%s'
+
+
+def node_name():
+    """Return the name this node's results are kept under"""
+    return settings.READINESS_NODE or socket.gethostname()
+
+
+def probe_exacttarget():
+    """Look up the canary user in ET"""
+    ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
+                             settings.EXACTTARGET_PASS)
+    ext.get_record(settings.EXACTTARGET_DATA,
+                   settings.READINESS_CANARY_TOKEN, ['TOKEN'])
+
+
+def probe_broker():
+    """Send a message through the broker and get it back"""
+    ping = uuid.uuid4().hex
+    deadline = time.time() + settings.READINESS_BUDGETS['broker']
+    with current_app.broker_connection() as conn:
+        queue = conn.SimpleQueue('%s.%s' % (settings.READINESS_QUEUE,
+                                            node_name()),
+                                 no_ack=True,
+                                 queue_opts={'auto_delete': True})
+        try:
+            queue.put({'ping': ping})
+            # Skip any pings left over from runs that timed out
+            while queue.get(timeout=max(deadline - time.time(), 0)
+                            ).payload.get('ping') != ping:
+                pass
+        finally:
+            queue.close()
+
+
+def probe_db():
+    cursor = connection.cursor()
+    cursor.execute('SELECT 1')
+    cursor.fetchone()
+
+
+def probe_cache():
+    # The results go in the cache too, so if it's down they'll go stale
+    key = 'readiness-ping:%s' % node_name()
+    cache.set(key, 1, 60)
+    if cache.get(key) != 1:
+        raise ValueError('Cache ping was not returned')
+
+
+PROBES = (
+    ('exacttarget', probe_exacttarget),
+    ('broker', probe_broker),
+    ('db', probe_db),
+    ('cache', probe_cache),
+)
+
+
+def run_probes(probes=PROBES):
+    """Run each probe, time it and save the results in the cache.
+
+    The ET probe is skipped unless settings.READINESS_CANARY_TOKEN is set.
+
+    :returns: A dict with when the probes were run and, for each probe, a
+        dict of how long it took, whether it was within budget and any
+        error.
+    """
+    results = {}
+    for name, probe in probes:
+        if name == 'exacttarget' and not settings.READINESS_CANARY_TOKEN:
+            continue
+        error = None
+        start = time.time()
+        try:
+            probe()
+        except Exception as e:
+            log.warning('Readiness probe %s failed: %r', name, e)
+            error = repr(e)
+        seconds = time.time() - start
+        statsd.timing('news.readiness.%s' % name, int(seconds * 1000))
+        budget = settings.READINESS_BUDGETS.get(name)
+        results[name] = {
+            'seconds': round(seconds, 3),
+            'ok': error is None and (budget is None or seconds <= budget),
+            'error': error,
+        }
+    state = {'checked': time.time(), 'probes': results}
+    cache.set(READINESS_KEY % node_name(), state,
+              settings.READINESS_MAX_AGE * 2)
+    return state
+
+
+def readiness():
+    """Return whether this node is ready and its latest results.
+
+    If there are no results in the cache (the command isn't running, or
+    the cache isn't shared with it), the probes are run here.
+    """
+    state = cache.get(READINESS_KEY % node_name())
+    if not state:
+        log.warning('No readiness probe results cached, running the '
+                    'probes inline')
+        statsd.incr('news.readiness.inline')
+        state = run_probes()
+    age = time.time() - state['checked']
+    state = dict(state, age=round(age, 3))
+    ready = age <= settings.READINESS_MAX_AGE and all(
+        result['ok'] for result in state['probes'].values())
+    return ready, state
@@ -0,0 +1,59 @@
+"""
+JSON responses for the news API.
+
+Responses that never change, like ``{"status": "ok"}`` and most of the
+errors, are encoded once with ``constant()`` and sent as they are.
+Other data is encoded per response, with ujson when it's installed and
+settings.FAST_JSON is on, since it's several times faster than the
+json module for the user data that lookups return.
+
+Big responses are sent with StreamingHttpResponse, a piece at a time.
+"""
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Before Django 1.5, an HttpResponse made from an iterator sends it
+    # as it goes, as long as no middleware reads its content.
+    StreamingHttpResponse = HttpResponse
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONConstant(str):
+    """A response body that's already encoded"""
+
+
+def constant(data):
+    """Encode ``data`` once, for responses that always have it"""
+    return JSONConstant(json.dumps(data))
+
+
+def dumps(data):
+    """Encode ``data`` as JSON, as fast as we can"""
+    if ujson is not None and settings.FAST_JSON:
+        try:
+            return ujson.dumps(data)
+        except (TypeError, OverflowError):
+            # Leave anything unusual to the json module
+            pass
+    return json.dumps(data)
+
+
+class HttpResponseJSON(HttpResponse):
+    def __init__(self, data, status=None):
+        if not isinstance(data, JSONConstant):
+            data = dumps(data)
+        super(HttpResponseJSON, self).__init__(content=data,
+                                               content_type='application/json',
+                                               status=status)
+
+
+OK = constant({'status': 'ok'})
@@ -0,0 +1,69 @@
+"""
+Getting a new process ready to serve before its first request.
+
+wsgi/basket.wsgi calls ``warm_up()`` once it has made the application,
+so the first request to each mod_wsgi process doesn't pay for importing
+the views and tasks, parsing the ExactTarget WSDL into a suds client, or
+reading the newsletters from the database. How long each step took is
+logged to the ``news.startup`` logger.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+
+log = logging.getLogger('news.startup')
+
+# Modules the first request would otherwise import
+EAGER_MODULES = (
+    'news.views',
+    'news.tasks',
+    'news.admin',
+    'urls',
+)
+
+
+def import_modules():
+    for name in EAGER_MODULES:
+        import_module(name)
+
+
+def build_et_client():
+    from news.backends.exacttarget import get_client
+    get_client(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+
+
+def load_newsletters():
+    from news.newsletters import newsletter_slugs
+    newsletter_slugs()
+
+
+STEPS = (
+    ('imports', import_modules),
+    ('et_client', build_et_client),
+    ('newsletters', load_newsletters),
+)
+
+
+def warm_up(steps=STEPS):
+    """Run each of the startup ``steps`` and log how long they took.
+
+    A step that fails is logged and skipped; it'll be done again, the
+    slow way, by the first request that needs it.
+
+    :returns: A list of (step name, seconds) pairs
+    """
+    timings = []
+    started = time.time()
+    for name, step in steps:
+        start = time.time()
+        try:
+            step()
+        except Exception:
+            log.exception('Startup step %s failed', name)
+        timings.append((name, time.time() - start))
+    log.info('Startup took %.3fs (%s)', time.time() - started,
+             ', '.join('%s %.3fs' % timing for timing in timings))
+    return timings
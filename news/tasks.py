@@ -1,27 +1,59 @@
+import atexit
 import datetime
+import json
 import logging
+import os
+import random
+import socket
+import threading
+import time
 from datetime import date
 from email.utils import formatdate
 from functools import wraps
+from hashlib import md5
 from time import mktime
 from urllib2 import URLError
 
 from django.conf import settings
-from django.core.cache import get_cache
+from django.core.cache import cache, get_cache
+from django.db import IntegrityError
+from django.utils.timezone import utc
 from django_statsd.clients import statsd
 
-from celery.task import Task, task
+from celery import current_app, signals as celery_signals
+from celery.task import Task, subtask, task
+from celery.task.control import broadcast
+from kombu.serialization import encode
+from suds.transport import TransportError
 
-from .backends.common import NewsletterException
+try:
+    import msgpack  # noqa
+except ImportError:
+    msgpack = None
+
+from .backends.common import NewsletterException, UnauthorizedException
 from .backends.exacttarget import (ExactTarget, ExactTargetDataExt)
-from .models import FailedTask, Newsletter
-from .newsletters import (is_supported_newsletter_language, newsletter_field,
-                          newsletter_slugs)
+from .models import FailedTask, Newsletter, PendingPromotion, TaskError
+from .outbox import (on_outbox_rollback, outbox_send, outbox_transaction,
+                     outbox_upsert)
+from .preload import preload_worker
+from .tracing import current_span, span, trace
+from .newsletters import (is_supported_newsletter_language,
+                          newsletter_confirm_message, newsletter_field,
+                          newsletter_slugs, newsletter_welcomes,
+                          newsletters_exempt_from_confirmation)
 
 
 log = logging.getLogger(__name__)
 
-BAD_MESSAGE_ID_CACHE = get_cache('bad_message_ids')
+# Message IDs known to be bad or good in ET. See validate_message_ids().
+MESSAGE_ID_CACHE = get_cache('message_ids')
+MESSAGE_ID_BAD = 'bad'
+MESSAGE_ID_GOOD = 'good'
+
+# The ET steps that tasks have done, so when a task is retried it can
+# skip the ones that already worked. See task_step().
+TASK_STEPS_CACHE = get_cache('task_steps')
 
 
 # A few constants to indicate the type of action to take
@@ -73,14 +105,20 @@ PHONEBOOK_GROUPS = (
     'FUNDRAISING',
 )
 
+# The fields of its `data` argument that update_user uses
+UPDATE_USER_FIELDS = (
+    'country',
+    'format',
+    'lang',
+    'newsletters',
+    'source_url',
+    'trigger_welcome',
+)
+
 # This is prefixed with the 2-letter language code + _ before sending,
 # e.g. 'en_recovery_message', and '_T' if text, e.g. 'en_recovery_message_T'.
 RECOVERY_MESSAGE_ID = 'recovery_message'
 
-# Vendor IDs for Firefox OS and Firefox & You:
-FFOS_VENDOR_ID = 'FIREFOX_OS'
-FFAY_VENDOR_ID = 'MOZILLA_AND_YOU'
-
 ## Error messages
 MSG_TOKEN_REQUIRED = 'Must have valid token for this request'
 MSG_EMAIL_OR_TOKEN_REQUIRED = 'Must have valid token OR email for this request'
@@ -97,10 +135,473 @@ class BasketError(Exception):
         super(BasketError, self).__init__(msg)
 
 
+# Keyword argument ETTask.apply_async adds to record when the task was
+# queued, so the worker can measure how long it waited.
+QUEUED_AT_KWARG = '_queued_at'
+
+# How long to wait before checking again whether a paused queue is running
+PAUSED_QUEUE_DELAY = 60
+
+
+def task_queue(name):
+    """Return the name of the queue that the task with this name is
+    routed to by settings.CELERY_ROUTES."""
+    route = settings.CELERY_ROUTES.get(name, {})
+    return route.get('queue', settings.CELERY_DEFAULT_QUEUE)
+
+
+def _paused_queue_key(queue):
+    return 'queue-paused-%s' % queue
+
+
+def pause_queue(queue):
+    """Stop running the tasks on a queue until resume_queue() is called.
+
+    Workers stop taking tasks from the queue, and any ET task from it
+    that still gets run is put back to try again later.
+    """
+    cache.set(_paused_queue_key(queue), True, settings.QUEUE_PAUSE_TIMEOUT)
+    broadcast('cancel_consumer', arguments={'queue': queue})
+
+
+def resume_queue(queue):
+    """Start running the tasks on a queue paused by pause_queue()"""
+    cache.delete(_paused_queue_key(queue))
+    broadcast('add_consumer', arguments={'queue': queue})
+
+
+def queue_is_paused(queue):
+    return cache.get(_paused_queue_key(queue), False)
+
+
+def record_queue_wait(name, queue, queued_at):
+    """Send how long a task waited for its first attempt to statsd, and
+    count it if that was longer than the queue's budget in
+    settings.CELERY_QUEUE_SLO."""
+    wait = max(time.time() - queued_at, 0)
+    statsd.timing(name + '.queue_wait', int(wait * 1000))
+    statsd.timing('queue.%s.wait' % queue, int(wait * 1000))
+    slo = settings.CELERY_QUEUE_SLO.get(queue)
+    if slo is not None and wait > slo:
+        statsd.incr('queue.%s.slo_miss' % queue)
+
+
+def _without_queued_at(kwargs):
+    return dict((k, v) for k, v in kwargs.items() if k != QUEUED_AT_KWARG)
+
+
+_task_run = threading.local()
+
+
+class TaskRun(object):
+    """Counts the ET steps done by one run of an ET task, to give each
+    step a key that's the same when the task is retried."""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.count = 0
+
+    def next_key(self, detail):
+        self.count += 1
+        key = u'%s-%d-%s' % (self.task_id, self.count, detail)
+        return 'task-step-' + md5(key.encode('utf-8')).hexdigest()
+
+
+def task_step(detail, func, *args):
+    """Call func(*args), which changes something in ET, unless the
+    running task already did this step before it was retried.
+
+    Steps are told apart by the task ID, their position in the task
+    and ``detail``, which should say what the step does (e.g. the
+    message ID for a send), so if a retry ends up doing something
+    different the step isn't skipped.
+
+    Outside of a task run by Celery, this just calls func(*args).
+    """
+    run = getattr(_task_run, 'current', None)
+    if run is None:
+        return func(*args)
+    key = run.next_key(detail)
+    done = TASK_STEPS_CACHE.get(key)
+    if done is not None:
+        statsd.incr('task.step.skipped')
+        current_span().outcome = 'skipped'
+        log.info("Task %s already did step %s, skipping" %
+                 (run.task_id, detail))
+        return done[0]
+    result = func(*args)
+    TASK_STEPS_CACHE.set(key, (result,))
+    return result
+
+
+def task_read(detail, ok, func, *args, **kwargs):
+    """Like task_step, but for reading data from ET: if the running task
+    is a retry, return what it read the first time, so it makes the
+    same decisions and its later steps have the same keys.
+
+    The result is only remembered if ``ok(result)`` is true, so errors
+    are read again.
+    """
+    run = getattr(_task_run, 'current', None)
+    if run is None:
+        return func(*args, **kwargs)
+    key = run.next_key(detail)
+    done = TASK_STEPS_CACHE.get(key)
+    if done is not None:
+        return done[0]
+    result = func(*args, **kwargs)
+    if ok(result):
+        TASK_STEPS_CACHE.set(key, (result,))
+    return result
+
+
+def user_data_ok(user_data):
+    """True if get_user_data's result isn't an error"""
+    return user_data is None or user_data.get('status') == 'ok'
+
+
+# Kinds of error ET tasks retry, each with its own policy in
+# settings.ET_RETRY_POLICIES
+RETRY_DEFAULT = 'default'
+RETRY_TIMEOUT = 'timeout'
+RETRY_THROTTLED = 'throttled'
+RETRY_AUTH = 'auth'
+
+RETRY_EXCEPTIONS = (URLError, socket.timeout, NewsletterException,
+                    UnauthorizedException, TransportError)
+
+# HTTP statuses, and bits of ET error messages, that mean it's asking us
+# to slow down
+THROTTLED_STATUSES = (429, 503)
+THROTTLED_MESSAGES = ('throttl', 'rate limit', 'too many', 'unavailable')
+
+# Cache key of the time until which the ET circuit is open
+ET_CIRCUIT_KEY = 'et-circuit-open-until'
+
+
+def retry_class(exc):
+    """Return which retry policy applies to an error from an ET task"""
+    if isinstance(exc, UnauthorizedException):
+        return RETRY_AUTH
+    # urllib2's HTTPError has the status in code, suds' TransportError
+    # in httpcode
+    status = getattr(exc, 'httpcode', None) or getattr(exc, 'code', None)
+    if status in THROTTLED_STATUSES:
+        return RETRY_THROTTLED
+    # repr, since str fails on faults with non-ASCII messages
+    message = repr(exc).lower()
+    if isinstance(exc, socket.timeout) or \
+            isinstance(getattr(exc, 'reason', None), socket.timeout) or \
+            'timed out' in message:
+        return RETRY_TIMEOUT
+    if any(part in message for part in THROTTLED_MESSAGES):
+        return RETRY_THROTTLED
+    return RETRY_DEFAULT
+
+
+def backoff_delay(retries, base, cap):
+    """Seconds to wait before retry number ``retries`` + 1: exponential
+    backoff with full jitter, so tasks that failed together don't all
+    come back together."""
+    return random.uniform(0, min(cap, base * 2 ** retries))
+
+
+def _et_failures_key():
+    return 'et-failures-%d' % (time.time() // settings.ET_CIRCUIT_WINDOW)
+
+
+def record_et_failure():
+    """Count an ET failure, and open the circuit if there have been
+    settings.ET_CIRCUIT_THRESHOLD of them in the current window."""
+    key = _et_failures_key()
+    cache.add(key, 0, settings.ET_CIRCUIT_WINDOW * 2)
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        # Expired or evicted since we added it
+        return
+    if failures >= settings.ET_CIRCUIT_THRESHOLD:
+        open_for = settings.ET_CIRCUIT_OPEN_TIME
+        if cache.add(ET_CIRCUIT_KEY, time.time() + open_for, open_for):
+            statsd.incr('et.circuit.open')
+            log.warning("%d ET failures, holding retries for %d seconds" %
+                        (failures, open_for))
+
+
+def et_circuit_closes_in():
+    """Seconds until the ET circuit closes again, or 0 if it's closed"""
+    until = cache.get(ET_CIRCUIT_KEY)
+    if until is None:
+        return 0
+    return max(until - time.time(), 0)
+
+
+def save_failed_tasks(failures):
+    """Write failures to the database as FailedTasks, with as few
+    queries as we can.
+
+    Each distinct traceback is stored once, as a TaskError.
+
+    :param list failures: dicts as made by ETTask.on_failure
+    """
+    einfos = dict((TaskError.signature_of(failure['einfo']), failure['einfo'])
+                  for failure in failures)
+    errors = dict(TaskError.objects.filter(signature__in=einfos.keys())
+                  .values_list('signature', 'pk'))
+    new_errors = [TaskError(signature=signature,
+                            compressed_einfo=TaskError.compress(einfo))
+                  for signature, einfo in einfos.items()
+                  if signature not in errors]
+    if new_errors:
+        try:
+            TaskError.objects.bulk_create(new_errors)
+        except IntegrityError:
+            # Another worker saved some of them since we checked, so play
+            # it safe and do them one at a time.
+            for error in new_errors:
+                TaskError.objects.get_or_create(
+                    signature=error.signature,
+                    defaults={'compressed_einfo': error.compressed_einfo})
+        errors = dict(TaskError.objects.filter(signature__in=einfos.keys())
+                      .values_list('signature', 'pk'))
+
+    # A failure can be in the buffer and a dead worker's spool file
+    saved = set(FailedTask.objects.filter(
+        task_id__in=[failure['task_id'] for failure in failures])
+        .values_list('task_id', flat=True))
+    tasks = []
+    for failure in failures:
+        if failure['task_id'] in saved:
+            continue
+        saved.add(failure['task_id'])
+        tasks.append(FailedTask(
+            task_id=failure['task_id'],
+            name=failure['name'],
+            args=failure['args'],
+            kwargs=failure['kwargs'],
+            exc=failure['exc'],
+            when=datetime.datetime.fromtimestamp(failure['when'], utc),
+            error_id=errors[TaskError.signature_of(failure['einfo'])],
+        ))
+    FailedTask.objects.bulk_create(tasks)
+
+
+class FailedTaskBuffer(object):
+    """Collects the failures of one worker process and writes them to
+    the database together, when there are
+    settings.FAILED_TASK_BUFFER_SIZE of them or the oldest is
+    settings.FAILED_TASK_FLUSH_INTERVAL seconds old.
+
+    Each failure is also appended to this process's spool file in
+    settings.FAILED_TASK_SPOOL_DIR straight away, and the file is
+    removed once they're in the database. The buffer is flushed when
+    the worker shuts down. If the process dies first, the next flush by
+    any worker on the host picks up its spool file, so no failure is
+    lost unless the disk is.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.pending = []
+        self.timer = None
+
+    def spool_path(self, pid):
+        return os.path.join(settings.FAILED_TASK_SPOOL_DIR,
+                            'failed-tasks-%d.json' % pid)
+
+    def _spool(self, failures):
+        if not os.path.isdir(settings.FAILED_TASK_SPOOL_DIR):
+            os.makedirs(settings.FAILED_TASK_SPOOL_DIR)
+        with open(self.spool_path(os.getpid()), 'a') as spool:
+            for failure in failures:
+                spool.write(json.dumps(failure) + '\n')
+
+    def _adopt_orphans(self):
+        """Take on the failures in spool files of processes that died"""
+        if not os.path.isdir(settings.FAILED_TASK_SPOOL_DIR):
+            return
+        for filename in os.listdir(settings.FAILED_TASK_SPOOL_DIR):
+            try:
+                pid = int(filename[len('failed-tasks-'):-len('.json')])
+                os.kill(pid, 0)
+            except ValueError:
+                continue
+            except OSError:
+                pass  # No such process
+            else:
+                continue
+            path = os.path.join(settings.FAILED_TASK_SPOOL_DIR, filename)
+            claimed = '%s.%d' % (path, os.getpid())
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue  # Another worker got it first
+            with open(claimed) as spool:
+                failures = [json.loads(line) for line in spool if line.strip()]
+            self._spool(failures)
+            self.pending.extend(failures)
+            os.remove(claimed)
+            log.info("Recovered %d failed tasks from %s" %
+                     (len(failures), filename))
+
+    def add(self, failure):
+        with self.lock:
+            self._spool([failure])
+            self.pending.append(failure)
+            if len(self.pending) >= settings.FAILED_TASK_BUFFER_SIZE:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(
+                    settings.FAILED_TASK_FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            try:
+                self._adopt_orphans()
+                if not self.pending:
+                    return
+                save_failed_tasks(self.pending)
+            except Exception:
+                # Still in the spool file; try again later
+                log.exception("Error saving %d failed tasks" %
+                              len(self.pending))
+                self.timer = threading.Timer(
+                    settings.FAILED_TASK_FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+            statsd.incr('failed_task.saved', len(self.pending))
+            self.pending = []
+            os.remove(self.spool_path(os.getpid()))
+
+
+failed_task_buffer = FailedTaskBuffer()
+
+
+def _flush_failed_tasks(**kwargs):
+    failed_task_buffer.flush()
+
+
+# worker_process_shutdown is only in newer Celery; atexit covers the
+# main process, and the spool files cover anything else.
+for _signal in ('worker_shutdown', 'worker_process_shutdown'):
+    if hasattr(celery_signals, _signal):
+        getattr(celery_signals, _signal).connect(_flush_failed_tasks)
+atexit.register(_flush_failed_tasks)
+
+# Load the app before the pool forks; see news/preload.py.
+celery_signals.worker_init.connect(preload_worker)
+
+
+def task_serializer():
+    """Return the serializer for ET task messages from
+    settings.ET_TASK_SERIALIZER, or None for Celery's default."""
+    serializer = settings.ET_TASK_SERIALIZER
+    if serializer == 'msgpack' and msgpack is None:
+        log.warning("ET_TASK_SERIALIZER is msgpack but it's not installed")
+        return None
+    return serializer
+
+
+def payload_size(args, kwargs, serializer=None):
+    """Return how many bytes a task's arguments take to send"""
+    serializer = serializer or getattr(settings, 'CELERY_TASK_SERIALIZER',
+                                       'pickle')
+    content_type, encoding, body = encode({'args': args, 'kwargs': kwargs},
+                                          serializer=serializer)
+    return len(body)
+
+
 class ETTask(Task):
     abstract = True
     default_retry_delay = 60 * 5  # 5 minutes
     max_retries = 6  # ~ 30 min
+    # Overrides for some of settings.ET_RETRY_POLICIES, e.g.
+    # @et_task(retry_policies={'timeout': {...}})
+    retry_policies = None
+    # Keys the task uses from its `data` argument (the first one); the
+    # rest aren't sent to the broker. None to send them all.
+    data_fields = None
+    # Whether the task's messages can be big enough to gzip. Only these
+    # are always measured; see apply_async.
+    big_payloads = False
+
+    def retry_policy(self, kind):
+        policies = dict(settings.ET_RETRY_POLICIES,
+                        **(self.retry_policies or {}))
+        return policies.get(kind, policies[RETRY_DEFAULT])
+
+    def retry_et(self, exc):
+        """Retry the running task after ``exc``, with the delay and
+        number of retries from the policy for that kind of error.
+
+        Waits at least until the ET circuit closes if it's open.
+        """
+        kind = retry_class(exc)
+        policy = self.retry_policy(kind)
+        retries = self.request.retries
+        if kind != RETRY_AUTH:
+            record_et_failure()
+        delay = backoff_delay(retries, policy['base'], policy['cap'])
+        closes_in = et_circuit_closes_in()
+        if closes_in:
+            delay = closes_in + backoff_delay(retries, policy['base'],
+                                              policy['cap'])
+        if retries < policy['max_retries']:
+            statsd.incr('%s.retry.%s' % (self.name, kind))
+            statsd.timing(self.name + '.retry_delay', int(delay * 1000))
+            statsd.timing('task.retry_delay.' + kind, int(delay * 1000))
+        self.retry(exc=exc, countdown=delay,
+                   max_retries=policy['max_retries'])
+
+    def slim_data(self, data):
+        """Return a plain dict of just the items of ``data`` that the
+        task uses, per its data_fields (e.g. from request.POST)."""
+        if self.data_fields is None:
+            return data
+        return dict((field, data[field]) for field in self.data_fields
+                    if field in data)
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        """Queue the task, noting when it should first be run so
+        et_task can tell how long it waited.
+
+        Only the data the task uses is sent, with
+        settings.ET_TASK_SERIALIZER. Messages of tasks with big_payloads
+        are gzipped if they're bigger than settings.ET_TASK_COMPRESS_OVER
+        bytes. Measuring a message means encoding it an extra time, so
+        for the rest it's only done for the payload size metric, for a
+        settings.ET_PAYLOAD_SIZE_SAMPLE_RATE fraction of them.
+        """
+        args = list(args or ())
+        kwargs = dict(kwargs or {})
+        if self.data_fields is not None:
+            if args:
+                args[0] = self.slim_data(args[0])
+            elif 'data' in kwargs:
+                kwargs['data'] = self.slim_data(kwargs['data'])
+        # A task that's put back keeps the time it was first queued
+        kwargs.setdefault(QUEUED_AT_KWARG,
+                          time.time() + options.get('countdown', 0))
+        serializer = options.get('serializer') or task_serializer()
+        if serializer:
+            options['serializer'] = serializer
+        threshold = self.big_payloads and settings.ET_TASK_COMPRESS_OVER
+        rate = settings.ET_PAYLOAD_SIZE_SAMPLE_RATE
+        sampled = rate and random.random() < rate
+        if threshold or sampled:
+            size = payload_size(args, kwargs, serializer)
+            if sampled:
+                # Sent as a timing so statsd gives us the distribution
+                statsd.timing(self.name + '.payload_bytes', size, rate)
+            if threshold and size > threshold:
+                options.setdefault('compression', 'gzip')
+        return super(ETTask, self).apply_async(args, kwargs, **options)
 
     def on_success(self, retval, task_id, args, kwargs):
         """Success handler.
@@ -116,6 +617,7 @@ class ETTask(Task):
 
         """
         statsd.incr(self.name + '.success')
+        kwargs = _without_queued_at(kwargs)
         log.info("Task succeeded: %s(args=%r, kwargs=%r)"
                  % (self.name, args, kwargs))
 
@@ -137,16 +639,27 @@ class ETTask(Task):
 
         """
         statsd.incr(self.name + '.failure')
+        kwargs = _without_queued_at(kwargs)
         log.error("Task failed: %s(args=%r, kwargs=%r, exc=%r)"
                   % (self.name, args, kwargs, exc))
-        FailedTask.objects.create(
-            task_id=task_id,
-            name=self.name,
-            args=args,
-            kwargs=kwargs,
-            exc=repr(exc),
-            einfo=str(einfo),  # str() gives more info than repr() on celery.datastructures.ExceptionInfo
-        )
+        failure = {
+            'task_id': task_id,
+            'name': self.name,
+            'args': list(args),
+            'kwargs': kwargs,
+            'exc': repr(exc),
+            # str() gives more info than repr() on celery.datastructures.ExceptionInfo
+            'einfo': str(einfo).decode('utf-8', 'replace'),
+            'when': time.time(),
+        }
+        if self.request.is_eager or not settings.FAILED_TASK_BUFFER_SIZE:
+            save_failed_tasks([failure])
+            return
+        try:
+            failed_task_buffer.add(failure)
+        except EnvironmentError:
+            log.exception("Can't spool failed task, saving it now")
+            save_failed_tasks([failure])
 
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         """Retry handler.
@@ -165,22 +678,50 @@ class ETTask(Task):
 
         """
         statsd.incr(self.name + '.retry')
+        kwargs = _without_queued_at(kwargs)
         log.warn("Task retrying: %s(args=%r, kwargs=%r, exc=%r)"
                  % (self.name, args, kwargs, exc))
 
 
-def et_task(func):
-    """Decorator to standardize ET Celery tasks."""
-    @task(base=ETTask)
+def et_task(func=None, **options):
+    """Decorator to standardize ET Celery tasks.
+
+    Options are passed on to Celery's task decorator, e.g.
+    ``@et_task(retry_policies=...)``.
+    """
+    if func is None:
+        return lambda func: et_task(func, **options)
+
+    @task(base=ETTask, **options)
     @wraps(func)
     def wrapped(*args, **kwargs):
+        queued_at = kwargs.pop(QUEUED_AT_KWARG, None)
+        queue = task_queue(wrapped.name)
+        if not wrapped.request.called_directly and queue_is_paused(queue):
+            # Put it back for later. This isn't a retry, so it doesn't
+            # count against max_retries.
+            statsd.incr(wrapped.name + '.paused')
+            if queued_at is not None:
+                kwargs[QUEUED_AT_KWARG] = queued_at
+            wrapped.apply_async(args, kwargs, countdown=PAUSED_QUEUE_DELAY)
+            return
+        if queued_at is not None and not wrapped.request.retries:
+            record_queue_wait(wrapped.name, queue, queued_at)
         statsd.incr(wrapped.name + '.total')
+        # Tasks called from other tasks share their caller's steps
+        previous_run = getattr(_task_run, 'current', None)
+        if not wrapped.request.called_directly:
+            _task_run.current = TaskRun(wrapped.request.id)
         try:
-            return func(*args, **kwargs)
-        except (URLError, NewsletterException) as e:
-            # URLError or NewsletterException could be a connection issue,
-            # so try again later.
-            wrapped.retry(exc=e)
+            with trace(wrapped.name):
+                with outbox_transaction():
+                    return func(*args, **kwargs)
+        except RETRY_EXCEPTIONS as e:
+            # These could be a connection issue or ET having a bad
+            # moment, so try again later.
+            wrapped.retry_et(e)
+        finally:
+            _task_run.current = previous_run
 
     return wrapped
 
@@ -254,7 +795,7 @@ def parse_newsletters(record, type, newsletters, cur_newsletters):
     return to_subscribe, to_unsubscribe
 
 
-@et_task
+@et_task(data_fields=('city', 'country') + PHONEBOOK_GROUPS)
 def update_phonebook(data, email, token):
     record = {
         'EMAIL_ADDRESS': email,
@@ -267,16 +808,14 @@ def update_phonebook(data, email, token):
 
     record.update((k, v) for k, v in data.items() if k in PHONEBOOK_GROUPS)
 
-    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
-    et.data_ext().add_record('PHONEBOOK', record.keys(), record.values())
+    apply_updates('PHONEBOOK', record)
 
 
 @et_task
 def update_student_ambassadors(data, email, token):
     data['EMAIL_ADDRESS'] = email
     data['TOKEN'] = token
-    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
-    et.data_ext().add_record('Student_Ambassadors', data.keys(), data.values())
+    apply_updates('Student_Ambassadors', data)
 
 
 # Return codes for update_user
@@ -287,7 +826,7 @@ UU_MUST_CONFIRM_PENDING = 4
 UU_MUST_CONFIRM_NEW = 5
 
 
-@et_task
+@et_task(data_fields=UPDATE_USER_FIELDS)
 def update_user(data, email, token, created, type, optin):
     """Task for updating user's preferences and newsletters.
 
@@ -306,6 +845,150 @@ def update_user(data, email, token, created, type, optin):
     :raises: NewsletterException if there are any errors that would be
         worth retrying. Our task wrapper will retry in that case.
     """
+    return apply_user_updates(email, token, [(data, type)])
+
+
+@et_task
+def update_user_merged(email, token, updates):
+    """Task for applying several queued update_user calls for one user
+    with a single read from and a single write to ET.
+
+    :param string email: User's email address
+    :param string token: User's token
+    :param list updates: (data, type) pairs in the order the calls
+        arrived, see update_user for what they mean.
+    :returns: Same as update_user.
+    """
+    return apply_user_updates(email, token, updates)
+
+
+# How long to keep the state of queued update_user calls around
+UPDATE_USER_STATE_TIMEOUT = 24 * 60 * 60
+# How many times a flush waits (5 seconds each) for an earlier call the
+# cache doesn't have before giving up on it
+UPDATE_USER_FLUSH_WAITS = 12
+
+
+def _queued_update_key(name, token):
+    return 'update_user-%s-%s' % (name, token)
+
+
+def queue_update_user(data, email, token, created, type, optin):
+    """Arrange for update_user to be called with these arguments.
+
+    If settings.UPDATE_USER_COALESCE_WINDOW is set, the call is held for
+    that many seconds, and all the calls for the same token that arrive
+    in the meantime are applied together by update_user_merged. That
+    needs a cache shared by the web heads and the Celery workers.
+
+    Each call also gets its own flush_user_updates task, which carries
+    the call. The first one to run applies all the calls queued by then,
+    and the rest find theirs done. So a call still gets applied if the
+    cache loses it.
+    """
+    data = update_user.slim_data(data)
+    window = getattr(settings, 'UPDATE_USER_COALESCE_WINDOW', 0)
+    if not window:
+        update_user.delay(data, email, token, created, type, optin)
+        return
+
+    seq_key = _queued_update_key('seq', token)
+    cache.add(seq_key, 0, UPDATE_USER_STATE_TIMEOUT)
+    seq = cache.incr(seq_key)
+    if seq == 1:
+        # Counter is new (or expired), so nothing before this is pending
+        cache.set(_queued_update_key('done', token), 0,
+                  UPDATE_USER_STATE_TIMEOUT)
+    call = (email, data, type)
+    cache.set(_queued_update_key(seq, token), call,
+              UPDATE_USER_STATE_TIMEOUT)
+    flush_user_updates.apply_async((token, seq, call), countdown=window)
+
+
+@task
+def flush_user_updates(token, seq=None, call=None, waited=0):
+    """Hand the update_user calls queued for this token by
+    queue_update_user to update_user_merged, in order.
+
+    :param seq: The number of the call this flush was queued for
+    :param call: That call, in case the cache has lost it
+    :param waited: How many times this flush has waited for an earlier
+        call that the cache doesn't have. After UPDATE_USER_FLUSH_WAITS,
+        such calls are given up on, so they don't hold up this call and
+        the ones after it.
+    """
+    lock_key = _queued_update_key('lock', token)
+    if not cache.add(lock_key, True, 60):
+        # Another flush for this user is running, try again shortly
+        flush_user_updates.apply_async((token, seq, call, waited),
+                                       countdown=5)
+        return
+    calls = []
+    try:
+        done_key = _queued_update_key('done', token)
+        done = cache.get(done_key, 0)
+        if seq is not None and seq <= done:
+            return
+        last = max(cache.get(_queued_update_key('seq', token), 0), seq or 0)
+        numbers = range(done + 1, last + 1)
+        keys = [_queued_update_key(n, token) for n in numbers]
+        queued = cache.get_many(keys)
+        give_up = seq is not None and waited >= UPDATE_USER_FLUSH_WAITS
+        applied = []
+        lost = []
+        for n, key in zip(numbers, keys):
+            queued_call = queued.get(key)
+            if queued_call is None and n == seq:
+                queued_call = call
+            if queued_call is None:
+                if give_up and n < seq:
+                    # Waited long enough; don't let it hold up this call
+                    lost.append(n)
+                    applied.append(key)
+                    continue
+                # Its producer hasn't stored it yet, or the cache lost
+                # it. Leave it, and the calls after it, for its own flush.
+                break
+            calls.append(queued_call)
+            applied.append(key)
+        if lost:
+            log.warning('Gave up on queued update_user calls %s for %s'
+                        % (lost, token))
+            statsd.incr('update_user.lost_call', len(lost))
+        if applied:
+            cache.set(done_key, done + len(applied),
+                      UPDATE_USER_STATE_TIMEOUT)
+            cache.delete_many(applied)
+
+        if seq is not None and seq > done + len(applied):
+            # The flush of an earlier call will pick this one up
+            flush_user_updates.apply_async(
+                (token, seq, call, waited + 1), countdown=5)
+    finally:
+        cache.delete(lock_key)
+
+    if calls:
+        email = calls[-1][0]
+        updates = [(data, type) for email_, data, type in calls]
+        update_user_merged.delay(email, token, updates)
+
+
+def apply_user_updates(email, token, updates, batch=None):
+    """Apply one or more update_user calls for a user.
+
+    The updates are applied in order against the user's current data
+    in ET, and the net result is sent back to ET in one write.
+    Welcomes are sent for the newsletters that the merged updates
+    newly subscribe the user to, if a SUBSCRIBE asked for them.
+
+    :param string email: User's email address
+    :param string token: User's token
+    :param list updates: (data, type) pairs, see update_user.
+    :param ETBatch batch: If given, the user's data is taken from it
+        instead of asking ET, and the ET writes and sends are saved up
+        in it rather than done right away.
+    :returns: Same as update_user.
+    """
 
     # Parse the parameters
     # `record` will contain the data we send to ET in the format they want.
@@ -322,18 +1005,30 @@ def update_user(data, email, token, created, type, optin):
         'source_url': 'SOURCE_URL',
     }
 
-    # Optionally add more fields
-    for field in extra_fields:
-        if field in data:
-            record[extra_fields[field]] = data[field]
+    # Optionally add more fields. Later updates win.
+    for data, type in updates:
+        for field in extra_fields:
+            if field in data:
+                record[extra_fields[field]] = data[field]
 
     lang = record.get('LANGUAGE_ISO2', '') or ''
 
-    # Can't import this earlier, circular import
-    from .views import get_user_data
+    if batch is None:
+        # Can't import this earlier, circular import
+        from .views import get_user_data
+
+        # Get the user's current settings from ET, if any
+        user_data = task_read('get_user_data %s' % token, user_data_ok,
+                              get_user_data, token=token)
+        write = apply_updates
+
+        def call(func, *args):
+            return func(*args)
+    else:
+        user_data = batch.users_data.get(token)
+        write = batch.apply_updates
+        call = batch.call
 
-    # Get the user's current settings from ET, if any
-    user_data = get_user_data(token=token)
     # If we don't find the user, get_user_data returns None. Create
     # a minimal dictionary to use going forward. This will happen
     # often due to new people signing up.
@@ -363,8 +1058,9 @@ def update_user(data, email, token, created, type, optin):
 
     # We need an HTML/Text format choice for sending welcome messages, and
     # optionally to update their ET record
-    if 'format' in data:  # Submitted in call
-        fmt = 'T' if data.get('format', 'H').upper().startswith('T') else 'H'
+    formats = [data['format'] for data, type in updates if 'format' in data]
+    if formats:  # Submitted in call
+        fmt = 'T' if (formats[-1] or 'H').upper().startswith('T') else 'H'
         # We only set the format in ET if the call asked us to
         record['EMAIL_FORMAT_'] = fmt
     elif 'format' in user_data:  # Existing user preference
@@ -373,30 +1069,50 @@ def update_user(data, email, token, created, type, optin):
         fmt = 'H'
     # From here on, fmt is either 'H' or 'T', preferring 'H'
 
-    newsletters = [x.strip() for x in data.get('newsletters', '').split(',')]
-
     cur_newsletters = user_data.get('newsletters', None)
     if cur_newsletters is not None:
         cur_newsletters = set(cur_newsletters)
+    orig_newsletters = cur_newsletters
 
     # Set the newsletter flags in the record by comparing to their
-    # current subscriptions.
-    to_subscribe, to_unsubscribe = parse_newsletters(record, type,
-                                                     newsletters,
-                                                     cur_newsletters)
+    # current subscriptions, as updated by each call in turn.
+    to_subscribe = set()
+    to_unsubscribe = set()
+    welcome_slugs = set()
+    # Send welcomes when type is SUBSCRIBE and trigger_welcome arg
+    # is absent or 'Y'.
+    should_send_welcomes = False
+    for data, type in updates:
+        newsletters = [x.strip() for x in
+                       data.get('newsletters', '').split(',')]
+        subs, unsubs = parse_newsletters(record, type, newsletters,
+                                         cur_newsletters)
+        to_subscribe = (to_subscribe | set(subs)) - set(unsubs)
+        to_unsubscribe = (to_unsubscribe | set(unsubs)) - set(subs)
+        if data.get('trigger_welcome', 'Y') == 'Y' and type == SUBSCRIBE:
+            should_send_welcomes = True
+            welcome_slugs |= set(subs)
+        if cur_newsletters is not None:
+            cur_newsletters = (cur_newsletters | set(subs)) - set(unsubs)
+
+    if orig_newsletters is not None:
+        # Don't touch flags that ended up where they started
+        for nl in (to_subscribe & orig_newsletters) | \
+                (to_unsubscribe - orig_newsletters):
+            name = newsletter_field(nl)
+            record.pop('%s_FLG' % name, None)
+            record.pop('%s_DATE' % name, None)
+        to_subscribe -= orig_newsletters
+        to_unsubscribe &= orig_newsletters
+    to_subscribe = list(to_subscribe)
+    welcome_slugs = list(welcome_slugs & set(to_subscribe))
 
     # Are they subscribing to any newsletters that don't require confirmation?
     # When including any newsletter that does not
     # require confirmation, user gets a pass on confirming and goes straight
     # to confirmed.
-    exempt_from_confirmation = Newsletter.objects\
-        .filter(slug__in=to_subscribe, requires_double_optin=False)\
-        .exists()
-
-    # Send welcomes when type is SUBSCRIBE and trigger_welcome arg
-    # is absent or 'Y'.
-    should_send_welcomes = data.get('trigger_welcome', 'Y') == 'Y'\
-        and type == SUBSCRIBE
+    exempt_from_confirmation = \
+        newsletters_exempt_from_confirmation(to_subscribe)
 
     MASTER = settings.EXACTTARGET_DATA
     OPT_IN = settings.EXACTTARGET_OPTIN_STAGE
@@ -406,9 +1122,9 @@ def update_user(data, email, token, created, type, optin):
         # Just add any new subs to whichever of master or optin list is
         # appropriate, and send welcomes.
         target_et = MASTER if user_data['master'] else OPT_IN
-        apply_updates(target_et, record)
+        write(target_et, record)
         if should_send_welcomes:
-            send_welcomes(user_data, to_subscribe, fmt)
+            call(send_welcomes, user_data, welcome_slugs, fmt)
         return_code = UU_ALREADY_CONFIRMED
     elif exempt_from_confirmation:
         # This user is not confirmed, but they
@@ -417,16 +1133,16 @@ def update_user(data, email, token, created, type, optin):
             # We were waiting for them to confirm.  Update the data in
             # their record (currently in the Opt-in table), then go
             # ahead and confirm them. This will also send welcomes.
-            apply_updates(OPT_IN, record)
-            confirm_user(user_data['token'], user_data)
+            write(OPT_IN, record)
+            call(confirm_user, user_data['token'], user_data)
             return_code = UU_EXEMPT_PENDING
         else:
             # Brand new user: Add them directly to master subscriber DB
             # and send welcomes.
             record['CREATED_DATE_'] = gmttime()
-            apply_updates(MASTER, record)
+            write(MASTER, record)
             if should_send_welcomes:
-                send_welcomes(user_data, to_subscribe, fmt)
+                call(send_welcomes, user_data, welcome_slugs, fmt)
             return_code = UU_EXEMPT_NEW
     else:
         # This user must confirm
@@ -440,8 +1156,8 @@ def update_user(data, email, token, created, type, optin):
             return_code = UU_MUST_CONFIRM_NEW
         # Create or update OPT_IN record and send email telling them (or
         # reminding them) to confirm.
-        apply_updates(OPT_IN, record)
-        send_confirm_notice(email, token, lang, fmt, to_subscribe)
+        write(OPT_IN, record)
+        call(send_confirm_notice, email, token, lang, fmt, to_subscribe)
     return return_code
 
 
@@ -453,11 +1169,69 @@ def apply_updates(target_et, record):
         or settings.EXACTTARGET_CONFIRMATION.
     :param dict record: Data to send
     """
+    if settings.ET_OUTBOX:
+        outbox_upsert(target_et, record)
+        return
+    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+    with span('et.add_record.%s' % target_et):
+        task_step('add_record %s' % target_et, et.data_ext().add_record,
+                  target_et, record.keys(), record.values())
+
+
+def apply_bulk_updates(target_et, records):
+    """Like apply_updates, but sends several records to ET in one call.
+
+    :param str target_et: Target database, e.g. settings.EXACTTARGET_DATA
+    :param list records: dicts of data to send
+    """
+    if settings.ET_OUTBOX:
+        for record in records:
+            outbox_upsert(target_et, record)
+        return
     et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
-    et.data_ext().add_record(target_et, record.keys(), record.values())
+    with span('et.add_records.%s' % target_et, count=len(records)):
+        task_step('add_records %s' % target_et, et.data_ext().add_records,
+                  target_et, records)
 
 
-def send_message(message_id, email, token, format):
+class ETBatch(object):
+    """Lets apply_user_updates handle several users with a few calls to
+    ET: their data is read up front, and the writes to ET are saved up
+    and sent together by run().
+    """
+    def __init__(self, users_data):
+        # token -> what get_user_data returned for it
+        self.users_data = users_data
+        self.writes = []
+        self.calls = []
+
+    def apply_updates(self, target_et, record):
+        self.writes.append((target_et, record))
+
+    def call(self, func, *args):
+        self.calls.append((func, args))
+
+    def run(self):
+        """Send the saved up writes, one call per target database, then
+        make the other calls (sending messages) in order."""
+        targets = []
+        records = {}
+        for target_et, record in self.writes:
+            if target_et not in records:
+                targets.append(target_et)
+                records[target_et] = []
+            records[target_et].append(record)
+        for target_et in targets:
+            apply_bulk_updates(target_et, records[target_et])
+        for func, args in self.calls:
+            try:
+                func(*args)
+            except BasketError as e:
+                # Not worth retrying, and shouldn't stop the other sends
+                log.error("Error in bulk update: %s" % e)
+
+
+def send_message(message_id, email, token, format, dedupe=False):
     """
     Ask ET to send a message.
 
@@ -466,37 +1240,133 @@ def send_message(message_id, email, token, format):
     :param str token: token of the email user
     :param str format: 'H' or 'T' - whether to send in HTML or Text
        (message_id should also be for a message in matching format)
+    :param bool dedupe: Don't send the message if it was sent to the
+       user in the last settings.SEND_DEDUPE_WINDOW seconds, e.g. when
+       update_user and confirm_user both decide to welcome them.
 
     :raises: NewsletterException for retryable errors, BasketError for
         fatal errors.
     """
 
-    if BAD_MESSAGE_ID_CACHE.get(message_id, False):
+    if message_id_is_bad(message_id):
+        statsd.incr('news.tasks.send_message.bad_message_id')
         return
+    window = settings.SEND_DEDUPE_WINDOW if dedupe else 0
+    sent_key = _sent_message_key(message_id, token)
+    if window and not cache.add(sent_key, True, window):
+        statsd.incr('news.tasks.send_message.suppressed')
+        log.info("Already sent %s to %s, not sending again" %
+                 (message_id, token))
+        return
+    try:
+        _send_message(message_id, email, token, format)
+    except Exception:
+        # Let a retry send it
+        if window:
+            cache.delete(sent_key)
+        raise
+    if window:
+        # With the outbox, the send is only made if the task's
+        # transaction commits
+        on_outbox_rollback(lambda: cache.delete(sent_key))
+
+
+def _sent_message_key(message_id, token):
+    key = u'%s-%s' % (message_id, token)
+    return 'sent-message-' + md5(key.encode('utf-8')).hexdigest()
+
+
+def _send_message(message_id, email, token, format):
     log.debug("Sending message %s to %s %s in %s" %
               (message_id, email, token, format))
+    if settings.ET_OUTBOX:
+        outbox_send(message_id, email, token, format)
+        return
     et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
-    try:
-        et.trigger_send(
-            message_id,
-            {
-                'EMAIL_ADDRESS_': email,
-                'TOKEN': token,
-                'EMAIL_FORMAT_': format,
-            }
-        )
-    except NewsletterException as e:
-        # Better error messages for some cases. Also there's no point in
-        # retrying these
-        if 'Invalid Customer Key' in e.message:
-            # Raise the error so it gets logged once, but remember it's a
-            # bad message ID so we don't try again during this process.
-            BAD_MESSAGE_ID_CACHE.set(message_id, True)
-            raise BasketError("ET says no such message ID: %r" % message_id)
-        elif 'There are no valid subscribers.' in e.message:
-            raise BasketError("ET rejected email address: %r" % email)
-        # we should retry
-        raise
+    with span('et.trigger_send', message_id=message_id):
+        try:
+            task_step(
+                'trigger_send %s %s' % (message_id, token),
+                et.trigger_send,
+                message_id,
+                {
+                    'EMAIL_ADDRESS_': email,
+                    'TOKEN': token,
+                    'EMAIL_FORMAT_': format,
+                }
+            )
+        except NewsletterException as e:
+            # Better error messages for some cases. Also there's no point in
+            # retrying these
+            if 'Invalid Customer Key' in e.message:
+                # Raise the error so it gets logged once, but remember it's a
+                # bad message ID so no worker tries it again for a while.
+                MESSAGE_ID_CACHE.set(message_id, MESSAGE_ID_BAD)
+                raise BasketError("ET says no such message ID: %r" % message_id)
+            elif 'There are no valid subscribers.' in e.message:
+                raise BasketError("ET rejected email address: %r" % email)
+            # we should retry
+            raise
+
+
+def message_id_is_bad(message_id):
+    """True if ET has told us there's no such message ID"""
+    return MESSAGE_ID_CACHE.get(message_id) == MESSAGE_ID_BAD
+
+
+def newsletter_message_ids(newsletter):
+    """Return the set of message IDs, in every language and format, that
+    we might send for this newsletter."""
+    bases = [message_id for message_id in (newsletter.welcome,
+                                           newsletter.confirm_message)
+             if message_id]
+    # English is the fallback for languages a newsletter doesn't support
+    langs = set(lang[:2].lower() for lang in newsletter.language_list
+                if lang)
+    langs.add('en')
+    return set(mogrify_message_id(message_id, lang, fmt)
+               for message_id in bases
+               for lang in langs
+               for fmt in ('H', 'T'))
+
+
+# Most message IDs to ask ET about in one call
+VALIDATE_MESSAGE_IDS_CHUNK_SIZE = 100
+
+
+@et_task
+def validate_message_ids(newsletter_ids=None):
+    """Ask ET which of the message IDs we might send for these
+    newsletters (default all of them) exist, and remember the answers
+    for all the workers, so bad ones are caught before anyone is sent
+    them.
+
+    :returns: sorted list of the bad message IDs
+    """
+    newsletters = Newsletter.objects.all()
+    if newsletter_ids is not None:
+        newsletters = newsletters.filter(pk__in=newsletter_ids)
+    message_ids = set()
+    for newsletter in newsletters:
+        message_ids.update(newsletter_message_ids(newsletter))
+    message_ids = sorted(message_ids)
+    if not message_ids:
+        return []
+
+    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+    found = set()
+    for i in range(0, len(message_ids), VALIDATE_MESSAGE_IDS_CHUNK_SIZE):
+        chunk = message_ids[i:i + VALIDATE_MESSAGE_IDS_CHUNK_SIZE]
+        found.update(et.get_triggered_send_keys(chunk))
+    bad = [message_id for message_id in message_ids
+           if message_id not in found]
+    statuses = dict((message_id, MESSAGE_ID_GOOD) for message_id in found)
+    statuses.update((message_id, MESSAGE_ID_BAD) for message_id in bad)
+    MESSAGE_ID_CACHE.set_many(statuses)
+    if bad:
+        statsd.incr('news.tasks.validate_message_ids.bad', len(bad))
+        log.error("Message IDs not found in ET: %s" % ', '.join(bad))
+    return bad
 
 
 def mogrify_message_id(message_id, lang, format):
@@ -541,12 +1411,8 @@ def send_confirm_notice(email, token, lang, format, newsletter_slugs):
 
     # See if any newsletters have a custom confirmation message
     # We only need to find one; if so, we'll use the first we find.
-    newsletters = Newsletter.objects.filter(slug__in=newsletter_slugs)\
-        .exclude(confirm_message='')[:1]
-    if newsletters:
-        welcome = newsletters[0].confirm_message
-    else:
-        welcome = CONFIRMATION_MESSAGE
+    welcome = newsletter_confirm_message(newsletter_slugs) or \
+        CONFIRMATION_MESSAGE
 
     welcome = mogrify_message_id(welcome, lang, format)
     send_message(welcome, email, token, format)
@@ -567,38 +1433,19 @@ def send_welcomes(user_data, newsletter_slugs, format):
                   % user_data)
         return
 
-    newsletters = Newsletter.objects.filter(
-        slug__in=newsletter_slugs
-    )
-
-    # If newsletters include FIREFOX_OS, then remove FIREFOX & YOU
-    # from the list so we don't send its welcome.
-    if newsletters.filter(vendor_id=FFOS_VENDOR_ID).exists():
-        newsletters = newsletters.exclude(vendor_id=FFAY_VENDOR_ID)
-
-    # We don't want any duplicate welcome messages, so make a set
-    # of the ones to send, then send them
-    welcomes_to_send = set()
-    for nl in newsletters:
-        welcome = nl.welcome.strip()
-        if not welcome:
-            continue
-        languages = [lang[:2].lower() for lang in nl.language_list]
-        lang_code = user_data.get('lang', 'en')[:2].lower()
-        if lang_code not in languages:
-            # Newsletter does not support their preferred language, so
-            # it doesn't have a welcome in that language either. Settle
-            # for English, same as they'll be getting the newsletter in.
-            lang_code = 'en'
-        welcome = mogrify_message_id(welcome, lang_code, format)
-        welcomes_to_send.add(welcome)
+    # We don't want any duplicate welcome messages, so the registry
+    # gives us a set of the ones to send. It also handles leaving out
+    # the Firefox & You welcome when Firefox OS is included.
+    welcomes_to_send = newsletter_welcomes(newsletter_slugs,
+                                           user_data.get('lang', 'en'),
+                                           format)
     # Note: it's okay not to send a welcome if none of the newsletters
     # have one configured.
     for welcome in welcomes_to_send:
         log.info("Sending welcome %s to user %s %s" %
                  (welcome, user_data['email'], user_data['token']))
         send_message(welcome, user_data['email'], user_data['token'],
-                     format)
+                     format, dedupe=True)
 
 
 @et_task
@@ -619,7 +1466,8 @@ def confirm_user(token, user_data):
     # Get user data if we don't already have it
     if user_data is None:
         from .views import get_user_data   # Avoid circular import
-        user_data = get_user_data(token=token)
+        user_data = task_read('get_user_data %s' % token, user_data_ok,
+                              get_user_data, token=token)
     if user_data is None:
         log.error(MSG_USER_NOT_FOUND)
         raise BasketError(MSG_USER_NOT_FOUND)
@@ -640,6 +1488,9 @@ def confirm_user(token, user_data):
     # Add user's token to the confirmation database at ET. A nightly
     # task will somehow do something about it.
     apply_updates(settings.EXACTTARGET_CONFIRMATION, {'TOKEN': token})
+    if settings.PROMOTE_CONFIRMED_USERS:
+        # Have promote_confirmed_users move them to Master before then
+        PendingPromotion.objects.get_or_create(token=token)
 
     # Now, if they're subscribed to any newsletters with confirmation
     # welcome messages, send those.
@@ -647,27 +1498,55 @@ def confirm_user(token, user_data):
                   user_data.get('format', 'H'))
 
 
+@et_task(big_payloads=True)
+def update_users_bulk(users):
+    """Subscribe several users to newsletters, with batched ET reads
+    and writes.
+
+    :param list users: dicts with the 'email' and 'token' of each user
+        and 'data', which is like update_user's data. A user who's in
+        the list more than once has their updates merged, in order, as
+        update_user_merged does.
+    """
+    from .views import get_users_data   # Avoid circular import
+    tokens = []
+    emails = {}
+    updates = {}
+    for user in users:
+        token = user['token']
+        if token not in updates:
+            tokens.append(token)
+            updates[token] = []
+        emails[token] = user['email']
+        updates[token].append((user['data'], SUBSCRIBE))
+    users_data = task_read(
+        'get_users_data', lambda result: all(map(user_data_ok,
+                                                 result.values())),
+        get_users_data, tokens=tokens)
+    batch = ETBatch(users_data)
+    for token in tokens:
+        apply_user_updates(emails[token], token, updates[token], batch)
+    batch.run()
+
+
 @et_task
 def add_sms_user(send_name, mobile_number, optin):
     if send_name not in SMS_MESSAGES:
         return
     et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
-    et.trigger_send_sms(send_name, mobile_number)
+    task_step('trigger_send_sms %s' % send_name, et.trigger_send_sms,
+              send_name, mobile_number)
     if optin:
         record = {'Phone': mobile_number, 'SubscriberKey': mobile_number}
-        et.data_ext().add_record('Mobile_Subscribers',
-                                 record.keys(),
-                                 record.values())
+        task_step('add_record Mobile_Subscribers', et.data_ext().add_record,
+                  'Mobile_Subscribers', record.keys(), record.values())
 
 
 @et_task
 def update_custom_unsub(token, reason):
     """Record a user's custom unsubscribe reason."""
-    ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
-                             settings.EXACTTARGET_PASS)
-    ext.add_record(settings.EXACTTARGET_DATA,
-                   ['TOKEN', 'UNSUBSCRIBE_REASON'],
-                   [token, reason])
+    apply_updates(settings.EXACTTARGET_DATA,
+                  {'TOKEN': token, 'UNSUBSCRIBE_REASON': reason})
 
 
 def attempt_fix(ext_name, record, task, e):
@@ -705,3 +1584,91 @@ def send_recovery_message_task(email):
 
     message_id = mogrify_message_id(RECOVERY_MESSAGE_ID, lang, format)
     send_message(message_id, email, user_data['token'], format)
+
+
+# Cache key of the progress of the last retry_failed_tasks run, and how
+# long it's kept (an explicit timeout, since None means the default)
+RETRY_PROGRESS_KEY = 'failed-task-retry-progress'
+RETRY_PROGRESS_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _failed_task_chunks(ids, chunk_size):
+    """Yield lists of FailedTasks in order of ID, from all of them or
+    just those with these IDs."""
+    if ids is not None:
+        ids = sorted(ids)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            yield list(FailedTask.objects.filter(pk__in=chunk).order_by('pk'))
+        return
+    last_pk = 0
+    while True:
+        chunk = list(FailedTask.objects.filter(pk__gt=last_pk)
+                     .order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def retry_failed_tasks(ids=None, chunk_size=None, rate=None, progress=None):
+    """Queue failed tasks to run again and delete them, a chunk at a
+    time.
+
+    Tasks with the same name and arguments are only queued once. Each
+    chunk is published over one broker connection and deleted with one
+    query.
+
+    :param ids: IDs of the FailedTasks to retry, or None for all of them
+    :param chunk_size: How many to handle at a time
+        (default settings.FAILED_TASK_RETRY_CHUNK_SIZE)
+    :param rate: Most tasks to queue per second, 0 for no limit
+        (default settings.FAILED_TASK_RETRY_RATE)
+    :param progress: Called with a dict of counts after each chunk. The
+        same dict is kept in the cache under RETRY_PROGRESS_KEY.
+    :returns: the dict of counts
+    """
+    chunk_size = chunk_size or settings.FAILED_TASK_RETRY_CHUNK_SIZE
+    rate = settings.FAILED_TASK_RETRY_RATE if rate is None else rate
+    total = len(ids) if ids is not None else FailedTask.objects.count()
+    counts = {'total': total, 'done': 0, 'queued': 0, 'duplicates': 0}
+    cache.set(RETRY_PROGRESS_KEY, counts, RETRY_PROGRESS_TIMEOUT)
+    seen = set()
+    for chunk in _failed_task_chunks(ids, chunk_size):
+        started = time.time()
+        done = []
+        queued = 0
+        try:
+            with current_app.broker_connection() as connection:
+                for failed in chunk:
+                    call = (failed.name,
+                            json.dumps(failed.args, sort_keys=True),
+                            json.dumps(failed.kwargs, sort_keys=True))
+                    if call in seen:
+                        counts['duplicates'] += 1
+                    else:
+                        subtask(failed.name, args=failed.args,
+                                kwargs=failed.kwargs).apply_async(
+                                    connection=connection)
+                        seen.add(call)
+                        queued += 1
+                    done.append(failed.pk)
+        finally:
+            # Forget the ones we queued, even if we couldn't queue the rest
+            FailedTask.objects.filter(pk__in=done).delete()
+            counts['done'] += len(done)
+            counts['queued'] += queued
+            cache.set(RETRY_PROGRESS_KEY, counts, RETRY_PROGRESS_TIMEOUT)
+        statsd.incr('failed_task.retried', queued)
+        if progress:
+            progress(counts)
+        if rate:
+            time.sleep(max(queued / float(rate) - (time.time() - started), 0))
+    return counts
+
+
+@task
+def retry_failed_tasks_task(ids):
+    """Run retry_failed_tasks in the background, for the admin"""
+    counts = retry_failed_tasks(ids)
+    log.info("Retried failed tasks: %r" % counts)
@@ -0,0 +1,59 @@
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from news.export import ndjson, subscriber_rows
+from news.models import APIUser, PendingPromotion, Subscriber
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        for name in ('c', 'a', 'd', 'b'):
+            Subscriber.objects.create(email='%s@example.com' % name,
+                                      token='token-%s' % name)
+        PendingPromotion.objects.create(token='token-b')
+
+    def test_rows(self):
+        """All the subscribers come out in order, whatever the chunk size"""
+        rows = list(subscriber_rows(chunk_size=3))
+        self.assertEqual(['a', 'b', 'c', 'd'],
+                         [row['email'][0] for row in rows])
+        self.assertEqual({'email': 'a@example.com', 'token': 'token-a'},
+                         rows[0])
+
+    def test_after(self):
+        """An export can carry on after the last email it got"""
+        rows = list(subscriber_rows(after='b@example.com', chunk_size=1))
+        self.assertEqual(['c@example.com', 'd@example.com'],
+                         [row['email'] for row in rows])
+
+    def test_with_pending(self):
+        rows = list(subscriber_rows(chunk_size=2, with_pending=True))
+        self.assertEqual([False, True, False, False],
+                         [row['pending_promotion'] for row in rows])
+
+    def test_ndjson(self):
+        rows = [{'email': str(i)} for i in range(5)]
+        chunks = list(ndjson(rows, lines_per_chunk=2))
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(rows, [json.loads(line) for line in
+                                ''.join(chunks).splitlines()])
+
+    def test_view(self):
+        auth = APIUser.objects.create(name='test')
+        url = reverse('export_subscribers')
+        rsp = self.client.get(url, {'api-key': auth.api_key})
+        self.assertEqual(401, rsp.status_code)
+        rsp = self.client.get(url, {'api-key': 'BAD KEY'},
+                              **{'wsgi.url_scheme': 'https'})
+        self.assertEqual(401, rsp.status_code)
+        rsp = self.client.get(url, {'api-key': auth.api_key,
+                                    'after': 'c@example.com',
+                                    'pending': 'Y'},
+                              **{'wsgi.url_scheme': 'https'})
+        self.assertEqual(200, rsp.status_code)
+        self.assertEqual([{'email': 'd@example.com', 'token': 'token-d',
+                           'pending_promotion': False}],
+                         [json.loads(line) for line in
+                          rsp.content.splitlines()])
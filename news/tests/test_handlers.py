@@ -0,0 +1,46 @@
+import json
+from StringIO import StringIO
+
+from django.test import TestCase
+
+from news.handlers import PrefixRouter
+
+
+def environ(path):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(),
+    }
+
+
+class PrefixRouterTest(TestCase):
+    def setUp(self):
+        self.statuses = []
+
+    def start_response(self, status, headers, exc_info=None):
+        self.statuses.append(status)
+
+    def test_api_middleware(self):
+        """API requests only run the API middleware"""
+        with self.settings(API_MIDDLEWARE_CLASSES=(
+                'django.middleware.common.CommonMiddleware',)):
+            router = PrefixRouter()
+            body = ''.join(router(environ('/news/newsletters/'),
+                                  self.start_response))
+        self.assertEqual('200 OK', self.statuses[0])
+        self.assertEqual('ok', json.loads(body)['status'])
+        self.assertEqual(1, len(router.api._response_middleware))
+        self.assertEqual(None, router.full._request_middleware)
+
+    def test_other_paths(self):
+        """Everything else gets the full middleware"""
+        router = PrefixRouter()
+        ''.join(router(environ('/admin/'), self.start_response))
+        self.assertTrue(router.full._request_middleware)
+        self.assertEqual(None, router.api._request_middleware)
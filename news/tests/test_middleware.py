@@ -0,0 +1,55 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from mock import patch
+
+from news import views
+from news.middleware import RateLimitMiddleware
+from news.models import APIUser
+
+
+LIMITS = {'lookup_user': (2, 3, 60)}
+
+
+@patch('news.middleware.time.time', lambda: 1000)
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.middleware = RateLimitMiddleware()
+        self.factory = RequestFactory()
+
+    def call(self, view=views.lookup_user, ip='10.0.0.1', **params):
+        request = self.factory.get('/news/lookup-user/', params,
+                                   REMOTE_ADDR=ip)
+        return self.middleware.process_view(request, view, (), {})
+
+    @patch('news.middleware.statsd')
+    def test_per_ip(self, statsd):
+        with self.settings(RATE_LIMITS=LIMITS):
+            self.assertEqual(None, self.call())
+            self.assertEqual(None, self.call())
+            rsp = self.call()
+            # Other IPs and views have their own limits
+            self.assertEqual(None, self.call(ip='10.0.0.2'))
+            self.assertEqual(None, self.call(view=views.subscribe))
+        self.assertEqual(429, rsp.status_code)
+        self.assertEqual('20', rsp['Retry-After'])
+        self.assertEqual('error', json.loads(rsp.content)['status'])
+        statsd.incr.assert_called_once_with('news.ratelimit.lookup_user')
+
+    def test_per_api_key(self):
+        """Enabled API keys have their own, separate limit"""
+        auth = APIUser.objects.create(name='test')
+        with self.settings(RATE_LIMITS=LIMITS):
+            for i in range(3):
+                self.assertEqual(None, self.call(**{'api-key':
+                                                    auth.api_key}))
+            self.assertEqual(429, self.call(**{'api-key': auth.api_key})
+                             .status_code)
+            # Made-up keys count against the IP
+            self.assertEqual(None, self.call(**{'api-key': 'BAD KEY'}))
+            self.assertEqual(None, self.call())
+            self.assertEqual(429, self.call().status_code)
@@ -1,5 +1,8 @@
+from django.core.cache import cache
 from django.test import TestCase
 
+from mock import patch
+
 from news import models
 
 
@@ -26,3 +29,54 @@ class SubscriberTest(TestCase):
         models.Subscriber.objects.get_and_sync('dude@example.com', 'asdfjkl')
         sub = models.Subscriber.objects.get(email='dude@example.com')
         self.assertEqual(sub.token, 'asdfjkl')
+
+
+class APIUserTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache = models.APIKeyCache()
+        self.auth = models.APIUser.objects.create(name='test')
+
+    def test_is_valid(self):
+        self.assertTrue(self.cache.is_valid(self.auth.api_key))
+        self.assertFalse(self.cache.is_valid('BAD KEY'))
+        self.assertFalse(self.cache.is_valid(None))
+
+    def test_cached(self):
+        """Keys are read from the database once until something changes"""
+        self.cache.is_valid(self.auth.api_key)
+        with patch.object(models.APIUser.objects, 'filter') as filter:
+            self.assertTrue(self.cache.is_valid(self.auth.api_key))
+        self.assertFalse(filter.called)
+
+    def test_invalidated(self):
+        """Saving or deleting an APIUser is seen by all processes"""
+        self.assertTrue(self.cache.is_valid(self.auth.api_key))
+        self.auth.enabled = False
+        self.auth.save()
+        self.assertFalse(self.cache.is_valid(self.auth.api_key))
+        other = models.APIUser.objects.create(name='other')
+        self.assertTrue(self.cache.is_valid(other.api_key))
+        other.delete()
+        self.assertFalse(self.cache.is_valid(other.api_key))
+
+    def test_ttl(self):
+        self.cache.is_valid(self.auth.api_key)
+        # A change the version didn't catch
+        models.APIUser.objects.filter(pk=self.auth.pk).update(enabled=False)
+        self.assertTrue(self.cache.is_valid(self.auth.api_key))
+        with self.settings(API_KEY_CACHE_TTL=-1):
+            self.assertFalse(self.cache.is_valid(self.auth.api_key))
+
+    def test_usage(self):
+        """Uses are counted in memory and added up in the database"""
+        with self.settings(API_KEY_USAGE_FLUSH_INTERVAL=60):
+            self.cache.is_valid(self.auth.api_key)
+            self.cache.is_valid(self.auth.api_key)
+        auth = models.APIUser.objects.get(pk=self.auth.pk)
+        self.assertEqual((0, None), (auth.requests, auth.last_used))
+        with self.settings(API_KEY_USAGE_FLUSH_INTERVAL=-1):
+            self.cache.is_valid(self.auth.api_key)
+        auth = models.APIUser.objects.get(pk=self.auth.pk)
+        self.assertEqual(3, auth.requests)
+        self.assertTrue(auth.last_used)
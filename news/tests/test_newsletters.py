@@ -0,0 +1,75 @@
+from django.test import TestCase
+
+from news.models import Newsletter
+from news.newsletters import (FFAY_VENDOR_ID, FFOS_VENDOR_ID,
+                              newsletter_confirm_message, newsletter_fields,
+                              newsletter_welcomes,
+                              newsletters_exempt_from_confirmation)
+
+
+class TestNewsletterRegistry(TestCase):
+    def setUp(self):
+        Newsletter.objects.create(
+            slug='required',
+            vendor_id='VENDOR1',
+            requires_double_optin=True,
+            confirm_message='confirm1',
+            welcome='welcome1',
+            languages='en,fr',
+            order=2,
+        )
+        Newsletter.objects.create(
+            slug='not-required',
+            vendor_id='VENDOR2',
+            requires_double_optin=False,
+            confirm_message='confirm2',
+            welcome='welcome2',
+            languages='en,pt-BR',
+            order=1,
+        )
+        Newsletter.objects.create(
+            slug='no-welcome',
+            vendor_id='VENDOR3',
+            requires_double_optin=True,
+            languages='en',
+        )
+
+    def test_exempt_from_confirmation(self):
+        self.assertTrue(newsletters_exempt_from_confirmation(
+            ['required', 'not-required']))
+        self.assertFalse(newsletters_exempt_from_confirmation(['required']))
+        self.assertFalse(newsletters_exempt_from_confirmation([]))
+
+    def test_confirm_message_uses_order(self):
+        """The first newsletter by order with a confirm message wins"""
+        self.assertEqual('confirm2', newsletter_confirm_message(
+            ['required', 'not-required']))
+        self.assertEqual('confirm1', newsletter_confirm_message(['required']))
+        self.assertIsNone(newsletter_confirm_message(['no-welcome']))
+
+    def test_welcomes(self):
+        self.assertEqual(set(['fr_welcome1_T']),
+                         newsletter_welcomes(['required'], 'fr', 'T'))
+        self.assertEqual(set(['pt_welcome2']),
+                         newsletter_welcomes(['not-required'], 'pt', 'H'))
+        # Unsupported language falls back to English
+        self.assertEqual(set(['en_welcome1', 'en_welcome2']),
+                         newsletter_welcomes(['required', 'not-required',
+                                              'no-welcome'], 'ru', 'H'))
+
+    def test_ffos_replaces_ffay_welcome(self):
+        Newsletter.objects.create(slug='ffos', vendor_id=FFOS_VENDOR_ID,
+                                  welcome='FFOS_WELCOME', languages='en')
+        Newsletter.objects.create(slug='ffay', vendor_id=FFAY_VENDOR_ID,
+                                  welcome='FFAY_WELCOME', languages='en')
+        self.assertEqual(set(['en_FFAY_WELCOME']),
+                         newsletter_welcomes(['ffay'], 'en', 'H'))
+        self.assertEqual(set(['en_FFOS_WELCOME']),
+                         newsletter_welcomes(['ffos', 'ffay'], 'en', 'H'))
+
+    def test_no_queries_once_loaded(self):
+        newsletter_fields()
+        with self.assertNumQueries(0):
+            newsletters_exempt_from_confirmation(['required'])
+            newsletter_confirm_message(['required'])
+            newsletter_welcomes(['required'], 'en', 'H')
@@ -0,0 +1,123 @@
+from urllib2 import URLError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+
+from mock import call, patch
+
+from news.backends.common import NewsletterException
+from news.models import OutboxEntry
+from news.outbox import drain_outbox, outbox_send, outbox_upsert
+from news.tasks import send_message, update_custom_unsub
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch('news.tasks.ExactTarget')
+    def test_tasks_use_outbox(self, mock_exact_target):
+        """With the outbox on, ET writes and sends are recorded, not made"""
+        with self.settings(ET_OUTBOX=True):
+            update_custom_unsub('TOKEN', 'Too many emails')
+            send_message('en_WELCOME', 'dude@example.com', 'TOKEN', 'H')
+        self.assertFalse(mock_exact_target.called)
+        upsert, send = OutboxEntry.objects.order_by('id')
+        self.assertEqual((OutboxEntry.UPSERT, settings.EXACTTARGET_DATA),
+                         (upsert.kind, upsert.target))
+        self.assertEqual({'TOKEN': 'TOKEN',
+                          'UNSUBSCRIBE_REASON': 'Too many emails'},
+                         upsert.payload)
+        self.assertEqual((OutboxEntry.SEND, 'en_WELCOME'),
+                         (send.kind, send.target))
+
+    @patch('news.outbox.ExactTarget')
+    def test_drain(self, mock_exact_target):
+        """Consecutive writes to the same data extension go together,
+        in order"""
+        outbox_upsert('Master', {'TOKEN': '1'})
+        outbox_upsert('Master', {'TOKEN': '2'})
+        outbox_send('en_WELCOME', 'one@example.com', '1', 'H')
+        outbox_upsert('Master', {'TOKEN': '1', 'LANGUAGE_ISO2': 'fr'})
+        outbox_upsert('Master', {'TOKEN': '1', 'COUNTRY_': 'fr'})
+        outbox_upsert('Confirmation', {'TOKEN': '2'})
+        self.assertEqual(6, drain_outbox())
+        et = mock_exact_target.return_value
+        self.assertEqual([
+            call('Master', [{'TOKEN': '1'}, {'TOKEN': '2'}]),
+            call('Master', [{'TOKEN': '1', 'LANGUAGE_ISO2': 'fr'}]),
+            call('Master', [{'TOKEN': '1', 'COUNTRY_': 'fr'}]),
+            call('Confirmation', [{'TOKEN': '2'}]),
+        ], et.data_ext.return_value.add_records.call_args_list)
+        et.trigger_send.assert_called_once_with('en_WELCOME', {
+            'EMAIL_ADDRESS_': 'one@example.com',
+            'TOKEN': '1',
+            'EMAIL_FORMAT_': 'H',
+        })
+        self.assertFalse(OutboxEntry.objects.filter(done_at=None).exists())
+
+    @patch('news.outbox.ExactTarget')
+    def test_drain_error(self, mock_exact_target):
+        """An error stops the drain so nothing overtakes the failed entry"""
+        et = mock_exact_target.return_value
+        et.data_ext.return_value.add_records.side_effect = \
+            NewsletterException('Timeout')
+        outbox_upsert('Master', {'TOKEN': '1'})
+        outbox_send('en_WELCOME', 'one@example.com', '1', 'H')
+        self.assertEqual(0, drain_outbox())
+        self.assertFalse(et.trigger_send.called)
+        first, second = OutboxEntry.objects.order_by('id')
+        self.assertEqual((1, None), (first.attempts, first.done_at))
+        self.assertEqual(0, second.attempts)
+
+    @patch('news.outbox.ExactTarget')
+    def test_drain_error_in_run(self, mock_exact_target):
+        """When a run of writes fails, only the entry ET has a problem
+        with is charged an attempt"""
+        add_records = mock_exact_target.return_value.data_ext.return_value\
+            .add_records
+        add_records.side_effect = [NewsletterException('Bad record'),
+                                   None,
+                                   NewsletterException('Bad record')]
+        outbox_upsert('Master', {'TOKEN': '1'})
+        outbox_upsert('Master', {'TOKEN': '2'})
+        outbox_upsert('Master', {'TOKEN': '3'})
+        self.assertEqual(1, drain_outbox())
+        self.assertEqual([
+            call('Master', [{'TOKEN': '1'}, {'TOKEN': '2'}, {'TOKEN': '3'}]),
+            call('Master', [{'TOKEN': '1'}]),
+            call('Master', [{'TOKEN': '2'}]),
+        ], add_records.call_args_list)
+        first, second, third = OutboxEntry.objects.order_by('id')
+        self.assertIsNotNone(first.done_at)
+        self.assertEqual((1, None), (second.attempts, second.done_at))
+        self.assertEqual(0, third.attempts)
+
+    @patch('news.outbox.ExactTarget')
+    def test_drain_connection_error(self, mock_exact_target):
+        """Errors other than ET's are recorded and stop the drain too"""
+        et = mock_exact_target.return_value
+        et.data_ext.return_value.add_records.side_effect = \
+            URLError('Connection refused')
+        outbox_upsert('Master', {'TOKEN': '1'})
+        outbox_send('en_WELCOME', 'one@example.com', '1', 'H')
+        self.assertEqual(0, drain_outbox())
+        self.assertFalse(et.trigger_send.called)
+        first, second = OutboxEntry.objects.order_by('id')
+        self.assertEqual((1, None), (first.attempts, first.done_at))
+        self.assertIn('Connection refused', first.error)
+        self.assertEqual(0, second.attempts)
+
+    @patch('news.outbox.ExactTarget')
+    def test_drain_bad_message(self, mock_exact_target):
+        """Sends ET will never accept are set aside"""
+        et = mock_exact_target.return_value
+        et.trigger_send.side_effect = [
+            NewsletterException('Invalid Customer Key'), None]
+        outbox_send('en_NOPE', 'one@example.com', '1', 'H')
+        outbox_send('en_WELCOME', 'one@example.com', '1', 'H')
+        self.assertEqual(1, drain_outbox())
+        bad = OutboxEntry.objects.get(target='en_NOPE')
+        self.assertIsNotNone(bad.done_at)
+        self.assertIn('Invalid Customer Key', bad.error)
@@ -0,0 +1,57 @@
+import gc
+import os
+
+from django.test import TestCase
+
+from mock import patch
+
+from news.preload import child_pids, parse_smaps, preload
+
+
+SMAPS = """\
+00400000-004ef000 r-xp 00000000 08:01 1234   /usr/bin/python2.7
+Size:                956 kB
+Rss:                 800 kB
+Pss:                 200 kB
+Shared_Clean:        600 kB
+Shared_Dirty:        100 kB
+Private_Clean:        40 kB
+Private_Dirty:        60 kB
+VmFlags: rd ex mr mw me dw
+7f0000000000-7f0000021000 rw-p 00000000 00:00 0
+Rss:                  12 kB
+Pss:                  12 kB
+Private_Dirty:        12 kB
+"""
+
+
+class PreloadTest(TestCase):
+    def setUp(self):
+        threshold = gc.get_threshold()
+        self.addCleanup(gc.set_threshold, *threshold)
+
+    @patch('news.preload.close_connection')
+    @patch('news.preload.warm_up')
+    def test_preload(self, warm_up, close_connection):
+        """The app is warmed up, the connections closed and full
+        collections made rarer"""
+        with self.settings(PRELOAD_GC_THRESHOLD=(700, 10, 123)):
+            preload()
+        self.assertTrue(warm_up.called)
+        self.assertTrue(close_connection.called)
+        self.assertEqual((700, 10, 123), gc.get_threshold())
+
+    def test_parse_smaps(self):
+        self.assertEqual(dict(rss=812, pss=212, shared=700, private=112),
+                         parse_smaps(SMAPS.splitlines()))
+
+    def test_child_pids(self):
+        if not os.path.exists('/proc/self/stat'):
+            return
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        try:
+            self.assertIn(pid, child_pids(os.getpid()))
+        finally:
+            os.waitpid(pid, 0)
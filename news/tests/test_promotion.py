@@ -0,0 +1,130 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils.timezone import now
+
+from mock import patch
+
+from news.backends.common import NewsletterException
+from news.models import PendingPromotion
+from news.promotion import promote_confirmed_users
+from news.tasks import confirm_user
+
+
+FIELDS = ['TOKEN', 'EMAIL_ADDRESS_', 'MOZILLA_AND_YOU_FLG']
+
+
+def optin_record(token):
+    return {'token': token, 'EMAIL_ADDRESS_': '%s@example.com' % token,
+            'MOZILLA_AND_YOU_FLG': 'Y', 'MOZILLA_AND_YOU_DATE': '2014-01-02',
+            'COUNTRY_': None}
+
+
+@patch('news.views.user_data_fields', lambda: list(FIELDS))
+@patch('news.promotion.newsletter_fields', lambda: ['MOZILLA_AND_YOU'])
+@patch('news.tasks.gmttime', lambda: 'NOW')
+@patch('news.promotion.ExactTargetDataExt')
+class PromotionTest(TestCase):
+    def get_records(self, data_id, tokens, fields):
+        if data_id == settings.EXACTTARGET_DATA:
+            return [{'TOKEN': token} for token in tokens
+                    if token in self.master]
+        return [optin_record(token) for token in tokens
+                if token in self.optin]
+
+    def setUp(self):
+        self.master = set(['2'])
+        self.optin = set(['1', '2', '3', '4'])
+        for token in '12345':
+            PendingPromotion.objects.create(token=token)
+
+    def test_promote(self, mock_ext):
+        """Users in Opt-in but not Master are copied in batches"""
+        ext = mock_ext.return_value
+        ext.get_records.side_effect = self.get_records
+        counts = promote_confirmed_users(batch_size=2)
+        self.assertEqual((3, 1, 1, None), (counts['promoted'],
+                                           counts['already'],
+                                           counts['missing'],
+                                           counts['error']))
+        self.assertEqual(6, ext.get_records.call_count)
+        writes = [args[1] for args, kwargs in
+                  ext.add_records.call_args_list]
+        self.assertEqual([['1'], ['3', '4']],
+                         [[r['TOKEN'] for r in records]
+                          for records in writes])
+        self.assertEqual({
+            'TOKEN': '3',
+            'EMAIL_ADDRESS_': '3@example.com',
+            'MOZILLA_AND_YOU_FLG': 'Y',
+            'MOZILLA_AND_YOU_DATE': '2014-01-02',
+            'EMAIL_PERMISSION_STATUS_': 'I',
+            'MODIFIED_DATE_': 'NOW',
+        }, writes[1][0])
+        optin_reads = [args for args, kwargs in ext.get_records.call_args_list
+                       if args[0] == settings.EXACTTARGET_OPTIN_STAGE]
+        self.assertIn('MOZILLA_AND_YOU_DATE', optin_reads[0][2])
+        # Missing from Opt-in, so left for the next run
+        self.assertEqual(['5'], list(
+            PendingPromotion.objects.values_list('token', flat=True)))
+
+    def test_drop_missing(self, mock_ext):
+        """Users missing from Opt-in for too long are dropped"""
+        ext = mock_ext.return_value
+        ext.get_records.side_effect = self.get_records
+        PendingPromotion.objects.filter(token__in=['4', '5']).update(
+            when=now() - timedelta(days=3))
+        with self.settings(PROMOTION_MISSING_MAX_AGE=24 * 60 * 60):
+            counts = promote_confirmed_users(batch_size=2)
+        self.assertEqual((1, 1), (counts['missing'], counts['dropped']))
+        self.assertFalse(PendingPromotion.objects.exists())
+
+    def test_error(self, mock_ext):
+        """An ET error leaves the rest pending for the next run"""
+        ext = mock_ext.return_value
+        ext.get_records.side_effect = self.get_records
+        ext.add_records.side_effect = [None, NewsletterException('Oops')]
+        counts = promote_confirmed_users(batch_size=2)
+        self.assertEqual(1, counts['promoted'])
+        self.assertTrue(counts['error'])
+        self.assertEqual(['3', '4', '5'], list(
+            PendingPromotion.objects.order_by('pk')
+            .values_list('token', flat=True)))
+
+
+class ConfirmRecordsPromotionTest(TestCase):
+    user_data = {
+        'status': 'ok',
+        'confirmed': False,
+        'email': 'dude@example.com',
+        'newsletters': [],
+    }
+
+    @patch('news.tasks.apply_updates')
+    def test_recorded(self, mock_apply_updates):
+        """confirm_user records the user for promotion if enabled"""
+        with self.settings(PROMOTE_CONFIRMED_USERS=True):
+            confirm_user('TOKEN', self.user_data)
+            confirm_user('TOKEN', self.user_data)
+        self.assertEqual(['TOKEN'], list(
+            PendingPromotion.objects.values_list('token', flat=True)))
+
+    @patch('news.tasks.apply_updates')
+    def test_not_recorded(self, mock_apply_updates):
+        with self.settings(PROMOTE_CONFIRMED_USERS=False):
+            confirm_user('TOKEN', self.user_data)
+        # Missing from Opt-in, so left for the next run
+        self.assertEqual(['5'], list(
+            PendingPromotion.objects.values_list('token', flat=True)))
+
+    def test_drop_missing(self, mock_ext):
+        """Users missing from Opt-in for too long are dropped"""
+        ext = mock_ext.return_value
+        ext.get_records.side_effect = self.get_records
+        PendingPromotion.objects.filter(token__in=['4', '5']).update(
+            when=now() - timedelta(days=3))
+        with self.settings(PROMOTION_MISSING_MAX_AGE=24 * 60 * 60):
+            counts = promote_confirmed_users(batch_size=2)
+        self.assertEqual((1, 1), (counts['missing'], counts['dropped']))
+        self.assertFalse(PendingPromotion.objects.exists())
@@ -0,0 +1,87 @@
+import json
+import time
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from news.readiness import READINESS_KEY, node_name, readiness, run_probes
+
+
+BUDGETS = {'fast': 1, 'slow': 1}
+
+
+def slow():
+    time.sleep(0.01)
+
+
+class ReadinessTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_run_probes(self):
+        """Failed probes and probes over budget aren't ok"""
+        probes = (('fast', Mock()), ('slow', slow),
+                  ('broken', Mock(side_effect=IOError)))
+        with self.settings(READINESS_BUDGETS=dict(BUDGETS, slow=0.001)):
+            state = run_probes(probes)
+        self.assertTrue(state['probes']['fast']['ok'])
+        self.assertFalse(state['probes']['slow']['ok'])
+        self.assertFalse(state['probes']['broken']['ok'])
+        self.assertTrue(state['probes']['broken']['error'])
+        self.assertEqual(state, cache.get(READINESS_KEY % node_name()))
+
+    def test_canary_token_needed(self):
+        """The ET probe only runs when there's a canary token"""
+        probe = Mock()
+        with self.settings(READINESS_CANARY_TOKEN=None):
+            run_probes((('exacttarget', probe),))
+        self.assertFalse(probe.called)
+
+    @patch('news.readiness.run_probes')
+    def test_nodes(self, run_probes_mock):
+        """Each node only reports its own results"""
+        run_probes_mock.side_effect = lambda: run_probes(
+            (('broken', Mock(side_effect=IOError)),))
+        with self.settings(READINESS_NODE='web1'):
+            run_probes((('fast', Mock()),))
+            self.assertTrue(readiness()[0])
+        with self.settings(READINESS_NODE='web2'):
+            self.assertFalse(readiness()[0])
+            run_probes((('broken', Mock(side_effect=IOError)),))
+            self.assertFalse(readiness()[0])
+        with self.settings(READINESS_NODE='web1'):
+            self.assertTrue(readiness()[0])
+
+    @patch('news.readiness.run_probes')
+    def test_inline(self, run_probes_mock):
+        """Without cached results, the probes are run inline"""
+        run_probes_mock.side_effect = lambda: run_probes((('fast', Mock()),))
+        self.assertTrue(readiness()[0])
+        self.assertTrue(readiness()[0])
+        self.assertEqual(1, run_probes_mock.call_count)
+
+    def test_stale(self):
+        """Results older than READINESS_MAX_AGE mean not ready"""
+        run_probes((('fast', Mock()),))
+        with self.settings(READINESS_MAX_AGE=60):
+            self.assertTrue(readiness()[0])
+        with self.settings(READINESS_MAX_AGE=-1):
+            self.assertFalse(readiness()[0])
+
+    @patch('news.readiness.time.time')
+    def test_view(self, time_):
+        """The view reads the cached results"""
+        time_.return_value = 1000.0
+        url = reverse('readiness')
+        probe = Mock()
+        run_probes((('fast', probe),))
+        resp = self.client.get(url)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('ok', json.loads(resp.content)['status'])
+        self.assertEqual(1, probe.call_count)
+        probe.side_effect = IOError
+        run_probes((('fast', probe),))
+        self.assertEqual(503, self.client.get(url).status_code)
@@ -0,0 +1,38 @@
+import json
+
+from django.test import TestCase
+
+from mock import patch
+
+from news import responses
+from news.responses import OK, HttpResponseJSON, constant
+
+
+class HttpResponseJSONTest(TestCase):
+    def test_constant(self):
+        """Pre-encoded bodies are sent as they are"""
+        error = constant({'status': 'error', 'code': 1})
+        with patch('news.responses.dumps') as dumps:
+            resp = HttpResponseJSON(error, 400)
+            self.assertEqual(400, resp.status_code)
+            self.assertEqual({'status': 'error', 'code': 1},
+                             json.loads(resp.content))
+            self.assertEqual({'status': 'ok'},
+                             json.loads(HttpResponseJSON(OK).content))
+        self.assertFalse(dumps.called)
+
+    def test_dynamic(self):
+        data = {'status': 'ok', 'newsletters': ['one', 'two'],
+                'confirmed': True}
+        for fast in (True, False):
+            with self.settings(FAST_JSON=fast):
+                resp = HttpResponseJSON(data)
+            self.assertEqual('application/json', resp['Content-Type'])
+            self.assertEqual(data, json.loads(resp.content))
+
+    @patch('news.responses.ujson')
+    def test_fast_json_fallback(self, mock_ujson):
+        """Anything ujson can't encode is left to json"""
+        mock_ujson.dumps.side_effect = TypeError
+        with self.settings(FAST_JSON=True):
+            self.assertEqual('{"a": 1}', responses.dumps({'a': 1}))
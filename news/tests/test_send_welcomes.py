@@ -1,11 +1,13 @@
+from django.core.cache import cache
 from django.test import TestCase
 
 from mock import patch
 
 from news.backends.common import NewsletterException
 from news.models import Newsletter
+from news.outbox import outbox_transaction
 from news.tasks import BasketError, confirm_user, mogrify_message_id, \
-    send_message
+    newsletter_message_ids, send_message, validate_message_ids
 
 
 class TestSendMessage(TestCase):
@@ -23,6 +25,86 @@ class TestSendMessage(TestCase):
             send_message(message_id, 'email', 'token', 'format')
         send_message(message_id, 'email', 'token', 'format')
 
+    @patch('news.tasks.statsd')
+    @patch('news.tasks.ExactTarget')
+    def test_duplicate_sends(self, mock_ExactTarget, statsd):
+        """The same welcome isn't sent to the same user twice in a row"""
+        cache.clear()
+        mock_et = mock_ExactTarget()
+        send_message('en_WELCOME', 'email', 'token', 'H', dedupe=True)
+        send_message('en_WELCOME', 'email', 'token', 'H', dedupe=True)
+        send_message('en_OTHER', 'email', 'token', 'H', dedupe=True)
+        send_message('en_WELCOME', 'email', 'token2', 'H', dedupe=True)
+        self.assertEqual(3, mock_et.trigger_send.call_count)
+        statsd.incr.assert_called_with('news.tasks.send_message.suppressed')
+
+    @patch('news.tasks.ExactTarget')
+    def test_other_sends_not_deduped(self, mock_ExactTarget):
+        """Messages users ask for again, like recovery emails, are sent
+        again"""
+        cache.clear()
+        mock_et = mock_ExactTarget()
+        send_message('en_RECOVERY', 'email', 'token', 'H')
+        send_message('en_RECOVERY', 'email', 'token', 'H')
+        self.assertEqual(2, mock_et.trigger_send.call_count)
+
+    @patch('news.tasks.outbox_send')
+    def test_rolled_back_send_not_deduped(self, outbox_send):
+        """A welcome whose outbox entry was rolled back can be sent by
+        the retry"""
+        cache.clear()
+        with self.settings(ET_OUTBOX=True):
+            with self.assertRaises(ValueError):
+                with outbox_transaction():
+                    send_message('en_WELCOME', 'email', 'token', 'H',
+                                 dedupe=True)
+                    raise ValueError
+            with outbox_transaction():
+                send_message('en_WELCOME', 'email', 'token', 'H',
+                             dedupe=True)
+        self.assertEqual(2, outbox_send.call_count)
+
+    @patch('news.tasks.ExactTarget')
+    def test_failed_send_not_deduped(self, mock_ExactTarget):
+        """A send that failed can be tried again"""
+        cache.clear()
+        mock_et = mock_ExactTarget()
+        mock_et.trigger_send.side_effect = [NewsletterException('Oops'), None]
+        with self.assertRaises(NewsletterException):
+            send_message('en_WELCOME', 'email', 'token', 'H', dedupe=True)
+        send_message('en_WELCOME', 'email', 'token', 'H', dedupe=True)
+        self.assertEqual(2, mock_et.trigger_send.call_count)
+
+
+class TestValidateMessageIds(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.newsletter = Newsletter.objects.create(
+            slug='slug', vendor_id='VENDOR', languages='en-US,fr',
+            welcome='WELCOME', confirm_message='CONFIRM')
+
+    def test_newsletter_message_ids(self):
+        """Every language and format of each message is checked"""
+        self.assertEqual(set([
+            'en_WELCOME', 'en_WELCOME_T', 'fr_WELCOME', 'fr_WELCOME_T',
+            'en_CONFIRM', 'en_CONFIRM_T', 'fr_CONFIRM', 'fr_CONFIRM_T',
+        ]), newsletter_message_ids(self.newsletter))
+
+    @patch('news.tasks.ExactTarget')
+    def test_bad_ids_not_sent(self, mock_ExactTarget):
+        """Message IDs ET doesn't have are found before they're sent"""
+        mock_et = mock_ExactTarget()
+        mock_et.get_triggered_send_keys.return_value = set([
+            'en_WELCOME', 'en_WELCOME_T', 'fr_WELCOME',
+            'en_CONFIRM', 'en_CONFIRM_T', 'fr_CONFIRM', 'fr_CONFIRM_T',
+        ])
+        self.assertEqual(['fr_WELCOME_T'],
+                         validate_message_ids([self.newsletter.pk]))
+        send_message('fr_WELCOME_T', 'email', 'token', 'T')
+        self.assertFalse(mock_et.trigger_send.called)
+        send_message('fr_WELCOME', 'email', 'token', 'H')
+        self.assertTrue(mock_et.trigger_send.called)
+
 
 class TestSendWelcomes(TestCase):
 
@@ -0,0 +1,27 @@
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from news.backends import exacttarget
+from news.startup import warm_up
+
+
+class WarmUpTest(TestCase):
+    def test_steps_timed(self):
+        """Every step runs, even after one fails"""
+        first = Mock(side_effect=ValueError)
+        second = Mock()
+        timings = warm_up(steps=(('first', first), ('second', second)))
+        self.assertTrue(first.called)
+        self.assertTrue(second.called)
+        self.assertEqual(['first', 'second'], [name for name, t in timings])
+
+    @patch('news.backends.exacttarget.Client')
+    def test_et_client_reused(self, Client):
+        """The client warm_up builds is the one requests use"""
+        self.addCleanup(setattr, exacttarget.logged_in, 'cached_client', None)
+        exacttarget.logged_in.cached_client = None
+        client = exacttarget.get_client('user', 'pass')
+        self.assertEqual(client, Client.return_value)
+        self.assertEqual(client, exacttarget.get_client('user', 'pass'))
+        self.assertEqual(1, Client.call_count)
@@ -1,11 +1,28 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+from urllib2 import HTTPError, URLError
+
 import celery
-from mock import Mock, patch
+from mock import ANY, Mock, patch
+from suds.transport import TransportError
 
+from django.core.cache import cache
+from django.http import QueryDict
 from django.test import TestCase
 
-from news.models import FailedTask, Subscriber
-from news.tasks import (RECOVERY_MESSAGE_ID, mogrify_message_id,
-    send_recovery_message_task, update_phonebook)
+from news.backends.common import NewsletterException, UnauthorizedException
+from news.models import FailedTask, Newsletter, Subscriber, TaskError
+from news.tasks import (ET_CIRCUIT_KEY, FailedTaskBuffer, QUEUED_AT_KWARG,
+    RECOVERY_MESSAGE_ID,
+    RETRY_AUTH, RETRY_DEFAULT, RETRY_THROTTLED, RETRY_TIMEOUT, SUBSCRIBE,
+    backoff_delay, et_circuit_closes_in, mogrify_message_id, pause_queue,
+    record_et_failure, resume_queue, retry_class, retry_failed_tasks,
+    send_recovery_message_task, task_queue, update_phonebook, update_user,
+    update_users_bulk)
 
 
 class FailedTaskTest(TestCase):
@@ -25,7 +42,53 @@ class FailedTaskTest(TestCase):
         self.assertEqual(args, fail.args)
         self.assertEqual(kwargs, fail.kwargs)
         self.assertEqual(u"Exception('Test exception',)", fail.exc)
-        self.assertIn("Exception: Test exception", fail.einfo)
+        self.assertIn("Exception: Test exception", fail.traceback())
+
+
+class FailedTaskBufferTest(TestCase):
+    """Test that failed tasks are saved together"""
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.buffer = FailedTaskBuffer()
+
+    def tearDown(self):
+        if self.buffer.timer:
+            self.buffer.timer.cancel()
+        shutil.rmtree(self.spool_dir)
+
+    def failure(self, task_id):
+        return {'task_id': task_id, 'name': 'news.tasks.update_phonebook',
+                'args': [1], 'kwargs': {}, 'exc': "Exception('Oops',)",
+                'einfo': u'Traceback...\nException: Oops', 'when': time.time()}
+
+    def test_buffer(self):
+        """Failures are spooled until there are enough to save"""
+        with self.settings(FAILED_TASK_SPOOL_DIR=self.spool_dir,
+                           FAILED_TASK_BUFFER_SIZE=2):
+            self.buffer.add(self.failure('1'))
+            self.assertEqual(0, FailedTask.objects.count())
+            self.assertTrue(os.path.exists(
+                self.buffer.spool_path(os.getpid())))
+            self.buffer.add(self.failure('2'))
+        self.assertEqual(2, FailedTask.objects.count())
+        # The traceback is only stored once
+        error = TaskError.objects.get()
+        self.assertEqual(u'Traceback...\nException: Oops', error.einfo)
+        self.assertEqual(u'Traceback...\nException: Oops',
+                         FailedTask.objects.get(task_id='1').traceback())
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    @patch('news.tasks.os.kill')
+    def test_dead_worker(self, kill):
+        """Failures spooled by a worker that died are saved"""
+        kill.side_effect = OSError('No such process')
+        with open(os.path.join(self.spool_dir,
+                               'failed-tasks-12345.json'), 'w') as spool:
+            spool.write(json.dumps(self.failure('1')) + '\n')
+        with self.settings(FAILED_TASK_SPOOL_DIR=self.spool_dir):
+            self.buffer.flush()
+        self.assertEqual('1', FailedTask.objects.get().task_id)
+        self.assertEqual([], os.listdir(self.spool_dir))
 
 
 class RetryTaskTest(TestCase):
@@ -54,6 +117,42 @@ class RetryTaskTest(TestCase):
         self.assertTrue(failed_task.delete.called)
 
 
+class BulkRetryTaskTest(TestCase):
+    """Test that we can retry lots of failed tasks at once"""
+    def setUp(self):
+        cache.clear()
+        for i, args in enumerate([[1], [2], [1], [3]]):
+            FailedTask.objects.create(name='news.tasks.update_phonebook',
+                                      task_id=str(i), args=args,
+                                      kwargs={'token': 3})
+
+    @patch('news.tasks.current_app')
+    @patch('news.tasks.subtask')
+    def test_retry_failed_tasks(self, subtask, current_app):
+        """Each distinct call is queued once, and all are deleted"""
+        progress = Mock()
+        counts = retry_failed_tasks(chunk_size=2, rate=0, progress=progress)
+        self.assertEqual({'total': 4, 'done': 4, 'queued': 3,
+                          'duplicates': 1}, counts)
+        self.assertEqual([[1], [2], [3]],
+                         [call[1]['args'] for call in subtask.call_args_list])
+        subtask.return_value.apply_async.assert_called_with(
+            connection=ANY)
+        # One connection per chunk
+        self.assertEqual(2, current_app.broker_connection.call_count)
+        self.assertEqual(2, progress.call_count)
+        self.assertEqual(0, FailedTask.objects.count())
+
+    @patch('news.tasks.current_app')
+    @patch('news.tasks.subtask')
+    def test_retry_some_failed_tasks(self, subtask, current_app):
+        """Only the chosen failed tasks are retried"""
+        ids = [FailedTask.objects.get(task_id='1').pk]
+        retry_failed_tasks(ids, rate=0)
+        self.assertEqual(1, subtask.call_count)
+        self.assertEqual(3, FailedTask.objects.count())
+
+
 @patch('news.tasks.send_message', autospec=True)
 @patch('news.views.look_for_user', autospec=True)
 class RecoveryMessageTask(TestCase):
@@ -116,3 +215,209 @@ class RecoveryMessageTask(TestCase):
         message_id = mogrify_message_id(RECOVERY_MESSAGE_ID, lang, format)
         mock_send.assert_called_with(message_id, self.email,
                                      subscriber.token, format)
+
+
+class QueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_task_queue(self):
+        """Tasks people are waiting on go on the interactive queue"""
+        with self.settings(CELERY_ROUTES={
+                'news.tasks.confirm_user': {'queue': 'interactive'}},
+                CELERY_DEFAULT_QUEUE='default'):
+            self.assertEqual('interactive',
+                             task_queue('news.tasks.confirm_user'))
+            self.assertEqual('default',
+                             task_queue('news.tasks.update_phonebook'))
+
+    @patch('news.tasks.broadcast')
+    @patch('news.tasks.ExactTarget')
+    def test_paused_queue(self, mock_exact_target, broadcast):
+        """Tasks from a paused queue are put back for later"""
+        queue = task_queue(update_phonebook.name)
+        pause_queue(queue)
+        broadcast.assert_called_with('cancel_consumer',
+                                     arguments={'queue': queue})
+        args = [{'city': 'Paris'}, 'foo@example.com', 'TOKEN']
+        with patch.object(update_phonebook, 'apply_async') as apply_async:
+            update_phonebook.apply(args=args)
+        apply_async.assert_called_with(tuple(args), {}, countdown=ANY)
+        # It keeps the time it was first queued
+        with patch.object(update_phonebook, 'apply_async') as apply_async:
+            update_phonebook.apply(args=args, kwargs={QUEUED_AT_KWARG: 100})
+        apply_async.assert_called_with(tuple(args), {QUEUED_AT_KWARG: 100},
+                                       countdown=ANY)
+        self.assertFalse(mock_exact_target.called)
+
+        resume_queue(queue)
+        update_phonebook.apply(args=args)
+        self.assertTrue(mock_exact_target.called)
+
+    @patch('news.tasks.statsd')
+    @patch('news.tasks.ExactTarget')
+    def test_queue_wait(self, mock_exact_target, statsd):
+        """The time a task waited for its first attempt goes to statsd"""
+        args = [{}, 'foo@example.com', 'TOKEN']
+        kwargs = {QUEUED_AT_KWARG: time.time() - 3600}
+        with self.settings(CELERY_QUEUE_SLO={
+                task_queue(update_phonebook.name): 60}):
+            update_phonebook.apply(args=args, kwargs=kwargs)
+        statsd.timing.assert_any_call(update_phonebook.name + '.queue_wait',
+                                      ANY)
+        statsd.incr.assert_any_call(
+            'queue.%s.slo_miss' % task_queue(update_phonebook.name))
+        # The timestamp isn't passed on to the task itself
+        mock_exact_target.return_value.data_ext.return_value.add_record.\
+            assert_called_with('PHONEBOOK', ANY, ANY)
+
+
+class TaskStepTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Newsletter.objects.create(slug='slug', vendor_id='VENDOR1',
+                                  languages='en', welcome='WELCOME',
+                                  requires_double_optin=False)
+
+    @patch('news.views.get_user_data')
+    @patch('news.tasks.ExactTarget')
+    def test_retry_skips_done_steps(self, mock_exact_target, get_user_data):
+        """A retried task doesn't redo the ET steps that worked"""
+        get_user_data.return_value = {
+            'status': 'ok',
+            'email': 'dude@example.com',
+            'token': 'TOKEN',
+            'lang': 'en',
+            'format': 'H',
+            'newsletters': [],
+            'confirmed': True,
+            'master': True,
+            'pending': False,
+        }
+        et = mock_exact_target.return_value
+        et.trigger_send.side_effect = [NewsletterException('timeout'), None]
+        update_user.apply(args=[{'newsletters': 'slug'}, 'dude@example.com',
+                                'TOKEN', False, SUBSCRIBE, True])
+        # The send was tried again, but the user was only read and
+        # written once.
+        self.assertEqual(2, et.trigger_send.call_count)
+        self.assertEqual(1, get_user_data.call_count)
+        self.assertEqual(1, et.data_ext.return_value.add_record.call_count)
+
+    @patch('news.views.get_user_data')
+    @patch('news.tasks.ExactTarget')
+    def test_called_directly(self, mock_exact_target, get_user_data):
+        """Calling a task function directly always does every step"""
+        get_user_data.return_value = None
+        data = {'newsletters': 'slug', 'lang': 'en'}
+        args = [data, 'dude@example.com', 'TOKEN', True, SUBSCRIBE, True]
+        with self.settings(SEND_DEDUPE_WINDOW=0):
+            update_user(*args)
+            update_user(*args)
+        et = mock_exact_target.return_value
+        self.assertEqual(2, et.data_ext.return_value.add_record.call_count)
+        self.assertEqual(2, et.trigger_send.call_count)
+
+
+class RetryPolicyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_retry_class(self):
+        self.assertEqual(RETRY_AUTH,
+                         retry_class(UnauthorizedException('Login Failed')))
+        self.assertEqual(RETRY_TIMEOUT,
+                         retry_class(URLError(socket.timeout('timed out'))))
+        self.assertEqual(RETRY_TIMEOUT, retry_class(socket.timeout()))
+        self.assertEqual(RETRY_THROTTLED, retry_class(
+            NewsletterException('Request was throttled')))
+        self.assertEqual(RETRY_THROTTLED, retry_class(
+            TransportError('Service Temporarily Down', 503)))
+        self.assertEqual(RETRY_THROTTLED, retry_class(
+            HTTPError('https://example.com/', 429, 'Slow down', {}, None)))
+        self.assertEqual(RETRY_DEFAULT,
+                         retry_class(NewsletterException('Error')))
+        # Numbers in the message don't count
+        self.assertEqual(RETRY_DEFAULT, retry_class(
+            NewsletterException('Invalid record 15039')))
+        self.assertEqual(RETRY_DEFAULT, retry_class(
+            NewsletterException(u'Caract\xe8re invalide')))
+
+    @patch('news.tasks.random.uniform')
+    def test_backoff_delay(self, uniform):
+        """The delay is jittered up to an exponential bound"""
+        uniform.side_effect = lambda low, high: high
+        self.assertEqual(60, backoff_delay(0, 60, 1800))
+        self.assertEqual(480, backoff_delay(3, 60, 1800))
+        self.assertEqual(1800, backoff_delay(10, 60, 1800))
+
+    def test_circuit(self):
+        """Enough failures open the circuit for a while"""
+        with self.settings(ET_CIRCUIT_THRESHOLD=3, ET_CIRCUIT_WINDOW=60,
+                           ET_CIRCUIT_OPEN_TIME=120):
+            record_et_failure()
+            record_et_failure()
+            self.assertEqual(0, et_circuit_closes_in())
+            record_et_failure()
+            self.assertTrue(0 < et_circuit_closes_in() <= 120)
+
+    @patch('news.tasks.statsd')
+    @patch('news.tasks.ExactTarget')
+    def test_retry_uses_policy(self, mock_exact_target, statsd):
+        """A retry's delay and limit come from its error's policy"""
+        mock_exact_target.side_effect = NewsletterException('Throttled')
+        policies = {
+            'default': {'base': 1, 'cap': 1, 'max_retries': 5},
+            'throttled': {'base': 100, 'cap': 100, 'max_retries': 0},
+        }
+        with self.settings(ET_RETRY_POLICIES=policies):
+            with patch.object(update_phonebook, 'retry') as retry:
+                update_phonebook.apply(args=[{}, 'foo@example.com', 'TOKEN'])
+        retry.assert_called_with(exc=ANY, countdown=ANY, max_retries=0)
+        self.assertTrue(0 <= retry.call_args[1]['countdown'] <= 100)
+
+    @patch('news.tasks.ExactTarget')
+    def test_retry_waits_for_circuit(self, mock_exact_target):
+        """Retries aren't scheduled before the ET circuit closes"""
+        mock_exact_target.side_effect = NewsletterException('Error')
+        cache.set(ET_CIRCUIT_KEY, time.time() + 600)
+        with patch.object(update_phonebook, 'retry') as retry:
+            update_phonebook.apply(args=[{}, 'foo@example.com', 'TOKEN'])
+        self.assertTrue(retry.call_args[1]['countdown'] > 590)
+
+
+class TaskPayloadTest(TestCase):
+    @patch('news.tasks.Task.apply_async')
+    def test_slim_data(self, apply_async):
+        """Only the data the task uses is sent to the broker"""
+        data = QueryDict('email=dude%40example.com&newsletters=slug1'
+                         '&country=us&csrfmiddlewaretoken=abc')
+        update_user.delay(data, 'dude@example.com', 'TOKEN', False,
+                          SUBSCRIBE, True)
+        args, kwargs = apply_async.call_args[0]
+        self.assertEqual({'newsletters': 'slug1', 'country': 'us'}, args[0])
+        self.assertEqual(['dude@example.com', 'TOKEN', False, SUBSCRIBE,
+                          True], args[1:])
+        self.assertNotIn('compression', apply_async.call_args[1])
+
+    @patch('news.tasks.Task.apply_async')
+    def test_compress_big_payloads(self, apply_async):
+        """Big task messages are gzipped"""
+        users = [{'email': 'user%d@example.com' % i, 'token': str(i),
+                  'data': {'newsletters': 'slug1'}} for i in range(20)]
+        with self.settings(ET_TASK_COMPRESS_OVER=100):
+            update_users_bulk.delay(users)
+        self.assertEqual('gzip', apply_async.call_args[1]['compression'])
+
+    @patch('news.tasks.payload_size')
+    @patch('news.tasks.Task.apply_async')
+    def test_payload_size_sampled(self, apply_async, payload_size):
+        """Small tasks' messages are only measured for the metric, and
+        only some of them"""
+        payload_size.return_value = 10
+        with self.settings(ET_PAYLOAD_SIZE_SAMPLE_RATE=0):
+            update_phonebook.delay({}, 'dude@example.com', 'TOKEN')
+        self.assertFalse(payload_size.called)
+        with self.settings(ET_PAYLOAD_SIZE_SAMPLE_RATE=1):
+            update_phonebook.delay({}, 'dude@example.com', 'TOKEN')
+        self.assertEqual(1, payload_size.call_count)
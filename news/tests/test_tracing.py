@@ -0,0 +1,64 @@
+import json
+
+from django.test import TestCase
+
+from mock import patch
+
+from news.backends.common import NewsletterException
+from news.tracing import NULL_SPAN, span, trace
+
+
+class TracingTest(TestCase):
+    @patch('news.tracing.statsd')
+    def test_trace(self, statsd):
+        """Each span is timed under its path in the tree"""
+        with self.settings(TRACE_SAMPLE_RATE=1):
+            with trace('task'):
+                with span('get_user_data'):
+                    with span('et.lookup.Master') as step:
+                        step.outcome = 'missing'
+                with span('et.add_record.Master'):
+                    pass
+        paths = [call[0][0] for call in statsd.timing.call_args_list]
+        self.assertEqual(['trace.task', 'trace.task.get_user_data',
+                          'trace.task.get_user_data.et.lookup.Master',
+                          'trace.task.et.add_record.Master'], paths)
+        statsd.incr.assert_called_once_with(
+            'trace.task.get_user_data.et.lookup.Master.missing')
+
+    @patch('news.tracing.statsd')
+    def test_error_outcome(self, statsd):
+        """A span that raises has the exception as its outcome"""
+        with self.settings(TRACE_SAMPLE_RATE=1):
+            with self.assertRaises(NewsletterException):
+                with trace('task'):
+                    with span('et.trigger_send'):
+                        raise NewsletterException('Oops')
+        statsd.incr.assert_any_call(
+            'trace.task.et.trigger_send.NewsletterException')
+        statsd.incr.assert_any_call('trace.task.NewsletterException')
+
+    @patch('news.tracing.statsd')
+    def test_not_sampled(self, statsd):
+        """Calls that aren't sampled aren't traced"""
+        with self.settings(TRACE_SAMPLE_RATE=0):
+            with trace('task') as root:
+                with span('step') as step:
+                    pass
+        self.assertIs(NULL_SPAN, root)
+        self.assertIs(NULL_SPAN, step)
+        self.assertFalse(statsd.timing.called)
+
+    @patch('news.tracing.log')
+    @patch('news.tracing.statsd')
+    def test_log(self, statsd, log):
+        """Traces can be logged as JSON"""
+        with self.settings(TRACE_SAMPLE_RATE=1, TRACE_LOG=True):
+            with trace('task', token='TOKEN'):
+                with span('step'):
+                    pass
+        logged = json.loads(log.info.call_args[0][0])
+        self.assertEqual('task', logged['name'])
+        self.assertEqual({'token': 'TOKEN'}, logged['info'])
+        self.assertEqual(['step'],
+                         [child['name'] for child in logged['children']])
@@ -2,6 +2,7 @@ import datetime
 import json
 
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.utils.unittest import skip
@@ -10,9 +11,9 @@ from mock import patch, ANY
 
 from news import models, views, tasks
 from news.backends.common import NewsletterException
+from news.newsletters import FFAY_VENDOR_ID, FFOS_VENDOR_ID
 from news.tasks import update_user, SUBSCRIBE, UU_EXEMPT_NEW, \
-    UU_ALREADY_CONFIRMED, SET, FFOS_VENDOR_ID, \
-    FFAY_VENDOR_ID, MSG_EMAIL_OR_TOKEN_REQUIRED, UNSUBSCRIBE
+    UU_ALREADY_CONFIRMED, SET, MSG_EMAIL_OR_TOKEN_REQUIRED, UNSUBSCRIBE
 
 
 class UpdateUserTest(TestCase):
@@ -49,7 +50,7 @@ class UpdateUserTest(TestCase):
         """
         # Fake an incoming request which we've already looked up and
         # found a corresponding subscriber for
-        req = self.rf.post('/testing/', {'stuff': 'whanot'})
+        req = self.rf.post('/testing/', {'stuff': 'whanot', 'format': 'T'})
         req.subscriber = self.sub
         # Call update_user to subscribe
         resp = views.update_user_task(req, tasks.SUBSCRIBE)
@@ -62,8 +63,9 @@ class UpdateUserTest(TestCase):
             'created': False,
         })
         # We should have called update_user with the email, token,
-        # created=False, type=SUBSCRIBE, optin=True
-        uu_mock.assert_called_with({'stuff': ['whanot']},
+        # created=False, type=SUBSCRIBE, optin=True, and only the data
+        # it uses
+        uu_mock.assert_called_with({'format': 'T'},
                                    self.sub.email, self.sub.token,
                                    False, tasks.SUBSCRIBE, True)
 
@@ -88,7 +90,7 @@ class UpdateUserTest(TestCase):
         })
         # We should have called update_user with the email, token,
         # created=False, type=SUBSCRIBE, optin=True
-        uu_mock.assert_called_with({'email': [self.sub.email]},
+        uu_mock.assert_called_with({},
                                    self.sub.email, self.sub.token,
                                    False, tasks.SUBSCRIBE, True)
 
@@ -116,7 +118,7 @@ class UpdateUserTest(TestCase):
         })
         # We should have called update_user with the email, token,
         # created=False, type=SUBSCRIBE, optin=True
-        uu_mock.assert_called_with({'email': [sub.email]},
+        uu_mock.assert_called_with({},
                                    sub.email, sub.token,
                                    True, tasks.SUBSCRIBE, True)
 
@@ -126,7 +128,7 @@ class UpdateUserTest(TestCase):
         Should not call the task if no email or token provided.
         """
         # Pretend there was no email given - bad request
-        req = self.rf.post('/testing/', {'stuff': 'whanot'})
+        req = self.rf.post('/testing/', {'stuff': 'whanot', 'format': 'T'})
         resp = views.update_user_task(req, tasks.SUBSCRIBE)
         # We don't try to call update_user
         self.assertFalse(uu_mock.called)
@@ -943,3 +945,217 @@ class UpdateUserTest(TestCase):
              'EMAIL_ADDRESS_': 'dude@example.com',
              'TOKEN': ANY}
         )
+
+
+class CoalescedUpdateUserTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sub = models.Subscriber.objects.create(email='dude@example.com')
+        for n in (1, 2, 3):
+            models.Newsletter.objects.create(
+                slug='slug%d' % n,
+                title='title%d' % n,
+                languages='en',
+                welcome='WELCOME%d' % n,
+                vendor_id='VENDOR%d' % n,
+            )
+        self.get_user_data = {
+            'email': self.sub.email,
+            'format': 'H',
+            'lang': 'en',
+            'token': self.sub.token,
+            'newsletters': ['slug3'],
+            'confirmed': True,
+            'master': True,
+            'pending': False,
+            'status': 'ok',
+        }
+
+    @patch('news.tasks.apply_updates')
+    @patch('news.tasks.send_message')
+    @patch('news.views.get_user_data')
+    def test_merged_updates(self, get_user_data, send_message,
+                            apply_updates):
+        """Updates are applied in order with one read and one write, and
+        welcomes are only sent for the net new subscriptions"""
+        get_user_data.return_value = self.get_user_data
+        updates = [
+            ({'newsletters': 'slug1,slug2', 'format': 'T'}, SUBSCRIBE),
+            ({'newsletters': 'slug1,slug3'}, UNSUBSCRIBE),
+            ({'newsletters': 'slug3', 'lang': 'en'}, SUBSCRIBE),
+        ]
+        rc = tasks.update_user_merged(self.sub.email, self.sub.token,
+                                      updates)
+        self.assertEqual(UU_ALREADY_CONFIRMED, rc)
+        self.assertEqual(1, get_user_data.call_count)
+        self.assertEqual(1, apply_updates.call_count)
+        record = apply_updates.call_args[0][1]
+        # slug1 and slug3 ended up where they started
+        self.assertEqual('Y', record['VENDOR2_FLG'])
+        self.assertNotIn('VENDOR1_FLG', record)
+        self.assertNotIn('VENDOR3_FLG', record)
+        self.assertEqual('T', record['EMAIL_FORMAT_'])
+        self.assertEqual('en', record['LANGUAGE_ISO2'])
+        send_message.assert_called_once_with('en_WELCOME2_T', self.sub.email,
+                                             self.sub.token, 'T')
+
+    @patch('news.tasks.update_user_merged.delay')
+    @patch('news.tasks.flush_user_updates.apply_async')
+    @patch('news.tasks.update_user.delay')
+    def test_queue_update_user(self, uu_mock, flush_mock, merged_mock):
+        """With a coalescing window, calls for a user are held and handed
+        to update_user_merged together"""
+        with self.settings(UPDATE_USER_COALESCE_WINDOW=10):
+            tasks.queue_update_user({'newsletters': 'slug1'}, self.sub.email,
+                                    self.sub.token, False, SUBSCRIBE, True)
+            tasks.queue_update_user({'newsletters': 'slug2'}, self.sub.email,
+                                    self.sub.token, False, UNSUBSCRIBE, True)
+        self.assertFalse(uu_mock.called)
+        first, second = [args for args, kwargs in flush_mock.call_args_list]
+        self.assertEqual((self.sub.token, 1), first[0][:2])
+        self.assertEqual({'countdown': 10}, flush_mock.call_args[1])
+        tasks.flush_user_updates(*first[0])
+        merged_mock.assert_called_once_with(self.sub.email, self.sub.token, [
+            ({'newsletters': 'slug1'}, SUBSCRIBE),
+            ({'newsletters': 'slug2'}, UNSUBSCRIBE),
+        ])
+        # The second call's flush finds nothing left to do
+        merged_mock.reset_mock()
+        tasks.flush_user_updates(*second[0])
+        self.assertFalse(merged_mock.called)
+
+    @patch('news.tasks.update_user_merged.delay')
+    @patch('news.tasks.flush_user_updates.apply_async')
+    def test_queued_update_lost(self, flush_mock, merged_mock):
+        """A call the cache has lost is applied from its own flush, and
+        the calls after it wait for it"""
+        with self.settings(UPDATE_USER_COALESCE_WINDOW=10):
+            tasks.queue_update_user({'newsletters': 'slug1'}, self.sub.email,
+                                    self.sub.token, False, SUBSCRIBE, True)
+            tasks.queue_update_user({'newsletters': 'slug2'}, self.sub.email,
+                                    self.sub.token, False, UNSUBSCRIBE, True)
+        first, second = [args[0] for args, kwargs
+                         in flush_mock.call_args_list]
+        cache.delete(tasks._queued_update_key(1, self.sub.token))
+        flush_mock.reset_mock()
+        # The second call's flush runs first and waits
+        tasks.flush_user_updates(*second)
+        self.assertFalse(merged_mock.called)
+        flush_mock.assert_called_once_with(second + (1,), countdown=5)
+        tasks.flush_user_updates(*first)
+        merged_mock.assert_called_once_with(self.sub.email, self.sub.token, [
+            ({'newsletters': 'slug1'}, SUBSCRIBE),
+            ({'newsletters': 'slug2'}, UNSUBSCRIBE),
+        ])
+        merged_mock.reset_mock()
+        tasks.flush_user_updates(*(second + (1,)))
+        self.assertFalse(merged_mock.called)
+
+    @patch('news.tasks.update_user_merged.delay')
+    @patch('news.tasks.flush_user_updates.apply_async')
+    def test_queued_update_gives_up_waiting(self, flush_mock, merged_mock):
+        """A predecessor that never turns up is skipped, so it doesn't
+        hold up the calls after it"""
+        cache.set(tasks._queued_update_key('seq', self.sub.token), 1)
+        with self.settings(UPDATE_USER_COALESCE_WINDOW=10):
+            tasks.queue_update_user({'newsletters': 'slug2'}, self.sub.email,
+                                    self.sub.token, False, UNSUBSCRIBE, True)
+            args = flush_mock.call_args[0][0]
+            tasks.queue_update_user({'newsletters': 'slug1'}, self.sub.email,
+                                    self.sub.token, False, SUBSCRIBE, True)
+            later_args = flush_mock.call_args[0][0]
+        self.assertEqual(2, args[1])
+        tasks.flush_user_updates(*args)
+        self.assertFalse(merged_mock.called)
+        tasks.flush_user_updates(*(args + (tasks.UPDATE_USER_FLUSH_WAITS,)))
+        merged_mock.assert_called_once_with(self.sub.email, self.sub.token, [
+            ({'newsletters': 'slug2'}, UNSUBSCRIBE),
+            ({'newsletters': 'slug1'}, SUBSCRIBE),
+        ])
+        self.assertEqual(3, cache.get(
+            tasks._queued_update_key('done', self.sub.token)))
+        merged_mock.reset_mock()
+        tasks.flush_user_updates(*args)
+        tasks.flush_user_updates(*later_args)
+        self.assertFalse(merged_mock.called)
+
+    @patch('news.tasks.flush_user_updates.apply_async')
+    @patch('news.tasks.update_user.delay')
+    def test_queue_update_user_no_window(self, uu_mock, flush_mock):
+        """Without a coalescing window, update_user is queued directly"""
+        with self.settings(UPDATE_USER_COALESCE_WINDOW=0):
+            tasks.queue_update_user({'newsletters': 'slug1'}, self.sub.email,
+                                    self.sub.token, False, SUBSCRIBE, True)
+        uu_mock.assert_called_with({'newsletters': 'slug1'}, self.sub.email,
+                                   self.sub.token, False, SUBSCRIBE, True)
+        self.assertFalse(flush_mock.called)
+
+
+class BulkUpdateUserTest(TestCase):
+    def setUp(self):
+        models.Newsletter.objects.create(slug='slug1', vendor_id='VENDOR1',
+                                         languages='en',
+                                         welcome='WELCOME1',
+                                         requires_double_optin=False)
+
+    @patch('news.tasks.send_message')
+    @patch('news.tasks.apply_bulk_updates')
+    @patch('news.views.get_users_data')
+    def test_update_users_bulk(self, get_users_data, apply_bulk_updates,
+                               send_message):
+        """Users are read from ET together and written to ET together"""
+        get_users_data.return_value = {
+            'token1': {
+                'status': 'ok',
+                'email': 'one@example.com',
+                'token': 'token1',
+                'lang': 'en',
+                'format': 'H',
+                'newsletters': [],
+                'confirmed': True,
+                'master': True,
+                'pending': False,
+            },
+            'token2': None,
+        }
+        users = [
+            {'email': 'one@example.com', 'token': 'token1',
+             'data': {'newsletters': 'slug1'}},
+            {'email': 'two@example.com', 'token': 'token2',
+             'data': {'newsletters': 'slug1', 'lang': 'en'}},
+        ]
+        tasks.update_users_bulk(users)
+        get_users_data.assert_called_once_with(tokens=['token1', 'token2'])
+        # Both go to the master database (one confirmed, one exempt)
+        # in a single call
+        apply_bulk_updates.assert_called_once_with(settings.EXACTTARGET_DATA,
+                                                   ANY)
+        records = apply_bulk_updates.call_args[0][1]
+        self.assertEqual(['token1', 'token2'],
+                         [record['TOKEN'] for record in records])
+        self.assertEqual(2, send_message.call_count)
+
+    @patch('news.tasks.apply_user_updates')
+    @patch('news.views.get_users_data')
+    def test_update_users_bulk_repeated(self, get_users_data,
+                                        apply_user_updates):
+        """A user who's in the chunk twice has their updates merged"""
+        get_users_data.return_value = {'token1': None, 'token2': None}
+        tasks.update_users_bulk([
+            {'email': 'one@example.com', 'token': 'token1',
+             'data': {'newsletters': 'slug1'}},
+            {'email': 'two@example.com', 'token': 'token2',
+             'data': {'newsletters': 'slug1'}},
+            {'email': 'One@example.com', 'token': 'token1',
+             'data': {'newsletters': 'slug2'}},
+        ])
+        get_users_data.assert_called_once_with(tokens=['token1', 'token2'])
+        self.assertEqual([
+            (('One@example.com', 'token1', [
+                ({'newsletters': 'slug1'}, SUBSCRIBE),
+                ({'newsletters': 'slug2'}, SUBSCRIBE),
+            ], ANY), {}),
+            (('two@example.com', 'token2', [
+                ({'newsletters': 'slug1'}, SUBSCRIBE),
+            ], ANY), {}),
+        ], apply_user_updates.call_args_list)
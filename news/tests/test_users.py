@@ -394,3 +394,74 @@ class TestLookupUser(TestCase):
         }
         rsp = self.ssl_get(params)
         self.assertEqual(404, rsp.status_code, rsp.content)
+
+
+class TestLookupUsers(TestCase):
+    """test for API lookup-users"""
+
+    def setUp(self):
+        self.auth = APIUser.objects.create(name="test")
+        self.url = reverse('lookup_users')
+
+    def ssl_post(self, body, api_key=None):
+        return self.client.post(
+            self.url + '?api-key=%s' % (api_key or self.auth.api_key),
+            json.dumps(body),
+            content_type='application/json',
+            **{'wsgi.url_scheme': 'https'})
+
+    def test_not_ssl(self):
+        rsp = self.client.post(self.url, '{}',
+                               content_type='application/json')
+        self.assertEqual(401, rsp.status_code, rsp.content)
+
+    def test_bad_api_key(self):
+        rsp = self.ssl_post({'tokens': ['dummy']}, api_key='BAD KEY')
+        self.assertEqual(401, rsp.status_code, rsp.content)
+
+    def test_bad_body(self):
+        """Exactly one list of tokens or emails is needed"""
+        for body in ({}, {'tokens': ['a'], 'emails': ['a@example.com']},
+                     {'tokens': 'a'}, {'tokens': [1]}, ['a']):
+            rsp = self.ssl_post(body)
+            self.assertEqual(400, rsp.status_code, rsp.content)
+
+    def test_too_many(self):
+        with self.settings(BULK_LOOKUP_MAX_KEYS=1):
+            rsp = self.ssl_post({'tokens': ['a', 'b']})
+        self.assertEqual(400, rsp.status_code, rsp.content)
+
+    @patch('news.views.get_users_data')
+    def test_with_tokens(self, get_users_data):
+        """Each token gets what lookup_user would return for it, and
+        they're looked up in chunks"""
+        error = {'status': 'error', 'status_code': 400,
+                 'desc': 'Oops', 'code': errors.BASKET_NETWORK_FAILURE}
+        get_users_data.side_effect = [
+            {'a': {'status': 'ok', 'token': 'a'}, 'b': None},
+            {'c': error},
+        ]
+        with self.settings(BULK_LOOKUP_CHUNK_SIZE=2):
+            rsp = self.ssl_post({'tokens': ['a', 'b', 'a', 'c']})
+        self.assertEqual(200, rsp.status_code, rsp.content)
+        self.assertEqual({
+            'status': 'ok',
+            'results': {
+                'a': {'status': 'ok', 'token': 'a', 'status_code': 200},
+                'b': {'status': 'error', 'status_code': 404,
+                      'desc': tasks.MSG_USER_NOT_FOUND,
+                      'code': errors.BASKET_UNKNOWN_TOKEN},
+                'c': error,
+            },
+        }, json.loads(rsp.content))
+        self.assertEqual([((), {'tokens': ['a', 'b']}),
+                          ((), {'tokens': ['c']})],
+                         get_users_data.call_args_list)
+
+    @patch('news.views.get_users_data')
+    def test_with_emails(self, get_users_data):
+        get_users_data.return_value = {}
+        rsp = self.ssl_post({'emails': ['mail@example.com']})
+        self.assertEqual(errors.BASKET_UNKNOWN_EMAIL, json.loads(
+            rsp.content)['results']['mail@example.com']['code'])
+        get_users_data.assert_called_once_with(emails=['mail@example.com'])
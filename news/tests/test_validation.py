@@ -0,0 +1,79 @@
+import json
+
+from django.test import TestCase
+
+from basket import errors
+from mock import patch
+
+from news import validation
+from news.validation import (Validator, check_lookup_user,
+                             check_lookup_users, check_subscribe_sms,
+                             check_update_user, clean_mobile_number,
+                             email_is_valid, present)
+
+
+class ValidatorTest(TestCase):
+    def test_first_error(self):
+        """The error from the first check that fails is returned"""
+        check = Validator(
+            present('a', 'a is missing'),
+            present(('a', 'b'), 'b is missing'),
+        )
+        self.assertEqual(None, check({'a': '', 'b': ''}))
+        body, status = check({})
+        data = json.loads(body)
+        self.assertEqual(('a is missing', errors.BASKET_USAGE_ERROR, 400),
+                         (data['desc'], data['code'], status))
+        self.assertEqual('b is missing',
+                         json.loads(check({'a': ''})[0])['desc'])
+
+    @patch('news.validation.newsletter_languages')
+    @patch('news.validation.newsletter_slug_set')
+    def test_update_user(self, slug_set, languages):
+        slug_set.return_value = frozenset(['one', 'two'])
+        languages.return_value = frozenset(['en-US', 'fr'])
+        self.assertEqual(None, check_update_user({
+            'newsletters': 'one, two',
+            'lang': 'EN',
+        }))
+        self.assertEqual(errors.BASKET_INVALID_NEWSLETTER, json.loads(
+            check_update_user({'newsletters': 'one,three'})[0])['code'])
+        self.assertEqual(errors.BASKET_INVALID_LANGUAGE, json.loads(
+            check_update_user({'lang': 'de'})[0])['code'])
+
+    def test_lookup_user(self):
+        """Exactly one of email and token is needed"""
+        self.assertEqual(None, check_lookup_user({'token': 'TOKEN'}))
+        self.assertEqual(None, check_lookup_user({'email': 'a@example.com',
+                                                  'token': ''}))
+        self.assertTrue(check_lookup_user({}))
+        self.assertTrue(check_lookup_user({'email': 'a@example.com',
+                                           'token': 'TOKEN'}))
+
+    def test_lookup_users(self):
+        """Exactly one list of tokens or emails is needed"""
+        self.assertEqual(None, check_lookup_users({'tokens': ['TOKEN']}))
+        self.assertEqual(None, check_lookup_users({'emails':
+                                                   ['a@example.com']}))
+        self.assertTrue(check_lookup_users({}))
+        self.assertTrue(check_lookup_users({'tokens': ['TOKEN'],
+                                            'emails': ['a@example.com']}))
+
+    def test_mobile_number(self):
+        self.assertEqual('15555551234', clean_mobile_number('(555) 555-1234'))
+        self.assertEqual('15555551234', clean_mobile_number('1-555-555-1234'))
+        self.assertEqual(None, clean_mobile_number('2-555-555-1234'))
+        self.assertEqual(None, clean_mobile_number('555-1234'))
+        self.assertEqual(None, check_subscribe_sms({'mobile_number':
+                                                    '5555551234'}))
+        self.assertEqual(
+            'mobile_number is missing',
+            json.loads(check_subscribe_sms({})[0])['desc'])
+
+    @patch('news.validation.validate_email')
+    def test_email_cached(self, validate_email):
+        """Each address is only checked once"""
+        validation._email_cache.clear()
+        self.assertTrue(email_is_valid('dude@example.com'))
+        self.assertTrue(email_is_valid('dude@example.com'))
+        self.assertEqual(1, validate_email.call_count)
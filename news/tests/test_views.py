@@ -1,4 +1,6 @@
+import gzip
 import json
+from StringIO import StringIO
 
 from django.core.urlresolvers import reverse
 from django.test import TestCase
@@ -152,6 +154,47 @@ class TestNewslettersAPI(TestCase):
         for lang in ['en-US', 'fr']:
             self.assertIn(lang, obj['languages'])
 
+    def test_newsletters_etag(self):
+        """Sending back the ETag gets a 304 without hitting the DB"""
+        models.Newsletter.objects.create(slug='slug', vendor_id='VENDOR1')
+        resp = views.newsletters(self.rf.get(self.url))
+        self.assertEqual(200, resp.status_code)
+        etag = resp['ETag']
+        self.assertIn('Accept-Encoding', resp['Vary'])
+
+        req = self.rf.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(0):
+            resp = views.newsletters(req)
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(etag, resp['ETag'])
+
+        # Changing a newsletter changes the ETag
+        models.Newsletter.objects.create(slug='slug2', vendor_id='VENDOR2')
+        resp = views.newsletters(req)
+        self.assertEqual(200, resp.status_code)
+        self.assertNotEqual(etag, resp['ETag'])
+
+    def test_newsletters_gzip(self):
+        """Clients that accept gzip get the same data gzipped"""
+        models.Newsletter.objects.create(slug='slug', vendor_id='VENDOR1')
+        plain = views.newsletters(self.rf.get(self.url))
+        req = self.rf.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        resp = views.newsletters(req)
+        self.assertEqual('gzip', resp['Content-Encoding'])
+        self.assertNotEqual(plain['ETag'], resp['ETag'])
+        content = gzip.GzipFile(fileobj=StringIO(resp.content)).read()
+        self.assertEqual(plain.content, content)
+
+    def test_accepts_gzip(self):
+        """gzip is only sent when its q-value isn't 0"""
+        self.assertTrue(views.accepts_gzip('gzip, deflate'))
+        self.assertTrue(views.accepts_gzip('deflate, GZIP;q=0.5'))
+        self.assertTrue(views.accepts_gzip('*'))
+        self.assertFalse(views.accepts_gzip('gzip;q=0, deflate'))
+        self.assertFalse(views.accepts_gzip('gzip; q=0.0, *'))
+        self.assertFalse(views.accepts_gzip('identity'))
+        self.assertFalse(views.accepts_gzip(''))
+
     def test_strip_languages(self):
         # If someone edits Newsletter and puts whitespace in the languages
         # field, we strip it on save
@@ -252,48 +295,48 @@ class TestNewslettersAPI(TestCase):
 
 
 class TestLanguageCodeIsValid(TestCase):
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_empty_string(self, n_l):
         """Empty string is accepted as a language code"""
         self.assertTrue(language_code_is_valid(''))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_none(self, n_l):
         """None is a TypeError"""
         with self.assertRaises(TypeError):
             language_code_is_valid(None)
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_zero(self, n_l):
         """0 is a TypeError"""
         with self.assertRaises(TypeError):
             language_code_is_valid(0)
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_exact_2_letter(self, n_l):
         """2-letter code that's in the list is valid"""
         n_l.return_value = ['az']
         self.assertTrue(language_code_is_valid('az'))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_exact_5_letter(self, n_l):
         """5-letter code that's in the list is valid"""
         n_l.return_value = ['az-BY']
         self.assertTrue(language_code_is_valid('az-BY'))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_prefix(self, n_l):
         """2-letter code that's a prefix of something in the list is valid"""
         n_l.return_value = ['az-BY']
         self.assertTrue(language_code_is_valid('az'))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_long_version(self, n_l):
         """5-letter code is valid if an entry in the list is a prefix of it"""
         n_l.return_value = ['az']
         self.assertTrue(language_code_is_valid('az-BY'))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_case_insensitive(self, n_l):
         """Matching is not case sensitive"""
         n_l.return_value = ['aZ', 'Qw-wE']
@@ -301,7 +344,7 @@ class TestLanguageCodeIsValid(TestCase):
         self.assertTrue(language_code_is_valid('az'))
         self.assertTrue(language_code_is_valid('QW'))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_wrong_length(self, n_l):
         """A code that's a prefix of something in the list, but not a valid
         length, is not valid. Or vice-versa."""
@@ -310,7 +353,7 @@ class TestLanguageCodeIsValid(TestCase):
         self.assertFalse(language_code_is_valid('a'))
         self.assertFalse(language_code_is_valid('az-BY2'))
 
-    @patch('news.views.newsletter_languages')
+    @patch('news.validation.newsletter_languages')
     def test_no_match(self, n_l):
         """Return False if there's no match any way we try."""
         n_l.return_value = ['az']
@@ -351,3 +394,119 @@ class RecoveryViewTest(TestCase):
         resp = self.client.post(self.url, {'email': email})
         self.assertEqual(200, resp.status_code)
         mock_send_recovery_message_task.assert_called_with(email)
+
+
+class BulkSubscribeTest(TestCase):
+    def setUp(self):
+        self.url = reverse('subscribe_bulk')
+        self.auth = models.APIUser.objects.create(name="test")
+        Newsletter.objects.create(slug='slug1', vendor_id='VENDOR1',
+                                  languages='en,fr')
+        Newsletter.objects.create(slug='slug2', vendor_id='VENDOR2',
+                                  languages='en')
+        self.existing = models.Subscriber.objects.create(
+            email='dude@example.com')
+
+    def ssl_post(self, records, api_key=None):
+        return self.client.post(
+            self.url + '?api-key=%s' % (api_key or self.auth.api_key),
+            json.dumps({'records': records}),
+            content_type='application/json',
+            **{'wsgi.url_scheme': 'https'})
+
+    def test_not_ssl(self):
+        resp = self.client.post(self.url, '{}',
+                                content_type='application/json')
+        self.assertEqual(401, resp.status_code)
+
+    def test_bad_api_key(self):
+        resp = self.ssl_post([], api_key='BAD KEY')
+        self.assertEqual(401, resp.status_code)
+
+    def test_too_many_records(self):
+        with self.settings(BULK_SUBSCRIBE_MAX_RECORDS=1):
+            resp = self.ssl_post([{}, {}])
+        self.assertEqual(400, resp.status_code)
+
+    @patch('news.views.get_users_data')
+    @patch('news.views.update_users_bulk.delay')
+    def test_email_case(self, bulk_mock, get_users_data):
+        """Emails that differ only in case are the same subscriber"""
+        get_users_data.side_effect = lambda emails: dict(
+            (email, None) for email in emails)
+        resp = self.ssl_post([
+            {'email': 'New@Example.com', 'newsletters': 'slug1'},
+            {'email': 'new@example.com', 'newsletters': 'slug2'},
+        ])
+        results = json.loads(resp.content)['results']
+        self.assertEqual(['ok', 'ok'], [r['status'] for r in results])
+        self.assertEqual(results[0]['token'], results[1]['token'])
+        self.assertEqual(1, len(get_users_data.call_args[1]['emails']))
+        self.assertEqual(1, models.Subscriber.objects.filter(
+            token=results[0]['token']).count())
+
+    @patch('news.views.get_users_data')
+    @patch('news.views.update_users_bulk.delay')
+    def test_bulk_subscribe(self, bulk_mock, get_users_data):
+        """Each record gets its own result, and the valid ones are queued
+        in chunks"""
+        get_users_data.return_value = {
+            'new@example.com': None,
+            'inet@example.com': {'status': 'ok', 'token': 'ET-TOKEN'},
+        }
+        records = [
+            {'email': 'dude@example.com', 'newsletters': 'slug1,slug2',
+             'lang': 'fr', 'format': 'T'},
+            {'email': 'new@example.com', 'newsletters': ['slug2']},
+            {'email': 'inet@example.com', 'newsletters': 'slug1'},
+            {'email': 'not an email', 'newsletters': 'slug1'},
+            {'email': 'bad@example.com', 'newsletters': 'slug1,nope'},
+            {'email': 'bad@example.com', 'newsletters': 'slug1',
+             'lang': 'zz'},
+        ]
+        with self.settings(BULK_SUBSCRIBE_CHUNK_SIZE=2):
+            resp = self.ssl_post(records)
+        self.assertEqual(200, resp.status_code)
+        results = json.loads(resp.content)['results']
+        self.assertEqual(6, len(results))
+        self.assertEqual({'status': 'ok', 'token': self.existing.token,
+                          'created': False}, results[0])
+        new_sub = models.Subscriber.objects.get(email='new@example.com')
+        self.assertEqual({'status': 'ok', 'token': new_sub.token,
+                          'created': True}, results[1])
+        self.assertEqual('ET-TOKEN', results[2]['token'])
+        self.assertEqual(['error'] * 3, [r['status'] for r in results[3:]])
+        # Only unknown emails were looked up in ET, all at once
+        get_users_data.assert_called_once_with(emails=ANY)
+        self.assertEqual(set(['new@example.com', 'inet@example.com']),
+                         set(get_users_data.call_args[1]['emails']))
+        # Three valid records in chunks of two
+        self.assertEqual(2, bulk_mock.call_count)
+        first_chunk = bulk_mock.call_args_list[0][0][0]
+        self.assertEqual({
+            'email': 'dude@example.com',
+            'token': self.existing.token,
+            'data': {'newsletters': 'slug1,slug2', 'lang': 'fr',
+                     'format': 'T'},
+        }, first_chunk[0])
+
+    @patch('news.views.get_users_data')
+    @patch('news.views.update_users_bulk.delay')
+    def test_repeated_email(self, bulk_mock, get_users_data):
+        """A subscriber's records all go in the same chunk"""
+        get_users_data.return_value = {'new@example.com': None}
+        with self.settings(BULK_SUBSCRIBE_CHUNK_SIZE=1):
+            resp = self.ssl_post([
+                {'email': 'dude@example.com', 'newsletters': 'slug1'},
+                {'email': 'new@example.com', 'newsletters': 'slug1'},
+                {'email': 'Dude@example.com', 'newsletters': 'slug2'},
+            ])
+        results = json.loads(resp.content)['results']
+        self.assertEqual(['ok'] * 3, [r['status'] for r in results])
+        self.assertEqual(2, bulk_mock.call_count)
+        first_chunk = bulk_mock.call_args_list[0][0][0]
+        self.assertEqual([self.existing.token] * 2,
+                         [record['token'] for record in first_chunk])
+        self.assertEqual(['slug1', 'slug2'],
+                         [record['data']['newsletters']
+                          for record in first_chunk])
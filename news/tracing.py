@@ -0,0 +1,152 @@
+"""
+Lightweight tracing of where the time goes in a task or request.
+
+A trace is a tree of timed spans. ``trace(name)`` starts one (for a
+sample of calls, per settings.TRACE_SAMPLE_RATE) and ``span(name)``
+adds a step to the trace that's running, if any, so spans cost next to
+nothing when the call isn't being traced::
+
+    with trace('news.tasks.update_user'):
+        with span('et.lookup.Master_Subscribers') as step:
+            ...
+            step.outcome = 'missing'
+
+When a trace ends, each span is sent to statsd as a timing named for
+its path in the tree, e.g.
+``trace.news.tasks.update_user.get_user_data.et.lookup.Master_Subscribers``,
+and spans that didn't end 'ok' are counted as
+``<path>.<outcome>``. With settings.TRACE_LOG, the whole tree is also
+logged as one line of JSON.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django_statsd.clients import statsd
+
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Span(object):
+    """One timed step of a trace"""
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.outcome = 'ok'
+        self.children = []
+        self.start = time.time()
+        self.duration = None
+
+    def walk(self, prefix=''):
+        """Yield (path, span) for this span and all those under it"""
+        path = prefix + self.name
+        yield path, self
+        for child in self.children:
+            for item in child.walk(path + '.'):
+                yield item
+
+    def as_dict(self):
+        data = {
+            'name': self.name,
+            'ms': int(self.duration * 1000),
+            'outcome': self.outcome,
+        }
+        if self.info:
+            data['info'] = self.info
+        if self.children:
+            data['children'] = [child.as_dict() for child in self.children]
+        return data
+
+
+class _NullSpan(object):
+    """Stands in for a Span when nothing is being traced"""
+    outcome = None
+    info = {}
+
+
+NULL_SPAN = _NullSpan()
+
+
+def current_span():
+    """Return the span that's running, or NULL_SPAN"""
+    return getattr(_local, 'span', None) or NULL_SPAN
+
+
+@contextmanager
+def span(name, **info):
+    """Time a step of the trace that's running, if there is one.
+
+    Yields the Span (or NULL_SPAN), so the caller can set its
+    ``outcome``. An exception sets it to the exception's class name.
+    """
+    parent = getattr(_local, 'span', None)
+    if parent is None:
+        yield NULL_SPAN
+        return
+    child = Span(name, **info)
+    parent.children.append(child)
+    _local.span = child
+    try:
+        yield child
+    except Exception as e:
+        child.outcome = e.__class__.__name__
+        raise
+    finally:
+        child.duration = time.time() - child.start
+        _local.span = parent
+
+
+@contextmanager
+def trace(name, **info):
+    """Trace a task or request, if it's picked for the sample.
+
+    Inside another trace, this is just a span.
+    """
+    if getattr(_local, 'span', None) is not None:
+        with span(name, **info) as step:
+            yield step
+        return
+    if random.random() >= settings.TRACE_SAMPLE_RATE:
+        yield NULL_SPAN
+        return
+    root = Span(name, **info)
+    _local.span = root
+    try:
+        yield root
+    except Exception as e:
+        root.outcome = e.__class__.__name__
+        raise
+    finally:
+        root.duration = time.time() - root.start
+        _local.span = None
+        emit(root)
+
+
+def traced(name):
+    """Decorator to run a function in a span named ``name``"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def emit(root):
+    """Send a finished trace to statsd, and the log if enabled"""
+    for path, step in root.walk():
+        statsd.timing('trace.' + path, int(step.duration * 1000))
+        if step.outcome != 'ok':
+            statsd.incr('trace.%s.%s' % (path, step.outcome))
+    if settings.TRACE_LOG:
+        log.info(json.dumps(root.as_dict()))
@@ -2,19 +2,24 @@ from django.conf.urls import patterns, url
 
 from .views import (confirm, custom_unsub_reason, custom_update_phonebook,
                     custom_update_student_ambassadors, debug_user,
-                    list_newsletters, lookup_user, newsletters,
-                    send_recovery_message, subscribe, subscribe_sms,
-                    unsubscribe, user)
+                    export_subscribers, list_newsletters, lookup_user,
+                    lookup_users, newsletters, readiness,
+                    send_recovery_message, subscribe, subscribe_bulk,
+                    subscribe_sms, unsubscribe, user)
 
 
 urlpatterns = patterns('',  # noqa
     url('^subscribe/$', subscribe),
+    url('^subscribe_bulk/$', subscribe_bulk, name='subscribe_bulk'),
     url('^subscribe_sms/$', subscribe_sms),
     url('^unsubscribe/(.*)/$', unsubscribe),
     url('^user/(.*)/$', user),
     url('^confirm/(.*)/$', confirm),
     url('^debug-user/$', debug_user),
     url('^lookup-user/$', lookup_user, name='lookup_user'),
+    url('^lookup-users/$', lookup_users, name='lookup_users'),
+    url('^export-subscribers/$', export_subscribers,
+        name='export_subscribers'),
     url('^recover/$', send_recovery_message, name='send_recovery_message'),
 
     url('^custom_unsub_reason/$', custom_unsub_reason),
@@ -23,5 +28,6 @@ urlpatterns = patterns('',  # noqa
     url('^custom_update_phonebook/(.*)/$', custom_update_phonebook),
 
     url('^newsletters/$', newsletters, name='newsletters_api'),
+    url('^readiness/$', readiness, name='readiness'),
     url('^$', list_newsletters),
 )
@@ -0,0 +1,257 @@
+"""
+Checking the parameters of the news API views.
+
+Each view's checks are declared once, as a Validator made of small
+checks::
+
+    check_subscribe_sms = Validator(
+        present('mobile_number', 'mobile_number is missing'),
+        us_mobile_number('mobile_number'),
+    )
+
+Calling a validator with the request's POST or GET data returns None if
+the data is fine, or (error body, HTTP status) for the first check that
+fails, ready for HttpResponseJSON. The errors have the same
+basket.errors codes the views have always returned.
+
+The work that doesn't depend on the request is done once: newsletter
+slugs and language codes are looked up in frozensets that are built when
+the newsletter data changes, regexes are compiled at import, and the
+answers for recently checked email addresses are remembered.
+"""
+import re
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+# Get error codes from basket-client so users see the same definitions
+from basket import errors
+
+from .newsletters import newsletter_languages, newsletter_slug_set
+from .responses import constant
+from .tasks import MSG_EMAIL_OR_TOKEN_REQUIRED
+
+
+NON_DIGITS_RE = re.compile(r'\D+')
+
+# How many email addresses to remember the answer for
+EMAIL_CACHE_SIZE = 10000
+_email_cache = {}
+
+# newsletter languages -> (lowercased codes, 2-letter prefixes)
+_language_sets = {}
+
+
+def error(desc, code, status=400):
+    """Return an error as validators do, with the body encoded once"""
+    return constant({
+        'status': 'error',
+        'desc': desc,
+        'code': code,
+    }), status
+
+
+INVALID_NEWSLETTER = error('invalid newsletter',
+                           errors.BASKET_INVALID_NEWSLETTER)
+INVALID_LANGUAGE = error('invalid language', errors.BASKET_INVALID_LANGUAGE)
+MOBILE_NOT_US = error('mobile_number must be a US number',
+                      errors.BASKET_USAGE_ERROR)
+
+
+def email_is_valid(email):
+    """Return True if ``email`` is a syntactically valid email address.
+    Answers are remembered for the last EMAIL_CACHE_SIZE or so
+    addresses."""
+    try:
+        return _email_cache[email]
+    except KeyError:
+        pass
+    try:
+        validate_email(email)
+        valid = True
+    except ValidationError:
+        valid = False
+    if len(_email_cache) >= EMAIL_CACHE_SIZE:
+        _email_cache.clear()
+    _email_cache[email] = valid
+    return valid
+
+
+def language_code_sets(langs):
+    """Return (codes, prefixes): frozensets of the lowercased language
+    codes in ``langs`` plus the empty string, and of their first two
+    letters. Worked out once for each set of languages."""
+    langs = frozenset(langs)
+    try:
+        return _language_sets[langs]
+    except KeyError:
+        pass
+    codes = frozenset([''] + [lang.lower() for lang in langs])
+    prefixes = frozenset(code[:2] for code in codes if code)
+    if len(_language_sets) > 10:
+        _language_sets.clear()
+    _language_sets[langs] = codes, prefixes
+    return codes, prefixes
+
+
+def language_code_is_valid(code):
+    """Return True if ``code`` is the empty string, or one of the language
+    codes associated with a newsletter.  Since language codes come in both
+    2-letter and 5-letter varieties ("en" and "en-US"), we consider codes
+    to also match if the 5-letter code starts with the 2-letter code.
+
+    Not case sensitive.
+
+    Raises TypeError if anything but a string is passed in.
+    """
+    if not isinstance(code, basestring):
+        raise TypeError("Language code must be a string")
+
+    codes, prefixes = language_code_sets(newsletter_languages())
+    code = code.lower()
+    # If the length is valid, consider 2-letter matches
+    return code in codes or (len(code) in (2, 5) and code[:2] in prefixes)
+
+
+def clean_mobile_number(number):
+    """Return ``number`` as the 11 digits of a US phone number starting
+    with 1, or None if it isn't one."""
+    mobile = NON_DIGITS_RE.sub('', number)
+    if len(mobile) == 10:
+        return '1' + mobile
+    if len(mobile) != 11 or mobile[0] != '1':
+        return None
+    return mobile
+
+
+class Validator(object):
+    """Runs checks on request data, in order, and returns the error from
+    the first that fails, or None."""
+
+    def __init__(self, *checks):
+        self.checks = checks
+
+    def __call__(self, data):
+        for check in self.checks:
+            invalid = check(data)
+            if invalid:
+                return invalid
+        return None
+
+
+## Checks. Each returns a function that takes the data and returns an
+## error or None.
+
+
+def present(fields, desc, code=errors.BASKET_USAGE_ERROR):
+    """All of the fields (a name or tuple of names) must be given"""
+    if isinstance(fields, basestring):
+        fields = (fields,)
+    invalid = error(desc, code)
+
+    def check(data):
+        for field in fields:
+            if field not in data:
+                return invalid
+    return check
+
+
+def required(field, desc, code=errors.BASKET_USAGE_ERROR):
+    """The field must be given and not be empty"""
+    invalid = error(desc, code)
+
+    def check(data):
+        if not data.get(field):
+            return invalid
+    return check
+
+
+def one_of(fields, desc, code=errors.BASKET_USAGE_ERROR):
+    """Exactly one of the fields must be given and not be empty"""
+    invalid = error(desc, code)
+
+    def check(data):
+        if sum(1 for field in fields if data.get(field)) != 1:
+            return invalid
+    return check
+
+
+def newsletters(field):
+    """If given, the field must be a comma-separated list of newsletter
+    slugs"""
+    def check(data):
+        value = data.get(field)
+        if value and not newsletter_slug_set().issuperset(
+                nl.strip() for nl in value.split(',')):
+            return INVALID_NEWSLETTER
+    return check
+
+
+def language(field):
+    """If given, the field must be a valid language code (see
+    language_code_is_valid)"""
+    def check(data):
+        if field in data and not language_code_is_valid(data[field]):
+            return INVALID_LANGUAGE
+    return check
+
+
+def email(field, desc):
+    """The field must be a valid email address, give or take whitespace
+    around it"""
+    invalid = error(desc, errors.BASKET_INVALID_EMAIL)
+
+    def check(data):
+        if not email_is_valid((data.get(field) or '').strip()):
+            return invalid
+    return check
+
+
+def us_mobile_number(field):
+    """If given, the field must be a US phone number"""
+    def check(data):
+        if field in data and clean_mobile_number(data[field]) is None:
+            return MOBILE_NOT_US
+    return check
+
+
+## The views' validators
+
+
+check_update_user = Validator(
+    newsletters('newsletters'),
+    language('lang'),
+)
+
+check_subscribe = Validator(
+    required('newsletters', 'newsletters is missing'),
+)
+
+check_subscribe_sms = Validator(
+    present('mobile_number', 'mobile_number is missing'),
+    us_mobile_number('mobile_number'),
+)
+
+check_send_recovery_message = Validator(
+    email('email', 'Using send_recovery_message, you need to pass a valid '
+                   'email in the `email` POST parameter'),
+)
+
+check_debug_user = Validator(
+    present(('email', 'supertoken'), 'Using debug_user, you need to pass '
+            'the `email` and `supertoken` GET parameters'),
+)
+
+check_custom_unsub_reason = Validator(
+    present(('token', 'reason'), 'custom_unsub_reason requires the `token` '
+            'and `reason` POST parameters'),
+)
+
+check_lookup_user = Validator(
+    one_of(('email', 'token'), MSG_EMAIL_OR_TOKEN_REQUIRED),
+)
+
+check_lookup_users = Validator(
+    one_of(('tokens', 'emails'), 'lookup_users needs a list of `tokens` '
+           'or of `emails`, but not both'),
+)
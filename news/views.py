@@ -1,10 +1,12 @@
 from functools import wraps
 import json
-import re
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import render
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
@@ -15,31 +17,136 @@ from basket import errors
 from .backends.common import NewsletterNoResultsException
 from .backends.exacttarget import (ExactTargetDataExt, NewsletterException,
                                    UnauthorizedException)
-from .forms import EmailForm
+from .export import ndjson, subscriber_rows
 from .models import APIUser, Newsletter, Subscriber
 from .tasks import (
     MSG_EMAIL_OR_TOKEN_REQUIRED, MSG_TOKEN_REQUIRED, MSG_USER_NOT_FOUND,
     SET, SUBSCRIBE, UNSUBSCRIBE,
     add_sms_user,
     confirm_user,
+    queue_update_user,
     send_recovery_message_task,
     update_custom_unsub,
     update_phonebook,
     update_student_ambassadors,
     update_user,
+    update_users_bulk,
+)
+from .newsletters import (newsletter_fields, newsletter_slug_set,
+                          newsletter_slugs, newsletters_api_body,
+                          slug_to_vendor_id)
+from .readiness import readiness as get_readiness
+from .responses import (OK, HttpResponseJSON, StreamingHttpResponse,
+                        constant, dumps)
+from .tracing import span, traced
+from .validation import (
+    check_custom_unsub_reason,
+    check_debug_user,
+    check_lookup_user,
+    check_lookup_users,
+    check_send_recovery_message,
+    check_subscribe,
+    check_subscribe_sms,
+    check_update_user,
+    clean_mobile_number,
+    email_is_valid,
+    language_code_is_valid,
 )
-from .newsletters import (newsletter_fields, newsletter_languages,
-                          newsletter_slugs, slug_to_vendor_id)
 
 
-## Utility functions
+## Responses that never change, encoded once
+
+
+TOKEN_REQUIRED = constant({
+    'status': 'error',
+    'desc': MSG_TOKEN_REQUIRED,
+    'code': errors.BASKET_USAGE_ERROR,
+})
+EMAIL_OR_TOKEN_REQUIRED = constant({
+    'status': 'error',
+    'desc': MSG_EMAIL_OR_TOKEN_REQUIRED,
+    'code': errors.BASKET_USAGE_ERROR,
+})
+UNKNOWN_TOKEN_DATA = {
+    'status': 'error',
+    'desc': MSG_USER_NOT_FOUND,
+    'code': errors.BASKET_UNKNOWN_TOKEN,
+}
+UNKNOWN_TOKEN = constant(UNKNOWN_TOKEN_DATA)
+UNKNOWN_EMAIL_DATA = {
+    'status': 'error',
+    'desc': MSG_USER_NOT_FOUND,
+    'code': errors.BASKET_UNKNOWN_EMAIL,
+}
+UNKNOWN_EMAIL = constant(UNKNOWN_EMAIL_DATA)
+EMAIL_NOT_KNOWN = constant({
+    'status': 'error',
+    'desc': 'Email address not known',
+    'code': errors.BASKET_UNKNOWN_EMAIL,
+})
+BAD_SUPERTOKEN = constant({
+    'status': 'error',
+    'desc': 'Bad supertoken',
+    'code': errors.BASKET_AUTH_ERROR,
+})
+BULK_SSL_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'subscribe_bulk always requires SSL',
+    'code': errors.BASKET_SSL_REQUIRED,
+})
+BULK_API_KEY_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'Using subscribe_bulk, you need to pass a '
+            'valid `api-key` GET parameter or X-api-key header',
+    'code': errors.BASKET_AUTH_ERROR,
+})
+BULK_BAD_BODY = constant({
+    'status': 'error',
+    'desc': 'Request body must be JSON with a list of `records`',
+    'code': errors.BASKET_USAGE_ERROR,
+})
+LOOKUP_USERS_SSL_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'lookup_users always requires SSL',
+    'code': errors.BASKET_SSL_REQUIRED,
+})
+LOOKUP_USERS_API_KEY_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'Using lookup_users, you need to pass a '
+            'valid `api-key` GET parameter or X-api-key header',
+    'code': errors.BASKET_AUTH_ERROR,
+})
+LOOKUP_USERS_BAD_BODY = constant({
+    'status': 'error',
+    'desc': 'Request body must be JSON with a list of `tokens` or of '
+            '`emails`, but not both',
+    'code': errors.BASKET_USAGE_ERROR,
+})
+EXPORT_SSL_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'export_subscribers always requires SSL',
+    'code': errors.BASKET_SSL_REQUIRED,
+})
+EXPORT_API_KEY_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'Using export_subscribers, you need to pass a '
+            'valid `api-key` GET parameter or X-api-key header',
+    'code': errors.BASKET_AUTH_ERROR,
+})
+LOOKUP_SSL_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'lookup_user always requires SSL',
+    'code': errors.BASKET_SSL_REQUIRED,
+})
+LOOKUP_API_KEY_REQUIRED = constant({
+    'status': 'error',
+    'desc': 'Using lookup_user with `email`, you need to pass a '
+            'valid `api-key` GET parameter or X-api-key header',
+    'code': errors.BASKET_AUTH_ERROR,
+})
 
 
-class HttpResponseJSON(HttpResponse):
-    def __init__(self, data, status=None):
-        super(HttpResponseJSON, self).__init__(content=json.dumps(data),
-                                               content_type='application/json',
-                                               status=status)
+## Utility functions
 
 
 def lookup_subscriber(token=None, email=None):
@@ -115,11 +222,7 @@ def logged_in(f):
         subscriber, subscriber_data, created = lookup_subscriber(token=token)
 
         if not subscriber:
-            return HttpResponseJSON({
-                'status': 'error',
-                'desc': MSG_TOKEN_REQUIRED,
-                'code': errors.BASKET_USAGE_ERROR,
-            }, 403)
+            return HttpResponseJSON(TOKEN_REQUIRED, 403)
 
         request.subscriber_data = subscriber_data
         request.subscriber = subscriber
@@ -127,64 +230,19 @@ def logged_in(f):
     return wrapper
 
 
-def language_code_is_valid(code):
-    """Return True if ``code`` is the empty string, or one of the language
-    codes associated with a newsletter.  Since language codes come in both
-    2-letter and 5-letter varieties ("en" and "en-US"), we consider codes
-    to also match if the 5-letter code starts with the 2-letter code.
-
-    Not case sensitive.
-
-    Raises TypeError if anything but a string is passed in.
-    """
-    if not isinstance(code, basestring):
-        raise TypeError("Language code must be a string")
-
-    # Accept empty string, or newsletter languages. Lowercase all the things.
-    langs = [''] + [lang.lower() for lang in newsletter_languages()]
-    code = code.lower()
-
-    if code in langs:
-        return True
-    elif len(code) in [2, 5]:
-        # If the length is valid, consider 2-letter matches
-        code2 = code[:2]
-        if any(code2 == lang[:2] for lang in langs):
-            return True
-    return False
-
-
 def update_user_task(request, type, data=None, optin=True):
     """Call the update_user task async with the right parameters"""
 
     sub = getattr(request, 'subscriber', None)
     data = data or request.POST.copy()
 
-    newsletters = data.get('newsletters', None)
-    if newsletters:
-        all_newsletters = newsletter_slugs()
-        for nl in [x.strip() for x in newsletters.split(',')]:
-            if nl not in all_newsletters:
-                return HttpResponseJSON({
-                    'status': 'error',
-                    'desc': 'invalid newsletter',
-                    'code': errors.BASKET_INVALID_NEWSLETTER,
-                }, 400)
-
-    if 'lang' in data and not language_code_is_valid(data['lang']):
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'invalid language',
-            'code': errors.BASKET_INVALID_LANGUAGE,
-        }, 400)
+    invalid = check_update_user(data)
+    if invalid:
+        return HttpResponseJSON(*invalid)
 
     email = data.get('email')
     if not (email or sub):
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': MSG_EMAIL_OR_TOKEN_REQUIRED,
-            'code': errors.BASKET_USAGE_ERROR,
-        }, 400)
+        return HttpResponseJSON(EMAIL_OR_TOKEN_REQUIRED, 400)
 
     created = False
     if not sub:
@@ -193,7 +251,7 @@ def update_user_task(request, type, data=None, optin=True):
         # checking ET first if need be.
         sub, user_data, created = lookup_subscriber(email=email)
 
-    update_user.delay(data, sub.email, sub.token, created, type, optin)
+    queue_update_user(data, sub.email, sub.token, created, type, optin)
     return HttpResponseJSON({
         'status': 'ok',
         'token': sub.token,
@@ -201,6 +259,20 @@ def update_user_task(request, type, data=None, optin=True):
     })
 
 
+def queue_et_write(task, *args):
+    """Queue a task that only writes to ET.
+
+    With settings.ET_OUTBOX on, the task runs now instead, which just
+    records its writes in the outbox, so the request doesn't depend on
+    the broker.
+    """
+    if settings.ET_OUTBOX:
+        with transaction.commit_on_success():
+            task(*args)
+    else:
+        task.delay(*args)
+
+
 def look_for_user(database, email, token, fields):
     """Try to get the user's data from the specified ET database.
     If found and the database is not the 'Confirmed' database,
@@ -212,15 +284,23 @@ def look_for_user(database, email, token, fields):
     """
     ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
                              settings.EXACTTARGET_PASS)
-    try:
-        user = ext.get_record(database,
-                              email or token,
-                              fields,
-                              'EMAIL_ADDRESS_' if email else 'TOKEN')
-    except NewsletterNoResultsException:
-        return None
+    with span('et.lookup.%s' % database) as step:
+        try:
+            user = ext.get_record(database,
+                                  email or token,
+                                  fields,
+                                  'EMAIL_ADDRESS_' if email else 'TOKEN')
+        except NewsletterNoResultsException:
+            step.outcome = 'missing'
+            return None
     if database == settings.EXACTTARGET_CONFIRMATION:
         return True
+    return et_record_to_user_data(user)
+
+
+def et_record_to_user_data(user):
+    """Turn a record from one of the ET user databases into a user data
+    dictionary (see get_user_data)."""
     newsletters = []
     for slug in newsletter_slugs():
         vendor_id = slug_to_vendor_id(slug)
@@ -240,6 +320,52 @@ def look_for_user(database, email, token, fields):
     return user_data
 
 
+def look_for_users(database, emails, tokens, fields):
+    """Like look_for_user, but for several users at once with one call
+    to ET. Returns a dictionary mapping each email (lowercased) or token
+    that was found to what look_for_user would return for it.
+    """
+    keys = emails or tokens
+    if not keys:
+        return {}
+    field = 'EMAIL_ADDRESS_' if emails else 'TOKEN'
+    ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
+                             settings.EXACTTARGET_PASS)
+    with span('et.lookup_many.%s' % database, count=len(keys)):
+        records = ext.get_records(database, keys, fields, field)
+    result = {}
+    for record in records:
+        # Field names from ET don't always come back in the same case
+        record = dict((name.upper(), value)
+                      for name, value in record.items())
+        key = record[field]
+        if emails:
+            key = key.lower()
+        if database == settings.EXACTTARGET_CONFIRMATION:
+            result[key] = True
+        else:
+            # Keep the first one, like get_record does
+            result.setdefault(key, et_record_to_user_data(record))
+    return result
+
+
+def user_data_fields():
+    """Return the list of fields to ask ET for in the user databases"""
+    fields = [
+        'EMAIL_ADDRESS_',
+        'EMAIL_FORMAT_',
+        'COUNTRY_',
+        'LANGUAGE_ISO2',
+        'TOKEN',
+        'CREATED_DATE_',
+    ]
+
+    for nl in newsletter_fields():
+        fields.append('%s_FLG' % nl)
+    return fields
+
+
+@traced('get_user_data')
 def get_user_data(token=None, email=None, sync_data=False):
     """Return a dictionary of the user's data from Exact Target.
     Look them up by their email if given, otherwise by the token.
@@ -288,19 +414,7 @@ def get_user_data(token=None, email=None, sync_data=False):
 
 
     """
-    newsletters = newsletter_fields()
-
-    fields = [
-        'EMAIL_ADDRESS_',
-        'EMAIL_FORMAT_',
-        'COUNTRY_',
-        'LANGUAGE_ISO2',
-        'TOKEN',
-        'CREATED_DATE_',
-    ]
-
-    for nl in newsletters:
-        fields.append('%s_FLG' % nl)
+    fields = user_data_fields()
 
     confirmed = True
     pending = False
@@ -360,6 +474,78 @@ def get_user_data(token=None, email=None, sync_data=False):
     return user_data
 
 
+@traced('get_users_data')
+def get_users_data(tokens=None, emails=None, sync_data=False):
+    """Like get_user_data, but for several users at once, looked up by
+    either their tokens or their emails.
+
+    Each ET database is asked about all the users with one call, so
+    this makes at most three calls to ET however many users there are.
+    Keep the number of users below ET's page size (2500).
+
+    Returns a dictionary mapping each token or email to what
+    get_user_data would return for it.
+    """
+    keys = list(tokens or emails or [])
+    if not keys:
+        return {}
+    fields = user_data_fields()
+
+    def normalize(key):
+        return key.lower() if emails else key
+
+    result = {}
+    try:
+        found = look_for_users(settings.EXACTTARGET_DATA,
+                               emails, tokens, fields)
+        for user_data in found.values():
+            user_data['confirmed'] = True
+            user_data['pending'] = False
+            user_data['master'] = True
+
+        missing = [key for key in keys if normalize(key) not in found]
+        if missing:
+            optin = look_for_users(settings.EXACTTARGET_OPTIN_STAGE,
+                                   missing if emails else None,
+                                   None if emails else missing,
+                                   fields)
+            # Ask the Confirmed database about all of them at once, by
+            # token since we have them now.
+            confirmed = look_for_users(settings.EXACTTARGET_CONFIRMATION,
+                                       None,
+                                       [u['token'] for u in optin.values()],
+                                       ['Token'])
+            for user_data in optin.values():
+                user_data['confirmed'] = user_data['token'] in confirmed
+                user_data['pending'] = False
+                user_data['master'] = False
+            found.update(optin)
+    except NewsletterException as e:
+        error = {
+            'status': 'error',
+            'status_code': 400,
+            'desc': str(e),
+            'code': errors.BASKET_NETWORK_FAILURE,
+        }
+        return dict((key, dict(error)) for key in keys)
+    except UnauthorizedException as e:
+        error = {
+            'status': 'error',
+            'status_code': 500,
+            'desc': 'Email service provider auth failure',
+            'code': errors.BASKET_EMAIL_PROVIDER_AUTH_FAILURE,
+        }
+        return dict((key, dict(error)) for key in keys)
+
+    for key in keys:
+        user_data = found.get(normalize(key))
+        result[key] = user_data
+        if user_data and sync_data:
+            Subscriber.objects.get_and_sync(user_data['email'],
+                                            user_data['token'])
+    return result
+
+
 def get_user(token=None, email=None, sync_data=False):
     user_data = get_user_data(token, email, sync_data)
     status_code = user_data.pop('status_code', 200) if user_data else 400
@@ -375,19 +561,15 @@ def get_user(token=None, email=None, sync_data=False):
 def confirm(request, token):
     confirm_user.delay(request.subscriber.token,
                        request.subscriber_data)
-    return HttpResponseJSON({'status': 'ok'})
+    return HttpResponseJSON(OK)
 
 
 @require_POST
 @csrf_exempt
 def subscribe(request):
-    newsletters = request.POST.get('newsletters', None)
-    if not newsletters:
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'newsletters is missing',
-            'code': errors.BASKET_USAGE_ERROR,
-        }, 400)
+    invalid = check_subscribe(request.POST)
+    if invalid:
+        return HttpResponseJSON(*invalid)
 
     optin = request.POST.get('optin', 'Y') == 'Y'
     return update_user_task(request, SUBSCRIBE, optin=optin)
@@ -395,30 +577,222 @@ def subscribe(request):
 
 @require_POST
 @csrf_exempt
-def subscribe_sms(request):
-    if 'mobile_number' not in request.POST:
+def subscribe_bulk(request):
+    """
+    Subscribe many users to newsletters with one request.
+
+    SSL and a valid API key are required. The request body is JSON::
+
+        {"records": [{"email": "...", "newsletters": "slug1,slug2",
+                      "lang": "en", "format": "H", "country": "us"}, ...]}
+
+    ``newsletters`` may also be a list of slugs. Records are validated
+    against the newsletter data, basket Subscriber records are found or
+    created for them, and the valid ones are queued to be sent to ET in
+    chunks. The response has a result for each record, in order, that
+    looks like the response from ``subscribe`` for that record.
+    """
+    if not request.is_secure():
+        return HttpResponseJSON(BULK_SSL_REQUIRED, 401)
+
+    api_key = request.GET.get('api-key', None) or\
+        request.META.get('HTTP_X_API_KEY', None)
+    if not APIUser.is_valid(api_key):
+        return HttpResponseJSON(BULK_API_KEY_REQUIRED, 401)
+
+    try:
+        records = json.loads(request.body)['records']
+        if not isinstance(records, list):
+            raise ValueError
+    except (ValueError, TypeError, KeyError):
+        return HttpResponseJSON(BULK_BAD_BODY, 400)
+
+    if len(records) > settings.BULK_SUBSCRIBE_MAX_RECORDS:
         return HttpResponseJSON({
             'status': 'error',
-            'desc': 'mobile_number is missing',
+            'desc': 'No more than %d records per request' %
+                    settings.BULK_SUBSCRIBE_MAX_RECORDS,
             'code': errors.BASKET_USAGE_ERROR,
         }, 400)
 
+    results, users = validate_bulk_records(records)
+    subscribers, created = lookup_subscribers(
+        [user['email'] for user in users])
+
+    # Each subscriber's records, so that a subscriber who's in the
+    # request more than once has all their records in the same chunk,
+    # where update_users_bulk merges them
+    tokens = []
+    queue = {}
+    for user in users:
+        email = user['email']
+        sub = subscribers.get(email)
+        if sub is None:
+            results[user['index']] = {
+                'status': 'error',
+                'desc': 'Unable to look up user',
+                'code': errors.BASKET_NETWORK_FAILURE,
+            }
+            continue
+        results[user['index']] = {
+            'status': 'ok',
+            'token': sub.token,
+            'created': email in created,
+        }
+        if sub.token not in queue:
+            tokens.append(sub.token)
+            queue[sub.token] = []
+        queue[sub.token].append({
+            'email': sub.email,
+            'token': sub.token,
+            'data': update_user.slim_data(user['data']),
+        })
+
+    chunk_size = settings.BULK_SUBSCRIBE_CHUNK_SIZE
+    for i in range(0, len(tokens), chunk_size):
+        update_users_bulk.delay([record for token in tokens[i:i + chunk_size]
+                                 for record in queue[token]])
+
+    return HttpResponseJSON({
+        'status': 'ok',
+        'results': results,
+    })
+
+
+def validate_bulk_records(records):
+    """
+    Check the records passed to subscribe_bulk.
+
+    Returns (results, users). ``results`` has an entry for each record,
+    which is an error dictionary for the invalid ones and None for the
+    rest. ``users`` has a dictionary with the 'index', 'email' and
+    'data' (for update_user) of each valid record.
+    """
+    all_newsletters = newsletter_slug_set()
+    results = [None] * len(records)
+    users = []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            results[index] = {
+                'status': 'error',
+                'desc': 'Each record must be an object',
+                'code': errors.BASKET_USAGE_ERROR,
+            }
+            continue
+
+        email = record.get('email') or ''
+        if not email_is_valid(email):
+            results[index] = {
+                'status': 'error',
+                'desc': 'invalid email',
+                'code': errors.BASKET_INVALID_EMAIL,
+            }
+            continue
+
+        newsletters = record.get('newsletters') or []
+        if isinstance(newsletters, basestring):
+            newsletters = newsletters.split(',')
+        newsletters = [nl.strip() for nl in newsletters]
+        if not newsletters:
+            results[index] = {
+                'status': 'error',
+                'desc': 'newsletters is missing',
+                'code': errors.BASKET_USAGE_ERROR,
+            }
+            continue
+        if not all_newsletters.issuperset(newsletters):
+            results[index] = {
+                'status': 'error',
+                'desc': 'invalid newsletter',
+                'code': errors.BASKET_INVALID_NEWSLETTER,
+            }
+            continue
+
+        lang = record.get('lang')
+        if lang is not None and not (isinstance(lang, basestring) and
+                                     language_code_is_valid(lang)):
+            results[index] = {
+                'status': 'error',
+                'desc': 'invalid language',
+                'code': errors.BASKET_INVALID_LANGUAGE,
+            }
+            continue
+
+        data = {'newsletters': ','.join(newsletters)}
+        for field in ('lang', 'format', 'country', 'source_url',
+                      'trigger_welcome'):
+            if record.get(field) is not None:
+                data[field] = record[field]
+        users.append({'index': index, 'email': email, 'data': data})
+    return results, users
+
+
+def lookup_subscribers(emails):
+    """
+    Find or create Subscriber objects for many emails at once, like
+    lookup_subscriber does for one.
+
+    Emails we don't have are looked up in ET together, and new
+    Subscriber records are created for them all at once.
+
+    Returns (subscribers, created): a dictionary mapping each email to
+    its Subscriber, and the set of emails we created Subscribers for.
+    Emails whose lookup in ET failed are left out. Emails are matched
+    without regard to case, as the database and ET do.
+    """
+    found = dict((sub.email.lower(), sub) for sub in
+                 Subscriber.objects.filter(email__in=emails))
+    missing = dict((email.lower(), email) for email in emails
+                   if email.lower() not in found)
+    created = set()
+    if missing:
+        # Check with ET to see if our DB is just out of sync
+        new_subs = []
+        for email, user_data in get_users_data(
+                emails=missing.values()).items():
+            if user_data and user_data['status'] == 'error':
+                continue
+            if user_data:
+                new_subs.append(Subscriber(email=email,
+                                           token=user_data['token']))
+            else:
+                new_subs.append(Subscriber(email=email))
+            created.add(email.lower())
+        try:
+            Subscriber.objects.bulk_create(new_subs)
+        except IntegrityError:
+            # Someone else created some of them since we checked, so
+            # play it safe and do them one at a time.
+            for sub in new_subs:
+                sub, sub_created = Subscriber.objects.get_or_create(
+                    email=sub.email, defaults={'token': sub.token})
+                if not sub_created:
+                    created.discard(sub.email.lower())
+                found[sub.email.lower()] = sub
+        else:
+            for sub in new_subs:
+                found[sub.email.lower()] = sub
+
+    subscribers = dict((email, found[email.lower()]) for email in emails
+                       if email.lower() in found)
+    return subscribers, set(email for email in emails
+                            if email.lower() in created)
+
+
+@require_POST
+@csrf_exempt
+def subscribe_sms(request):
+    invalid = check_subscribe_sms(request.POST)
+    if invalid:
+        return HttpResponseJSON(*invalid)
+
     msg_name = request.POST.get('msg_name', 'SMS_Android')
-    mobile = request.POST['mobile_number']
-    mobile = re.sub(r'\D+', '', mobile)
-    if len(mobile) == 10:
-        mobile = '1' + mobile
-    elif len(mobile) != 11 or mobile[0] != '1':
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'mobile_number must be a US number',
-            'code': errors.BASKET_USAGE_ERROR,
-        }, 400)
+    mobile = clean_mobile_number(request.POST['mobile_number'])
 
     optin = request.POST.get('optin', 'N') == 'Y'
 
     add_sms_user.delay(msg_name, mobile, optin)
-    return HttpResponseJSON({'status': 'ok'})
+    return HttpResponseJSON(OK)
 
 
 @require_POST
@@ -458,41 +832,25 @@ def send_recovery_message(request):
     If email not known, returns 404.
     Otherwise, queues a task to send the message and returns 200.
     """
-    form = EmailForm(request.POST)
-    if not form.is_valid():
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'Using send_recovery_message, you need to pass a valid '
-                    'email in the `email` POST parameter',
-            'code': errors.BASKET_INVALID_EMAIL,
-        }, 400)
-    email = form.cleaned_data['email']
+    invalid = check_send_recovery_message(request.POST)
+    if invalid:
+        return HttpResponseJSON(*invalid)
+    email = request.POST['email'].strip()
     user_data = get_user_data(email=email, sync_data=True)
     if not user_data:
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'Email address not known',
-            'code': errors.BASKET_UNKNOWN_EMAIL,
-        }, 404)  # Note: Bedrock looks for this 404
+        return HttpResponseJSON(EMAIL_NOT_KNOWN, 404)  # Note: Bedrock looks for this 404
     send_recovery_message_task.delay(email)
-    return HttpResponseJSON({'status': 'ok'})
+    return HttpResponseJSON(OK)
 
 
 @never_cache
 def debug_user(request):
-    if not 'email' in request.GET or not 'supertoken' in request.GET:
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'Using debug_user, you need to pass the '
-                    '`email` and `supertoken` GET parameters',
-            'code': errors.BASKET_USAGE_ERROR,
-        }, 400)
+    invalid = check_debug_user(request.GET)
+    if invalid:
+        return HttpResponseJSON(*invalid)
 
     if request.GET['supertoken'] != settings.SUPERTOKEN:
-        return HttpResponseJSON({'status': 'error',
-                                 'desc': 'Bad supertoken',
-                                 'code': errors.BASKET_AUTH_ERROR},
-                                401)
+        return HttpResponseJSON(BAD_SUPERTOKEN, 401)
 
     email = request.GET['email']
     user_data = get_user_data(email=email)
@@ -515,16 +873,13 @@ def custom_unsub_reason(request):
     """Update the reason field for the user, which logs why the user
     unsubscribed from all newsletters."""
 
-    if not 'token' in request.POST or not 'reason' in request.POST:
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'custom_unsub_reason requires the `token` '
-                    'and `reason` POST parameters',
-            'code': errors.BASKET_USAGE_ERROR,
-        }, 400)
+    invalid = check_custom_unsub_reason(request.POST)
+    if invalid:
+        return HttpResponseJSON(*invalid)
 
-    update_custom_unsub.delay(request.POST['token'], request.POST['reason'])
-    return HttpResponseJSON({'status': 'ok'})
+    queue_et_write(update_custom_unsub, request.POST['token'],
+                   request.POST['reason'])
+    return HttpResponseJSON(OK)
 
 
 @require_POST
@@ -532,9 +887,9 @@ def custom_unsub_reason(request):
 @csrf_exempt
 def custom_update_student_ambassadors(request, token):
     sub = request.subscriber
-    update_student_ambassadors.delay(dict(request.POST.items()), sub.email,
-                                     sub.token)
-    return HttpResponseJSON({'status': 'ok'})
+    queue_et_write(update_student_ambassadors, dict(request.POST.items()),
+                   sub.email, sub.token)
+    return HttpResponseJSON(OK)
 
 
 @require_POST
@@ -542,28 +897,60 @@ def custom_update_student_ambassadors(request, token):
 @csrf_exempt
 def custom_update_phonebook(request, token):
     sub = request.subscriber
-    update_phonebook.delay(dict(request.POST.items()), sub.email, sub.token)
-    return HttpResponseJSON({'status': 'ok'})
+    queue_et_write(update_phonebook, dict(request.POST.items()), sub.email,
+                   sub.token)
+    return HttpResponseJSON(OK)
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip, going by its
+    q-values (so not for ``gzip;q=0``)"""
+    qvalues = {}
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[params[0].strip().lower()] = q
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return False
 
 
 # Get data about current newsletters
 @require_GET
 @cache_control(max_age=300)
 def newsletters(request):
-    # Get the newsletters as a dictionary of dictionaries that are
-    # easily jsonified
-
-    result = {}
-    for newsletter in Newsletter.objects.all().values():
-        newsletter['languages'] = newsletter['languages'].split(",")
-        result[newsletter['slug']] = newsletter
-        del newsletter['id']  # caller doesn't need to know our pkey
-        del newsletter['slug']  # or our slug
+    """
+    Return the newsletters as a dictionary of dictionaries.
 
-    return HttpResponseJSON({
-        'status': 'ok',
-        'newsletters': result,
-    })
+    The response is rendered once whenever the newsletter data changes,
+    so it doesn't touch the database. Clients that send back the ETag in
+    If-None-Match get a 304, and clients that accept gzip get it gzipped.
+    """
+    api = newsletters_api_body()
+    use_gzip = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    # Each representation needs its own strong validator
+    etag = api['etag'] + ('-gzip' if use_gzip else '')
+
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in etags or '*' in etags:
+        response = HttpResponseNotModified()
+    elif use_gzip:
+        response = HttpResponse(api['gzip_body'],
+                                content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(api['body'], content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
 
 
 @never_cache
@@ -607,11 +994,7 @@ def lookup_user(request):
     """
 
     if not request.is_secure():
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': 'lookup_user always requires SSL',
-            'code': errors.BASKET_SSL_REQUIRED,
-        }, 401)
+        return HttpResponseJSON(LOOKUP_SSL_REQUIRED, 401)
 
     token = request.GET.get('token', None)
     email = request.GET.get('email', None)
@@ -621,37 +1004,160 @@ def lookup_user(request):
     api_key = request.GET.get('api-key', None) or\
         request.META.get('HTTP_X_API_KEY', None)
 
-    if (not email and not token) or (email and token):
-        return HttpResponseJSON({
-            'status': 'error',
-            'desc': MSG_EMAIL_OR_TOKEN_REQUIRED,
-            'code': errors.BASKET_USAGE_ERROR,
-        }, 400)
+    invalid = check_lookup_user(request.GET)
+    if invalid:
+        return HttpResponseJSON(*invalid)
 
     if email and not APIUser.is_valid(api_key):
-            return HttpResponseJSON({
-                'status': 'error',
-                'desc': 'Using lookup_user with `email`, you need to pass a '
-                        'valid `api-key` GET parameter or X-api-key header',
-                'code': errors.BASKET_AUTH_ERROR,
-            }, 401)
+        return HttpResponseJSON(LOOKUP_API_KEY_REQUIRED, 401)
 
     status_code = 200
     user_data = get_user_data(token=token, email=email)
     if not user_data:
-        code = errors.BASKET_UNKNOWN_TOKEN if token else errors.BASKET_UNKNOWN_EMAIL
-        user_data = {
-            'status': 'error',
-            'desc': MSG_USER_NOT_FOUND,
-            'code': code,
-        }
-        status_code = 404
+        return HttpResponseJSON(UNKNOWN_TOKEN if token else UNKNOWN_EMAIL,
+                                404)
     elif user_data['status'] == 'error':
         status_code = 400
 
     return HttpResponseJSON(user_data, status_code)
 
 
+@require_POST
+@csrf_exempt
+@never_cache
+def lookup_users(request):
+    """
+    Look up many users in Exact Target at once, by token or by email.
+
+    SSL and a valid API key (as for lookup_user) are always required.
+    The request body is JSON, with either a list of tokens or a list of
+    emails, but not both::
+
+        {"tokens": ["...", ...]}
+        {"emails": ["...", ...]}
+
+    The users are looked up with get_users_data, in chunks of
+    settings.BULK_LOOKUP_CHUNK_SIZE, and the response is sent as each
+    chunk is done::
+
+        {"status": "ok", "results": {"<token or email>": {...}, ...}}
+
+    Each result is what lookup_user would return for that token or email,
+    with the HTTP status it would have returned in 'status_code'. Users
+    who aren't found get a 404 with the BASKET_UNKNOWN_TOKEN or
+    BASKET_UNKNOWN_EMAIL code.
+    """
+    if not request.is_secure():
+        return HttpResponseJSON(LOOKUP_USERS_SSL_REQUIRED, 401)
+
+    api_key = request.GET.get('api-key', None) or\
+        request.META.get('HTTP_X_API_KEY', None)
+    if not APIUser.is_valid(api_key):
+        return HttpResponseJSON(LOOKUP_USERS_API_KEY_REQUIRED, 401)
+
+    try:
+        body = json.loads(request.body)
+        if check_lookup_users(body):
+            raise ValueError
+        by_email = bool(body.get('emails'))
+        keys = body['emails' if by_email else 'tokens']
+        if not (isinstance(keys, list) and
+                all(isinstance(key, basestring) for key in keys)):
+            raise ValueError
+    except (ValueError, TypeError, AttributeError, KeyError):
+        return HttpResponseJSON(LOOKUP_USERS_BAD_BODY, 400)
+
+    if len(keys) > settings.BULK_LOOKUP_MAX_KEYS:
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'No more than %d tokens or emails per request' %
+                    settings.BULK_LOOKUP_MAX_KEYS,
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    # Without duplicates, in order
+    seen = set()
+    keys = [key for key in keys if not (key in seen or seen.add(key))]
+    return StreamingHttpResponse(_lookup_users_body(keys, by_email),
+                                 content_type='application/json')
+
+
+def _lookup_users_body(keys, by_email):
+    """Yield the body of a lookup_users response, a chunk of users at a
+    time"""
+    not_found = dumps(dict(UNKNOWN_EMAIL_DATA if by_email
+                           else UNKNOWN_TOKEN_DATA, status_code=404))
+    chunk_size = settings.BULK_LOOKUP_CHUNK_SIZE
+    yield '{"status": "ok", "results": {'
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        if by_email:
+            users = get_users_data(emails=chunk)
+        else:
+            users = get_users_data(tokens=chunk)
+        parts = []
+        for key in chunk:
+            user_data = users.get(key)
+            if not user_data:
+                result = not_found
+            else:
+                if 'status_code' not in user_data:
+                    user_data['status_code'] = \
+                        400 if user_data['status'] == 'error' else 200
+                result = dumps(user_data)
+            parts.append('%s: %s' % (dumps(key), result))
+        yield (', ' if start else '') + ', '.join(parts)
+    yield '}}'
+
+
+@require_GET
+@never_cache
+def export_subscribers(request):
+    """
+    Stream the email and token of every Subscriber, as newline-delimited
+    JSON in order of email (see news.export).
+
+    SSL and a valid API key (as for lookup_user) are always required.
+
+    Optional GET parameters:
+
+    ``after``: only export the subscribers whose emails sort after this
+    one. To carry on with an export that was cut off, pass the email on
+    the last line you got.
+
+    ``pending=Y``: also say on each line whether the subscriber is still
+    waiting to be promoted from Opt-in to Master.
+    """
+    if not request.is_secure():
+        return HttpResponseJSON(EXPORT_SSL_REQUIRED, 401)
+
+    api_key = request.GET.get('api-key', None) or\
+        request.META.get('HTTP_X_API_KEY', None)
+    if not APIUser.is_valid(api_key):
+        return HttpResponseJSON(EXPORT_API_KEY_REQUIRED, 401)
+
+    rows = subscriber_rows(after=request.GET.get('after') or None,
+                           with_pending=request.GET.get('pending') == 'Y')
+    return StreamingHttpResponse(ndjson(rows),
+                                 content_type='application/x-ndjson')
+
+
+@require_GET
+@never_cache
+def readiness(request):
+    """
+    Whether this node's dependencies are answering in time, for the load
+    balancer: 200 if so, 503 if not.
+
+    Reports what ``./manage.py readiness_probes`` last found (see
+    news.readiness), and only checks things itself when there's nothing
+    in the cache from it.
+    """
+    ready, state = get_readiness()
+    state['status'] = 'ok' if ready else 'error'
+    return HttpResponseJSON(state, 200 if ready else 503)
+
+
 def list_newsletters(request):
     """
     Public web page listing currently active newsletters.
@@ -17,7 +17,12 @@ else:
             raise
 
 
-CACHES['bad_message_ids'] = {
-    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    'TIMEOUT': 12 * 60 * 60,  # 12 hours
-}
+# Message IDs we know are bad (or good) in ET. Shared by all the workers,
+# so each bad ID only has to fail once, so it uses the default cache backend.
+CACHES.setdefault('message_ids', dict(CACHES['default'],
+                                      TIMEOUT=12 * 60 * 60))  # 12 hours
+
+# Which ET steps tasks have done, so retries can skip them. This must be
+# shared by all the Celery workers, so it uses the default cache backend.
+CACHES.setdefault('task_steps', dict(CACHES['default'],
+                                     TIMEOUT=24 * 60 * 60))  # 1 day
@@ -60,6 +60,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 
 MIDDLEWARE_CLASSES = (
     'django.middleware.common.CommonMiddleware',
+    'news.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -68,6 +69,24 @@ MIDDLEWARE_CLASSES = (
     'django_statsd.middleware.GraphiteMiddleware',
 )
 
+# The middleware for requests under API_PATH_PREFIX, which don't need
+# sessions, users, messages or CSRF checks (see news/handlers.py). None
+# to use MIDDLEWARE_CLASSES for everything.
+API_PATH_PREFIX = '/news/'
+API_MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'news.middleware.RateLimitMiddleware',
+    'news.middleware.GraphiteViewHitCountMiddleware',
+)
+
+# Whether wsgi/basket.wsgi validates the models like runserver does.
+# Always done when DEBUG is on.
+WSGI_VALIDATE_MODELS = False
+# Whether wsgi/basket.wsgi imports the views and tasks, builds the
+# ExactTarget client and loads the newsletters before the first request
+# (see news/startup.py).
+WSGI_WARM_UP = True
+
 ROOT_URLCONF = 'urls'
 
 TEMPLATE_DIRS = (
@@ -115,6 +134,192 @@ BROKER_VHOST = 'basket'
 CELERY_DISABLE_RATE_LIMITS = True
 CELERY_IGNORE_RESULT = True
 
+# Tasks someone is waiting on (e.g. for a confirmation email) go on their
+# own queue so they don't wait behind back-office updates and bulk jobs.
+# Run separate workers for each, e.g.:
+#   ./manage.py celeryd -Q basket_interactive -c 8
+#   ./manage.py celeryd -Q basket_backoffice,celery -c 2
+# The back-office queue can be paused during ET incidents with
+#   ./manage.py pause_queue basket_backoffice
+# and stays paused until it's resumed, or for QUEUE_PAUSE_TIMEOUT seconds
+# (memcached keeps things for at most 30 days).
+QUEUE_PAUSE_TIMEOUT = 30 * 24 * 60 * 60
+CELERY_DEFAULT_QUEUE = 'celery'
+CELERY_QUEUES = {
+    'celery': {'exchange': 'celery', 'routing_key': 'celery'},
+    'basket_interactive': {'exchange': 'basket_interactive',
+                           'routing_key': 'basket_interactive'},
+    'basket_backoffice': {'exchange': 'basket_backoffice',
+                          'routing_key': 'basket_backoffice'},
+}
+CELERY_ROUTES = {
+    'news.tasks.update_user': {'queue': 'basket_interactive'},
+    'news.tasks.update_user_merged': {'queue': 'basket_interactive'},
+    'news.tasks.flush_user_updates': {'queue': 'basket_interactive'},
+    'news.tasks.confirm_user': {'queue': 'basket_interactive'},
+    'news.tasks.send_recovery_message_task': {'queue': 'basket_interactive'},
+    'news.tasks.add_sms_user': {'queue': 'basket_interactive'},
+    'news.tasks.update_phonebook': {'queue': 'basket_backoffice'},
+    'news.tasks.update_student_ambassadors': {'queue': 'basket_backoffice'},
+    'news.tasks.update_custom_unsub': {'queue': 'basket_backoffice'},
+    'news.tasks.update_users_bulk': {'queue': 'basket_backoffice'},
+    'news.tasks.retry_failed_tasks_task': {'queue': 'basket_backoffice'},
+    'news.tasks.validate_message_ids': {'queue': 'basket_backoffice'},
+}
+# Seconds a task may wait on each queue before its first attempt before
+# it counts as a miss (statsd: queue.<queue>.slo_miss)
+CELERY_QUEUE_SLO = {
+    'basket_interactive': 10,
+    'basket_backoffice': 15 * 60,
+}
+
+# Serializer for ET task messages, or None for CELERY_TASK_SERIALIZER.
+# 'msgpack' is smaller and faster, but needs the msgpack package on the
+# web heads and the workers.
+ET_TASK_SERIALIZER = None
+# Gzip messages of the ET tasks that can have big ones (like
+# update_users_bulk) when they're bigger than this many bytes (0 for never)
+ET_TASK_COMPRESS_OVER = 4 * 1024
+# Fraction of ET task messages to measure for the payload_bytes metric.
+# Each one measured is encoded an extra time.
+ET_PAYLOAD_SIZE_SAMPLE_RATE = 0.01
+
+# Record ET writes and sends in the outbox table instead of making them
+# straight away, and have ./manage.py drain_outbox send them in batches.
+ET_OUTBOX = False
+# Most outbox entries to read at a time
+ET_OUTBOX_BATCH_SIZE = 200
+# Seconds the drainer waits when the outbox is empty or ET has problems
+ET_OUTBOX_POLL_INTERVAL = 5
+# Failed attempts after which an entry is left for someone to look at
+ET_OUTBOX_MAX_ATTEMPTS = 10
+# Days to keep sent entries
+ET_OUTBOX_KEEP_DAYS = 7
+
+# Record users who confirm so ./manage.py promote_confirmed_users can
+# copy them from Opt-in to Master ahead of ET's nightly job. Only turn
+# this on where the command runs from cron.
+PROMOTE_CONFIRMED_USERS = False
+# Most users to promote with each read from and write to ET
+PROMOTION_BATCH_SIZE = 500
+# Seconds a confirmed user can be missing from Opt-in before
+# promote_confirmed_users stops trying to promote them
+PROMOTION_MISSING_MAX_AGE = 2 * 24 * 60 * 60
+
+# Seconds during which the same welcome isn't sent to the same user
+# again (0 to always send). Needs a cache shared by the workers.
+SEND_DEDUPE_WINDOW = 10 * 60
+
+# Fraction of ET tasks to trace step by step (see news/tracing.py), and
+# whether to log each trace as a line of JSON as well as sending it to
+# statsd.
+TRACE_SAMPLE_RATE = 0.01
+TRACE_LOG = False
+
+# How ET tasks retry each kind of error: the delay before retry N is
+# random between 0 and min(cap, base * 2 ** N) seconds.
+ET_RETRY_POLICIES = {
+    'default': {'base': 60, 'cap': 30 * 60, 'max_retries': 6},
+    'timeout': {'base': 30, 'cap': 15 * 60, 'max_retries': 8},
+    'throttled': {'base': 5 * 60, 'cap': 60 * 60, 'max_retries': 8},
+    # Usually needs someone to fix the credentials
+    'auth': {'base': 15 * 60, 'cap': 60 * 60, 'max_retries': 3},
+}
+# After this many ET failures in ET_CIRCUIT_WINDOW seconds, hold all
+# retries until ET_CIRCUIT_OPEN_TIME seconds have passed.
+ET_CIRCUIT_THRESHOLD = 50
+ET_CIRCUIT_WINDOW = 60
+ET_CIRCUIT_OPEN_TIME = 2 * 60
+
+# If set, hold update_user calls for this many seconds and apply all the
+# calls for the same user in that window together. Needs a cache that's
+# shared between the web heads and the Celery workers.
+UPDATE_USER_COALESCE_WINDOW = 0
+
+# Most records accepted by one /news/subscribe_bulk/ request, and how
+# many users' records to send to ET in each task.
+BULK_SUBSCRIBE_MAX_RECORDS = 1000
+BULK_SUBSCRIBE_CHUNK_SIZE = 100
+
+# Most tokens or emails accepted by one /news/lookup-users/ request, and
+# how many of them to look up in ET at a time (ET's page size is 2500).
+BULK_LOOKUP_MAX_KEYS = 5000
+BULK_LOOKUP_CHUNK_SIZE = 500
+
+# Subscribers to read at a time when exporting them
+SUBSCRIBER_EXPORT_CHUNK_SIZE = 5000
+
+# Seconds each process keeps the enabled API keys before reading them
+# again (they're read again straight away when an APIUser changes), and
+# how often to add up the uses of each key in the database.
+API_KEY_CACHE_TTL = 60
+API_KEY_USAGE_FLUSH_INTERVAL = 60
+
+# How often each client may call the news API views that cost ET calls:
+# view name -> (requests per IP, requests per API key, seconds). See
+# news.middleware.RateLimitMiddleware. Needs a cache shared by the web
+# heads. For example:
+# RATE_LIMITS = {
+#     'lookup_user': (60, 6000, 60),
+#     'send_recovery_message': (10, 600, 60),
+#     'subscribe': (60, 6000, 60),
+#     'user': (60, 6000, 60),
+# }
+RATE_LIMITS = {}
+# Where to find the client's IP address, e.g. 'HTTP_X_CLUSTER_CLIENT_IP'
+# behind a load balancer
+RATE_LIMIT_IP_HEADER = 'REMOTE_ADDR'
+
+# Encode API responses with ujson, if it's installed (see news/responses.py)
+FAST_JSON = True
+
+# How many failed tasks to retry at a time, and the most to queue per
+# second (0 for no limit). See ./manage.py retry_failed_tasks.
+FAILED_TASK_RETRY_CHUNK_SIZE = 500
+FAILED_TASK_RETRY_RATE = 200
+
+# Each worker process saves its FailedTasks together, when it has this
+# many or the oldest is this many seconds old (0 to save each at once).
+# Until then they're kept in a spool file in FAILED_TASK_SPOOL_DIR, which
+# should be on local disk and writable by the workers.
+FAILED_TASK_BUFFER_SIZE = 50
+FAILED_TASK_FLUSH_INTERVAL = 30
+FAILED_TASK_SPOOL_DIR = path('tmp', 'failed_tasks')
+
+# ./manage.py readiness_probes checks ET, the broker, the database and
+# the cache this often (seconds) for the /news/readiness/ view, which
+# says the node isn't ready (503) when a probe failed, took longer than
+# its budget here (seconds), or hasn't run for READINESS_MAX_AGE. The
+# command and the web processes must share a cache (e.g. memcached, not
+# the default LocMemCache); a process that finds no results runs the
+# probes itself, so with LocMemCache each one does that every
+# READINESS_MAX_AGE * 2 seconds instead.
+READINESS_INTERVAL = 15
+READINESS_MAX_AGE = 60
+READINESS_BUDGETS = {
+    'exacttarget': 5,
+    'broker': 1,
+    'db': 0.5,
+    'cache': 0.2,
+}
+# Token of a user in EXACTTARGET_DATA for the ET probe to look up. The
+# ET probe is skipped when this is None.
+READINESS_CANARY_TOKEN = None
+# Each node's broker probe sends a message through its own queue, named
+# this plus the node's name. The node's name is READINESS_NODE, or its
+# hostname when that's None.
+READINESS_QUEUE = 'basket_readiness'
+READINESS_NODE = None
+
+# Whether the celery worker loads the app before starting its pool, so
+# the pool processes share it (see news/preload.py).
+CELERY_PRELOAD = True
+# The garbage collector thresholds for processes that preloaded. The
+# third is how many young collections there are to each full one, which
+# is what unshares the preloaded memory (Python's default is 10). None
+# to leave them alone.
+PRELOAD_GC_THRESHOLD = (700, 10, 100)
+
 import djcelery
 djcelery.setup_loader()
 
@@ -147,6 +352,13 @@ LOGGING = {
             'formatter': 'verbose'
         }
     },
+    'loggers': {
+        'news.startup': {
+            'level': 'INFO',
+            'handlers': ['console'],
+            'propagate': True,
+        },
+    },
 }
 
 TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'